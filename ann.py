@@ -0,0 +1,175 @@
+import os
+import hashlib
+import numpy as np
+from scoring import VECTOR_FEATURES, combined_similarity, feature_vectors, top_k
+
+ANN_INDEX_FILE = "ann_index.npz"
+
+# Residual vectors used to train each product-quantizer codebook
+PQ_TRAINING_SAMPLE = 20000
+
+# Below this many tracks a linear scan is already fast and exact
+ANN_MIN_TRACKS = 20000
+
+
+def kmeans(vectors, n_clusters, n_iter=10, seed=0, sample_size=100000):
+    """Lloyd's k-means on a random sample, returns (n_clusters, D) centroids"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        counts = np.bincount(labels, minlength=n_clusters)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters with random points
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+def assign(vectors, centroids, chunk_size=65536):
+    """Index of the nearest centroid of every vector"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return labels
+
+
+def catalog_checksum(catalog):
+    """Digest of the track names and features an index was built from"""
+    digest = hashlib.sha256("\n".join(catalog.names).encode())
+    for key in VECTOR_FEATURES:
+        digest.update(np.ascontiguousarray(getattr(catalog, key)).tobytes())
+    return digest.hexdigest()
+
+
+class IVFPQIndex:
+    """
+    Inverted-file index with product quantization over the catalog's feature vectors.
+    Vectors are clustered into inverted lists; a query scans only the `nprobe`
+    nearest lists, scoring their entries from compact PQ codes with per-query
+    lookup tables, and the best candidates are re-ranked exactly. `nprobe` is
+    the recall/latency knob: more lists probed means higher recall and more work.
+    """
+
+    def __init__(self, n_lists=None, n_subvectors=13, n_codes=256, seed=0):
+        self.n_lists = n_lists
+        self.n_subvectors = n_subvectors
+        self.n_codes = n_codes
+        self.seed = seed
+        self.checksum = None
+
+    def build(self, vectors, checksum=None):
+        """Train the coarse and product quantizers and encode all vectors"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if dim % self.n_subvectors:
+            raise ValueError(f"Vector size {dim} is not divisible into {self.n_subvectors} subvectors")
+        n_lists = self.n_lists or max(1, int(4 * np.sqrt(n)))
+        self.checksum = checksum
+
+        self.centroids = kmeans(vectors, n_lists, seed=self.seed)
+        labels = assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[labels]
+
+        sub_dim = dim // self.n_subvectors
+        self.codebooks = np.stack([
+            kmeans(residuals[:, m * sub_dim:(m + 1) * sub_dim], self.n_codes, seed=self.seed + m + 1,
+                   sample_size=PQ_TRAINING_SAMPLE)
+            if len(residuals) >= self.n_codes else
+            np.resize(residuals[:, m * sub_dim:(m + 1) * sub_dim], (self.n_codes, sub_dim))
+            for m in range(self.n_subvectors)
+        ])
+        codes = np.stack([assign(residuals[:, m * sub_dim:(m + 1) * sub_dim], self.codebooks[m])
+                          for m in range(self.n_subvectors)], axis=1).astype(np.uint8)
+
+        # Inverted lists stored contiguously, ordered by list
+        order = np.argsort(labels, kind='stable')
+        self.ids = order.astype(np.int64)
+        self.codes = codes[order]
+        self.list_starts = np.searchsorted(labels[order], np.arange(len(self.centroids) + 1))
+        return self
+
+    def search(self, query_vector, k, nprobe=16, mask=None):
+        """Approximate top-k ids by PQ distance (smallest first); mask limits the eligible ids"""
+        query_vector = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        nprobe = min(nprobe, len(self.centroids))
+        coarse = ((self.centroids - query_vector) ** 2).sum(axis=1)
+        lists = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+        sub_dim = len(query_vector) // self.n_subvectors
+        ids, distances = [], []
+        for lst in lists:
+            start, end = self.list_starts[lst], self.list_starts[lst + 1]
+            if start == end:
+                continue
+            list_ids = self.ids[start:end]
+            list_codes = self.codes[start:end]
+            if mask is not None:
+                keep = mask[list_ids]
+                list_ids, list_codes = list_ids[keep], list_codes[keep]
+            # Distance lookup table of the query residual against every codebook entry
+            residual = (query_vector - self.centroids[lst]).reshape(self.n_subvectors, 1, sub_dim)
+            table = ((self.codebooks - residual) ** 2).sum(axis=2)
+            ids.append(list_ids)
+            distances.append(table[np.arange(self.n_subvectors), list_codes].sum(axis=1))
+
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        ids = np.concatenate(ids)
+        distances = np.concatenate(distances)
+        return ids[top_k(-distances, k)]
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, codebooks=self.codebooks, ids=self.ids, codes=self.codes,
+                 list_starts=self.list_starts, checksum=np.array(self.checksum or ""))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(n_lists=len(data['centroids']), n_subvectors=data['codebooks'].shape[0],
+                        n_codes=data['codebooks'].shape[1])
+            index.centroids = data['centroids']
+            index.codebooks = data['codebooks']
+            index.ids = data['ids']
+            index.codes = data['codes']
+            index.list_starts = data['list_starts']
+            index.checksum = str(data['checksum']) or None
+        return index
+
+
+def catalog_vectors(catalog):
+    return feature_vectors({key: getattr(catalog, key) for key in VECTOR_FEATURES})
+
+
+def build_catalog_index(catalog, **params):
+    return IVFPQIndex(**params).build(catalog_vectors(catalog), catalog_checksum(catalog))
+
+
+def search_catalog(query_features, catalog, index=None, rows=None, k=100, nprobe=16, rerank=10, exact=False):
+    """
+    Top-k catalog rows for one query (stacked features), best first, as (rows, scores).
+    Candidates come from the ANN index and are re-ranked with the exact combined
+    score; exact=True (or no index) scores every row instead, for verification.
+    """
+    if rows is None:
+        rows = np.arange(len(catalog.names))
+    if exact or index is None:
+        scores = combined_similarity(query_features, catalog, rows)[0]
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    mask = np.zeros(len(catalog.names), dtype=bool)
+    mask[rows] = True
+    candidates = index.search(feature_vectors(query_features)[0], k * rerank, nprobe=nprobe, mask=mask)
+    scores = combined_similarity(query_features, catalog, candidates)[0]
+    best = top_k(scores, k)
+    return candidates[best], scores[best]
@@ -1,150 +1,286 @@
 # Import necessary libraries
 import os
 import librosa
-import librosa.display
 import numpy as np
-import matplotlib.pyplot as plt
-from imagehash import phash
-from PIL import Image
 import json
-import hashlib
-from statistics import mean
-from scipy.spatial.distance import cosine
+from functools import cached_property
+from scoring import top_k, feature_vectors, stack_features
+from binary_hash import from_hex, hamming_distance, lsh_codes, to_hex
+import fingerprint
+import spectrograms
+from timing import span
+from audio_io import load_audio
 
-# Function to generate and save spectrograms
+# Function to generate and save spectrograms (for viewing only; hashes come from spectrogram_thumbnail)
 def generate_spectrogram(audio_path, output_path):
-    y, sr = librosa.load(audio_path, duration=30)  # Load first 30 seconds of audio
-    
-    plt.figure(figsize=(10, 4))
-    S = librosa.feature.melspectrogram(y=y, sr=sr)
-    S_dB = librosa.power_to_db(S, ref=np.max)
-    librosa.display.specshow(S_dB, sr=sr, x_axis='time', y_axis='mel')
-    plt.colorbar(format='%+2.0f dB')
-    plt.title('Mel-frequency spectrogram')
-    plt.tight_layout()
-    
-    plt.savefig(output_path)
-    plt.close()
+    spectrograms.render_png(audio_path, output_path, duration=30)
+
+# Audio read past the feature window so its last frames match a full decode
+FEATURE_MARGIN_SECONDS = 0.5
+# Mel bands of the mean power spectrum used to decompose blends (see blend.py)
+BLEND_BANDS = 64
+
+# Shared single-pass analysis of one decoded signal
+class AudioAnalysis:
+    """
+    Decode an audio signal once and derive every feature and hash from it.
+    The STFT is computed a single time over the whole signal; the features use
+    the frames of the first `feature_duration` seconds, the landmarks use all frames.
+    """
+
+    def __init__(self, y, sr=22050, feature_duration=30, n_fft=2048, hop_length=512, stft=None):
+        self.y = np.asarray(y, dtype=np.float32)
+        self.sr = sr
+        self.feature_duration = feature_duration
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        if stft is not None:
+            self.stft = stft
+        self._features = {}
+
+    @classmethod
+    def from_file(cls, audio_path, sr=22050, feature_duration=30, features_only=False):
+        """
+        Decode a file for analysis. With features_only, only the feature window
+        (plus a margin covering its last STFT frames and the resampler's edge) is
+        read, which gives the same features() but nothing past the window.
+        """
+        duration = feature_duration + FEATURE_MARGIN_SECONDS if features_only else None
+        with span("decode"):
+            y, sr = load_audio(audio_path, sr=sr, duration=duration)
+        return cls(y, sr=sr, feature_duration=feature_duration)
+
+    @classmethod
+    def mix(cls, analysis1, analysis2, ratio1, ratio2):
+        """
+        Analysis of the weighted mix of two analyzed signals.
+        The STFT is linear, so the mix's STFT is the weighted sum of the two
+        existing ones and no new transform is needed. The signals are cut to the
+        shorter one, so only its last frame or two differ from a fresh STFT.
+        """
+        if (analysis1.sr, analysis1.n_fft, analysis1.hop_length) != (analysis2.sr, analysis2.n_fft, analysis2.hop_length):
+            raise ValueError("Both analyses must use the same sample rate and STFT parameters")
+        n_samples = min(len(analysis1.y), len(analysis2.y))
+        n_frames = 1 + n_samples // analysis1.hop_length
+        y = ratio1 * analysis1.y[:n_samples] + ratio2 * analysis2.y[:n_samples]
+        stft = ratio1 * analysis1.stft[:, :n_frames] + ratio2 * analysis2.stft[:, :n_frames]
+        return cls(y, sr=analysis1.sr, feature_duration=analysis1.feature_duration,
+                   n_fft=analysis1.n_fft, hop_length=analysis1.hop_length, stft=stft)
+
+    @cached_property
+    def stft(self):
+        with span("stft"):
+            return librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length)
+
+    @cached_property
+    def magnitude(self):
+        return np.abs(self.stft)
+
+    @cached_property
+    def power(self):
+        return self.magnitude ** 2
+
+    @cached_property
+    def n_feature_frames(self):
+        # Same frame count librosa gives for the signal cut to feature_duration
+        # (known without computing the STFT, so batch_features can group analyses first)
+        n_samples = min(len(self.y), int(self.feature_duration * self.sr))
+        n_frames = self.stft.shape[1] if 'stft' in self.__dict__ else 1 + len(self.y) // self.hop_length
+        return min(n_frames, 1 + n_samples // self.hop_length)
+
+    def _mel_db(self, power):
+        mel = librosa.feature.melspectrogram(S=power, sr=self.sr)
+        return librosa.power_to_db(mel)
+
+    def features(self, n_mfcc=20):
+        """Features of the first `feature_duration` seconds (see extract_features)"""
+        if n_mfcc not in self._features:
+            with span("features"):
+                self._features[n_mfcc] = self._compute_features(n_mfcc)
+        return self._features[n_mfcc]
+
+    @cached_property
+    def feature_mel_db(self):
+        """Mel spectrogram (dB) of the feature window, shared by the MFCCs and the spectrogram hash"""
+        return self._mel_db(self.power[:, :self.n_feature_frames])
+
+    def _compute_features(self, n_mfcc):
+        n = self.n_feature_frames
+        magnitude = self.magnitude[:, :n]
+        power = self.power[:, :n]
+        # spectral_bandwidth would otherwise compute the same centroid again
+        centroid = librosa.feature.spectral_centroid(S=magnitude, sr=self.sr)
+        return {
+            "spectral_centroid": float(np.mean(centroid)),
+            "spectral_bandwidth": float(np.mean(librosa.feature.spectral_bandwidth(S=magnitude, sr=self.sr,
+                                                                                   centroid=centroid))),
+            "mfcc": np.mean(librosa.feature.mfcc(S=self.feature_mel_db, n_mfcc=n_mfcc), axis=1).tolist(),
+            "chroma": np.mean(librosa.feature.chroma_stft(S=power, sr=self.sr), axis=1).tolist(),
+            "spectral_contrast": np.mean(librosa.feature.spectral_contrast(S=magnitude, sr=self.sr), axis=1).tolist(),
+            # Linear power, so the spectrum of a mix is close to the weighted sum of its tracks' spectra
+            "mel_power": np.mean(librosa.feature.melspectrogram(S=power, sr=self.sr, n_mels=BLEND_BANDS), axis=1).tolist(),
+        }
+
+    def hashes(self):
+        """Locality-sensitive hash of the features, compared bit by bit (see hash_features)"""
+        features = self.features()
+        with span("hash"):
+            return {'lsh_hash': to_hex(lsh_codes(feature_vectors(stack_features([features])))[0])}
+
+    def landmarks(self):
+        """Constellation peak-pair fingerprints of the whole signal as (keys, offsets)"""
+        magnitude = self.magnitude
+        with span("landmarks"):
+            return fingerprint.landmarks(magnitude)
+
+    def spectrogram_thumbnail(self):
+        """Mel spectrogram of the feature window as a small grey image, input of the perceptual hash"""
+        mel_db = self.feature_mel_db
+        with span("spectrogram"):
+            return spectrograms.thumbnail(mel_db)
+
+    def summary(self, n_mfcc=20):
+        """Everything the catalog stores about a track: features, hashes, landmarks and spectrogram thumbnail"""
+        return {
+            "features": self.features(n_mfcc),
+            "hash": self.hashes(),
+            "landmarks": self.landmarks(),
+            "spectrogram": self.spectrogram_thumbnail(),
+        }
 
 # Function to extract features from audio
 def extract_features(audio_path):
-    y, sr = librosa.load(audio_path, duration=30)
-    features = {
-        "spectral_centroid": np.mean(librosa.feature.spectral_centroid(y=y, sr=sr)),
-        "spectral_bandwidth": np.mean(librosa.feature.spectral_bandwidth(y=y, sr=sr)),
-        "mfcc": np.mean(librosa.feature.mfcc(y=y, sr=sr), axis=1).tolist(),
-        "chroma": np.mean(librosa.feature.chroma_stft(y=y, sr=sr), axis=1).tolist(),
-        "spectral_contrast": np.mean(librosa.feature.spectral_contrast(y=y, sr=sr), axis=1).tolist(),
-    }
+    return AudioAnalysis.from_file(audio_path, features_only=True).features()
+
+# Clips whose feature windows are stacked into one batch by extract_features_batch
+FEATURE_BATCH_SIZE = 8
+
+# Function to compute the feature-window magnitudes of several analyses as one (B, F, T) stack
+def _window_magnitudes(analyses, n_frames):
+    first = analyses[0]
+    window = {}
+    pending = [analysis for analysis in analyses if 'stft' not in analysis.__dict__]
+    if pending:
+        # The last feature frame is centred n_fft // 2 samples before the end of this span;
+        # zero padding past a signal's end is the same padding a single STFT applies
+        n_samples = (n_frames - 1) * first.hop_length + first.n_fft // 2
+        stacked = np.zeros((len(pending), n_samples), dtype=np.float32)
+        for row, analysis in zip(stacked, pending):
+            y = analysis.y[:n_samples]
+            row[:len(y)] = y
+        with span("stft"):
+            stft = librosa.stft(stacked, n_fft=first.n_fft, hop_length=first.hop_length)
+        window = {id(analysis): np.abs(stft[i, :, :n_frames]) for i, analysis in enumerate(pending)}
+    return np.stack([window[id(analysis)] if id(analysis) in window else analysis.magnitude[:, :n_frames]
+                     for analysis in analyses])
+
+# Function to compute the features of a (B, F, T) magnitude stack, as AudioAnalysis._compute_features does for one,
+# and the (B, n_mels, T) mel spectrograms (dB) they were computed from
+def _stacked_features(magnitude, sr, n_mfcc):
+    power = magnitude ** 2
+
+    # Filter bank projections are stacked: one filter bank and one matrix product per batch
+    mel_power = librosa.feature.melspectrogram(S=power, sr=sr, n_mels=BLEND_BANDS)
+    # power_to_db clips at 80 dB below the maximum of its whole input, so the clip is applied per track
+    mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr), top_db=None)
+    mel_db = np.maximum(mel_db, mel_db.max(axis=(1, 2), keepdims=True) - 80.0)
+    mfcc = librosa.feature.mfcc(S=mel_db, n_mfcc=n_mfcc)
+
+    # Elementwise statistics run per track: stacked they gain nothing and spill out of cache.
+    # spectral_contrast also converts to dB against the maximum of its whole input.
+    centroid = [librosa.feature.spectral_centroid(S=track, sr=sr) for track in magnitude]
+    bandwidth = [librosa.feature.spectral_bandwidth(S=track, sr=sr, centroid=track_centroid)
+                 for track, track_centroid in zip(magnitude, centroid)]
+    contrast = [librosa.feature.spectral_contrast(S=track, sr=sr) for track in magnitude]
+
+    # chroma_stft estimates the tuning over its whole input: estimate it per track,
+    # then project the tracks of each tuning together
+    tunings = [librosa.estimate_tuning(S=track, sr=sr, bins_per_octave=12) for track in power]
+    chroma = [None] * len(magnitude)
+    for tuning in set(tunings):
+        rows = [i for i, track_tuning in enumerate(tunings) if track_tuning == tuning]
+        # Kept in librosa's memory layout, which decides the summation order of the means
+        for row, track_chroma in zip(rows, librosa.feature.chroma_stft(S=power[rows], sr=sr, tuning=tuning)):
+            chroma[row] = track_chroma
+
+    features = [{
+        "spectral_centroid": float(np.mean(centroid[i])),
+        "spectral_bandwidth": float(np.mean(bandwidth[i])),
+        "mfcc": np.mean(mfcc[i], axis=1).tolist(),
+        "chroma": np.mean(chroma[i], axis=1).tolist(),
+        "spectral_contrast": np.mean(contrast[i], axis=1).tolist(),
+        "mel_power": np.mean(mel_power[i], axis=1).tolist(),
+    } for i in range(len(magnitude))]
+    return features, mel_db
+
+# Function to compute the features of several analyses at once
+def batch_features(analyses, n_mfcc=20):
+    """
+    Features of several analyses, identical to calling features() on each, but
+    computed on stacked (B, F, T) arrays: one STFT, one filter bank and one
+    projection per batch instead of per track. Analyses with the same sample
+    rate, STFT parameters and feature window length (every catalog track of 30 s
+    or more) are stacked together. Results (and the feature-window mel
+    spectrogram) are stored on the analyses as well.
+    """
+    groups = {}
+    for analysis in analyses:
+        if n_mfcc not in analysis._features:
+            key = (analysis.sr, analysis.n_fft, analysis.hop_length, analysis.n_feature_frames)
+            groups.setdefault(key, []).append(analysis)
+    for (sr, _, _, n_frames), group in groups.items():
+        magnitude = _window_magnitudes(group, n_frames)
+        with span("features"):
+            features, mel_db = _stacked_features(magnitude, sr, n_mfcc)
+        for analysis, track_features, track_mel_db in zip(group, features, mel_db):
+            analysis._features[n_mfcc] = track_features
+            # Shared with the spectrogram thumbnail, as features() shares it
+            analysis.__dict__.setdefault('feature_mel_db', track_mel_db)
+    return [analysis.features(n_mfcc) for analysis in analyses]
+
+# Function to extract features from several audio files or signals
+def extract_features_batch(sources, sr=22050, feature_duration=30, n_mfcc=20, batch_size=FEATURE_BATCH_SIZE):
+    """
+    Features of each source, the same as extract_features gives for a file.
+    Sources are file paths or mono signals already at sr; they are processed
+    batch_size at a time to bound the memory of the stacked spectrograms.
+    """
+    features = []
+    for start in range(0, len(sources), batch_size):
+        analyses = [AudioAnalysis.from_file(source, sr=sr, feature_duration=feature_duration, features_only=True)
+                    if isinstance(source, (str, os.PathLike))
+                    else AudioAnalysis(source, sr=sr, feature_duration=feature_duration)
+                    for source in sources[start:start + batch_size]]
+        features += batch_features(analyses, n_mfcc)
     return features
 
-# Function to hash spectrogram image
+# Function to hash a spectrogram image file (same result as imagehash.phash)
 def hash_spectrogram(image_path):
-    return str(phash(Image.open(image_path)))
+    from PIL import Image
+    size = spectrograms.THUMBNAIL_SIZE
+    image = Image.open(image_path).convert('L').resize((size, size), Image.LANCZOS)
+    return spectrograms.phashes(np.asarray(image))[0]
 
 # Function to compute a perceptual hash of features
 def hash_features(audio_path, sr=22050):
-    y, sr = librosa.load(audio_path, sr=sr)
-    # Extract key features for hashing
-    hash_dict = {}
-    
-    # 1. MFCC-based hash
-    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-    mfcc_mean = mfccs.mean(axis=1)
-    mfcc_string = ''.join([str(int(abs(x) * 1000)) for x in mfcc_mean])
-    hash_dict['mfcc_hash'] = hashlib.sha256(mfcc_string.encode()).hexdigest()
-    
-    # 2. Chroma-based hash
-    chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-    chroma_mean = chroma.mean(axis=1)
-    chroma_string = ''.join([str(int(x * 1000)) for x in chroma_mean])
-    hash_dict['chroma_hash'] = hashlib.sha256(chroma_string.encode()).hexdigest()
-    
-    # 3. Energy-based hash
-    rmse = librosa.feature.rms(y=y)[0]
-    energy_string = ''.join([str(int(x * 1000)) for x in rmse[:100]])  # Use first 100 frames
-    hash_dict['energy_hash'] = hashlib.sha256(energy_string.encode()).hexdigest()
-    
-    # 4. Compact hash (32-bit) combining multiple features
-    compact_features = [
-        int(mean(mfcc_mean) * 1000),
-        int(mean(chroma_mean) * 1000),
-        int(mean(rmse) * 1000),
-        int(librosa.feature.zero_crossing_rate(y).mean() * 1000)
-    ]
-    compact_string = ''.join([str(x % 256) for x in compact_features])
-    hash_dict['compact_hash'] = format(int(hashlib.md5(compact_string.encode()).hexdigest(), 16) % (2**32), '08x')
-    
-    return hash_dict
-
-# Function to calculate similarity between hashes
+    return AudioAnalysis.from_file(audio_path, sr=sr).hashes()
+
+# Function to calculate similarity between hashes (share of equal bits)
 def calculate_similarity(hash1, hash2):
-    hash1_array = np.frombuffer(bytes.fromhex(hash1), dtype=np.uint8)
-    hash2_array = np.frombuffer(bytes.fromhex(hash2), dtype=np.uint8)
-    return 1 - cosine(hash1_array, hash2_array)
+    code1 = from_hex(hash1)
+    code2 = from_hex(hash2)
+    return 1 - hamming_distance(code1, code2[None, :])[0, 0] / (64 * len(code1))
 
 # Function to search for similar songs
 def search_similar_songs(query_hash, hash_database, top_n=1):
-    similarities = []
-    for entry in hash_database:
-        similarity = calculate_similarity(query_hash, entry["hash"])
-        similarities.append((similarity, entry["song_name"]))
-
-    similarities.sort(reverse=True, key=lambda x: x[0])
-    return similarities[:top_n]
-
-# # Main processing script
-# def process_songs(input_folder, output_folder):
-#     if not os.path.exists(output_folder):
-#         os.makedirs(output_folder)
-    
-#     spectrogram_folder = os.path.join(output_folder, "spectrograms")
-#     os.makedirs(spectrogram_folder, exist_ok=True)
-    
-#     all_features = []
-#     all_hashes = []
-#     feature_hashes = []
-
-#     for file_name in os.listdir(input_folder):
-#         if file_name.endswith(".wav") or file_name.endswith(".mp3"):
-#             audio_path = os.path.join(input_folder, file_name)
-            
-#             # Generate spectrogram
-#             spectrogram_path = os.path.join(spectrogram_folder, file_name.rsplit(".", 1)[0] + ".png")
-#             generate_spectrogram(audio_path, spectrogram_path)
-            
-#             # Extract features
-#             features = extract_features(audio_path)
-#             song_name = file_name.split("_", 1)[-1].rsplit(".", 1)[0]  # Remove team number and file extension
-            
-#             all_features.append({"song_name": song_name, "features": features})
-            
-#             # Hash spectrogram
-#             spectrogram_hash = hash_spectrogram(spectrogram_path)
-#             all_hashes.append({"song_name": song_name, "hash": spectrogram_hash})
-
-#             # Hash features
-#             feature_hash = hash_features(features)
-#             feature_hashes.append({"song_name": song_name, "hash": feature_hash})
-#             print(f"Processed {file_name}: Spectrogram Hash = {spectrogram_hash}, Feature Hash = {feature_hash}")
-    
-#     # Save all features to a single JSON file
-#     all_features_path = os.path.join(output_folder, "all_features.json")
-#     with open(all_features_path, "w") as f:
-#         json.dump(all_features, f, indent=4)
-    
-#     # Save all spectrogram hashes to a single JSON file
-#     all_hashes_path = os.path.join(output_folder, "all_hashes.json")
-#     with open(all_hashes_path, "w") as f:
-#         json.dump(all_hashes, f, indent=4)
-
-#     # Save all feature hashes to a single JSON file
-#     feature_hashes_path = os.path.join(output_folder, "feature_hashes.json")
-#     with open(feature_hashes_path, "w") as f:
-#         json.dump(feature_hashes, f, indent=4)
-
-# # Define input and output folders
-# input_folder = "Music"  
-# output_folder = "output"
-
-# process_songs(input_folder, output_folder)
+    if not hash_database:
+        return []
+    query_code = from_hex(query_hash)
+    codes = np.array([from_hex(entry["hash"]) for entry in hash_database])
+
+    # Hamming similarity against all entries at once
+    similarities = 1 - hamming_distance(query_code, codes)[0] / (64 * len(query_code))
+
+    return [(similarities[i], hash_database[i]["song_name"]) for i in top_k(similarities, top_n)]
+
+# The catalog is built by ingest.py
@@ -0,0 +1,354 @@
+import os
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import contextlib
+import numpy as np
+import soundfile as sf
+from audioProcessor import AudioAnalysis
+from ann import build_catalog_index, search_catalog
+from binary_hash import from_hex
+from catalog import Catalog, get_file_type, route_target_type
+from ingest import Ingest
+from scoring import (
+    HASH_SHARE, FEATURE_SHARE, feature_similarity_pair, hash_similarity, hash_similarity_pair, stack_features, top_k
+)
+
+SR = 22050
+MANIFEST_FILE = "manifest.json"
+QUERY_KINDS = ("clip", "noisy", "mix")
+ENGINES = ("baseline", "features", "ann", "lsh", "landmarks")
+
+
+# Function to convert MIDI note numbers to frequencies
+def midi_to_hz(note):
+    return 440.0 * 2 ** ((np.asarray(note) - 69) / 12)
+
+
+def _tone(freq, n_samples, sr, n_harmonics, vibrato=0.0):
+    """Harmonic tone with 1/h partials and optional 5 Hz vibrato"""
+    t = np.arange(n_samples) / sr
+    phase = 2 * np.pi * freq * (t + vibrato * np.sin(2 * np.pi * 5 * t) / (2 * np.pi * 5))
+    return sum(np.sin(h * phase) / h for h in range(1, n_harmonics + 1))
+
+
+def synthesize_song(rng, duration, sr=SR):
+    """Vocal and music stems of one synthetic song: a chord progression with drums and a melody over it"""
+    n = int(duration * sr)
+    beat = int(sr * 60 / rng.uniform(80, 140))
+    root = rng.integers(45, 57)
+    scale = np.array([0, 2, 4, 5, 7, 9, 11])
+    progression = rng.choice(7, 4)
+    decay = np.exp(-np.arange(beat) / (0.4 * beat))
+
+    music = np.zeros(n, dtype=np.float32)
+    for bar, start in enumerate(range(0, n, 4 * beat)):
+        degree = progression[bar % 4]
+        chord = root + scale[[degree, (degree + 2) % 7, (degree + 4) % 7]]
+        length = min(4 * beat, n - start)
+        music[start:start + length] += sum(_tone(f, length, sr, 4) for f in midi_to_hz(chord)) / 3
+    # Drums: a noise burst on every beat
+    hit = rng.standard_normal(beat) * np.exp(-np.arange(beat) / (0.03 * sr))
+    for start in range(0, n, beat):
+        length = min(beat, n - start)
+        music[start:start + length] *= 0.6 + 0.4 * decay[:length]
+        music[start:start + length] += 0.3 * hit[:length]
+
+    vocals = np.zeros(n, dtype=np.float32)
+    note_length = beat // 2
+    envelope = np.minimum(1, np.arange(note_length) / (0.05 * sr)) * np.exp(-np.arange(note_length) / note_length)
+    for start in range(0, n, note_length):
+        if rng.random() < 0.2:
+            continue  # rest
+        length = min(note_length, n - start)
+        note = root + 12 + scale[rng.integers(7)] + 12 * rng.integers(2)
+        vocals[start:start + length] += _tone(midi_to_hz(note), length, sr, 8, vibrato=0.01) * envelope[:length]
+
+    return 0.5 * vocals / np.abs(vocals).max(), 0.5 * music / np.abs(music).max()
+
+
+def synthesize_catalog(folder, n_songs, duration, seed):
+    """
+    Write vocals, music and original (their sum) files for every song.
+    The catalog is reused when it was generated with the same parameters.
+    """
+    params = {"n_songs": n_songs, "duration": duration, "seed": seed, "sr": SR}
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            if json.load(f) == params:
+                return
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+    rng = np.random.default_rng(seed)
+    for i in range(n_songs):
+        vocals, music = synthesize_song(rng, duration)
+        for kind, y in (("vocals", vocals), ("music", music), ("original", 0.6 * (vocals + music))):
+            sf.write(os.path.join(folder, f"Song{i:05d}_{kind}.wav"), y, SR, subtype="PCM_16")
+    with open(manifest_path, "w") as f:
+        json.dump(params, f)
+
+
+def make_queries(folder, n_songs, n_queries, clip_seconds, snr_db, seed):
+    """
+    Query signals and the track each should find. Every sampled song gives a
+    truncated clip, the same clip with white noise at snr_db, and a vocals/music
+    blend like the one the GUI mixes, all expected to find the song's original.
+    """
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in rng.choice(n_songs, min(n_queries, n_songs), replace=False):
+        original = f"Song{i:05d}_original.wav"
+        y, _ = sf.read(os.path.join(folder, original), dtype="float32")
+        clip_length = min(int(clip_seconds * SR), len(y))
+        start = rng.integers(len(y) - clip_length + 1)
+        clip = y[start:start + clip_length]
+        noise = rng.standard_normal(clip_length).astype(np.float32)
+        noise *= np.sqrt(np.mean(clip ** 2) / np.mean(noise ** 2) / 10 ** (snr_db / 10))
+
+        stems = [f"Song{i:05d}_vocals.wav", f"Song{i:05d}_music.wav"]
+        vocals, music = (sf.read(os.path.join(folder, stem), dtype="float32")[0] for stem in stems)
+        ratio = rng.uniform(0.3, 0.7)
+
+        queries.append({"kind": "clip", "expected": original, "types": ("original", "original"), "y": clip})
+        queries.append({"kind": "noisy", "expected": original, "types": ("original", "original"),
+                        "y": clip + noise})
+        queries.append({"kind": "mix", "expected": original, "types": (get_file_type(stems[0]), get_file_type(stems[1])),
+                        "stems": (vocals, music), "ratios": (ratio, 1 - ratio)})
+    return queries
+
+
+def analyze_query(query):
+    """Summary of a query signal; blends are mixed from the analyzed stems as in the GUI"""
+    if query["kind"] == "mix":
+        analyses = [AudioAnalysis(y, sr=SR) for y in query["stems"]]
+        for analysis in analyses:
+            analysis.stft
+        start = time.perf_counter()
+        summary = AudioAnalysis.mix(*analyses, *query["ratios"]).summary()
+    else:
+        start = time.perf_counter()
+        summary = AudioAnalysis(query["y"], sr=SR).summary()
+    return summary, time.perf_counter() - start
+
+
+class Engines:
+    """The search paths under test, each returning the k best song names for a query summary"""
+
+    def __init__(self, output_folder, nprobe):
+        self.catalog = Catalog(output_folder)
+        self.catalog.load()
+        start = time.perf_counter()
+        self.ann_index = build_catalog_index(self.catalog)
+        self.ann_build_seconds = time.perf_counter() - start
+        self.nprobe = nprobe
+        self.landmark_index = self.catalog.landmark_index()
+        # Per-track dicts as the JSON databases held them, for the baseline's pairwise scan
+        self.entries = [(self.catalog.names[i], self.catalog.types[i], self.catalog.entry_features(i),
+                         self.catalog.entry_hashes(i)) for i in range(len(self.catalog))]
+
+    def baseline(self, summary, target_type, k):
+        """The original search: every track of the target type scored pair by pair, then sorted"""
+        similarities = []
+        for song_name, track_type, features, hashes in self.entries:
+            if track_type == target_type:
+                similarity = (FEATURE_SHARE * feature_similarity_pair(summary["features"], features)
+                              + HASH_SHARE * hash_similarity_pair(summary["hash"], hashes))
+                similarities.append((similarity, song_name))
+        similarities.sort(reverse=True)
+        return [song_name for _, song_name in similarities[:k]]
+
+    def features(self, summary, target_type, k):
+        """Exact feature and hash scoring over the target type, the GUI's Features mode"""
+        rows = np.flatnonzero(self.catalog.types == target_type)
+        best_rows, _ = search_catalog(stack_features([summary["features"]]), self.catalog, rows=rows, k=k, exact=True)
+        return [self.catalog.names[i] for i in best_rows]
+
+    def ann(self, summary, target_type, k):
+        rows = np.flatnonzero(self.catalog.types == target_type)
+        best_rows, _ = search_catalog(stack_features([summary["features"]]), self.catalog,
+                                      index=self.ann_index, rows=rows, k=k, nprobe=self.nprobe)
+        return [self.catalog.names[i] for i in best_rows]
+
+    def lsh(self, summary, target_type, k):
+        """Hamming ranking of the LSH codes alone, scoring.hash_similarity"""
+        rows = np.flatnonzero(self.catalog.types == target_type)
+        scores = hash_similarity(from_hex(summary["hash"]["lsh_hash"]), self.catalog, rows)[0]
+        return [self.catalog.names[rows[i]] for i in top_k(scores, k)]
+
+    def landmarks(self, summary, target_type, k):
+        keys, offsets = summary["landmarks"]
+        matches = self.landmark_index.query(keys, offsets, top_n=len(self.landmark_index))
+        return [song_name for song_name, _, _ in matches if get_file_type(song_name) == target_type][:k]
+
+
+def percentiles(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean())}
+
+
+def run_ingest(audio_folder, output_folder, workers):
+    """Ingest the whole catalog from scratch without the feature cache"""
+    shutil.rmtree(output_folder, ignore_errors=True)
+    os.makedirs(output_folder)
+    ingest = Ingest(audio_folder, output_folder, workers, use_cache=False)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.run()
+        # Queries must see the merged segments and rebuilt index, as after a real ingest
+        if ingest.maintenance is not None:
+            ingest.maintenance.join()
+    seconds = time.perf_counter() - start
+    cores = workers or os.cpu_count()
+    files = len(ingest.state)
+    return {"files": files, "workers": cores, "seconds": seconds,
+            "files_per_second": files / seconds, "files_per_second_per_core": files / seconds / cores}
+
+
+def run_queries(engines, queries, k, repeats):
+    """Latency of every engine per query and whether the expected track was found"""
+    analysis_seconds = {kind: [] for kind in QUERY_KINDS}
+    latencies = {name: [] for name in ENGINES}
+    hits = {name: {kind: {"top1": 0, "top_k": 0, "queries": 0} for kind in QUERY_KINDS} for name in ENGINES}
+
+    # Warm-up: the first analysis and search pay for lazy imports and JIT compilation
+    if queries:
+        summary, _ = analyze_query(queries[0])
+        for name in ENGINES:
+            getattr(engines, name)(summary, route_target_type(*queries[0]["types"]), k)
+
+    for query in queries:
+        summary, seconds = analyze_query(query)
+        analysis_seconds[query["kind"]].append(seconds)
+        target_type = route_target_type(*query["types"])
+        for name in ENGINES:
+            search = getattr(engines, name)
+            for _ in range(repeats):
+                start = time.perf_counter()
+                ranking = search(summary, target_type, k)
+                latencies[name].append(time.perf_counter() - start)
+            counts = hits[name][query["kind"]]
+            counts["queries"] += 1
+            counts["top1"] += bool(ranking) and ranking[0] == query["expected"]
+            counts["top_k"] += query["expected"] in ranking
+
+    results = {"analysis": {kind: percentiles(s) for kind, s in analysis_seconds.items() if s}, "engines": {}}
+    for name in ENGINES:
+        recall = {}
+        for kind, counts in hits[name].items():
+            if counts["queries"]:
+                recall[kind] = {"top1": counts["top1"] / counts["queries"], "top_k": counts["top_k"] / counts["queries"]}
+        total = sum(counts["queries"] for counts in hits[name].values())
+        recall["all"] = {
+            "top1": sum(counts["top1"] for counts in hits[name].values()) / total,
+            "top_k": sum(counts["top_k"] for counts in hits[name].values()) / total,
+        }
+        results["engines"][name] = {"latency": percentiles(latencies[name]), "recall": recall}
+    return results
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished children (ingest workers)"""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 / 1024 ** 2 if platform.system() == "Darwin" else 1 / 1024
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    audio_folder = os.path.join(args.workdir, "audio")
+    output_folder = os.path.join(args.workdir, "output")
+
+    print(f"Synthesizing {args.songs} songs ({3 * args.songs} files)")
+    synthesize_catalog(audio_folder, args.songs, args.duration, args.seed)
+
+    print("Ingesting")
+    ingest = run_ingest(audio_folder, output_folder, args.workers)
+    print(f"  {ingest['files']} files in {ingest['seconds']:.1f} s, "
+          f"{ingest['files_per_second_per_core']:.2f} files/s per core")
+
+    print("Querying")
+    engines = Engines(output_folder, args.nprobe)
+    queries = make_queries(audio_folder, args.songs, args.queries, args.clip_seconds, args.snr_db, args.seed)
+    results = run_queries(engines, queries, args.k, args.repeats)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "ingest": ingest,
+        "ann_build_seconds": engines.ann_build_seconds,
+        **results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_report(results, baseline=None):
+    def delta(value, path, fmt):
+        if baseline is None:
+            return ""
+        old = baseline
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+        return f" ({value - old:+{fmt}})" if isinstance(old, (int, float)) else ""
+
+    ingest = results["ingest"]
+    print(f"\nIngest: {ingest['files_per_second_per_core']:.2f} files/s per core"
+          f"{delta(ingest['files_per_second_per_core'], ('ingest', 'files_per_second_per_core'), '.2f')}")
+    for kind, latency in results["analysis"].items():
+        print(f"Query analysis ({kind}): p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms")
+    print(f"\n{'engine':<10} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'top-1':>14} {'top-k':>14}")
+    for name, engine in results["engines"].items():
+        latency, recall = engine["latency"], engine["recall"]["all"]
+        cells = [f"{latency[p]:.2f}{delta(latency[p], ('engines', name, 'latency', p), '.2f')}"
+                 for p in ("p50_ms", "p95_ms", "p99_ms")]
+        cells += [f"{recall[r]:.2f}{delta(recall[r], ('engines', name, 'recall', 'all', r), '.2f')}"
+                  for r in ("top1", "top_k")]
+        print(f"{name:<10} {cells[0]:>18} {cells[1]:>18} {cells[2]:>18} {cells[3]:>14} {cells[4]:>14}")
+    rss = results["peak_rss_mb"]
+    print(f"\nPeak RSS: {rss['self']:.0f} MB (ingest workers {rss['children']:.0f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest and search on a synthetic catalog")
+    parser.add_argument("--songs", type=int, default=50, help="synthetic songs (each gives vocals, music and original files)")
+    parser.add_argument("--duration", type=float, default=30, help="length of every synthetic track in seconds")
+    parser.add_argument("--queries", type=int, default=20, help="songs to query (each gives a clip, a noisy clip and a blend)")
+    parser.add_argument("--clip-seconds", type=float, default=10, help="length of the truncated query clips")
+    parser.add_argument("--snr-db", type=float, default=10, help="signal-to-noise ratio of the noisy clips")
+    parser.add_argument("--k", type=int, default=10, help="result list length for top-k recall")
+    parser.add_argument("--nprobe", type=int, default=16, help="inverted lists probed by the ANN engine")
+    parser.add_argument("--repeats", type=int, default=5, help="timed searches per query and engine")
+    parser.add_argument("--workers", type=int, default=None, help="ingest worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="bench_data", help="folder for the synthetic audio and its catalog")
+    parser.add_argument("--output", default="benchmark_results.json", help="machine-readable results file")
+    parser.add_argument("--compare", default=None, help="earlier results file to show differences against")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,62 @@
+import numpy as np
+
+# Length of the locality-sensitive feature hash, in bits (a multiple of 64)
+N_BITS = 256
+# Fixed seed: the random hyperplanes must be identical for the catalog and every query
+PROJECTION_SEED = 20241
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_projections = {}
+
+
+def popcount(words):
+    """Number of set bits per uint64 word"""
+    words = np.asarray(words, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    as_bytes = words.view(np.uint8).reshape(words.shape + (8,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+def pack_bits(bits):
+    """Pack a (N, n_bits) boolean matrix into (N, n_bits // 64) uint64 words"""
+    bits = np.ascontiguousarray(bits, dtype=bool)
+    packed = np.packbits(bits, axis=-1, bitorder='little')
+    return np.ascontiguousarray(packed).view('<u8')
+
+
+def to_hex(code):
+    """Hex string of one packed code"""
+    return np.ascontiguousarray(code, dtype='<u8').tobytes().hex()
+
+
+def from_hex(hex_string):
+    """Packed uint64 words of a hex string (its length must be a multiple of 16)"""
+    return np.frombuffer(bytes.fromhex(hex_string), dtype='<u8').copy()
+
+
+def hamming_distance(query_codes, codes):
+    """Hamming distance of every query code (Q, W) to every code (N, W), via XOR + popcount"""
+    query_codes = np.atleast_2d(query_codes)
+    distances = np.zeros((len(query_codes), len(codes)), dtype=np.int32)
+    for word in range(codes.shape[1]):
+        distances += popcount(query_codes[:, word, None] ^ codes[None, :, word])
+    return distances
+
+
+def projection(dim, n_bits=N_BITS):
+    """Random hyperplanes for sign-random-projection (SimHash)"""
+    if (dim, n_bits) not in _projections:
+        rng = np.random.default_rng(PROJECTION_SEED)
+        _projections[dim, n_bits] = rng.standard_normal((dim, n_bits)).astype(np.float32)
+    return _projections[dim, n_bits]
+
+
+def lsh_codes(vectors, n_bits=N_BITS):
+    """
+    Locality-sensitive codes of feature vectors (N, D) as packed (N, n_bits // 64) words.
+    The probability that a bit differs is the angle between two vectors over pi,
+    so the Hamming distance estimates their cosine distance.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return pack_bits(vectors @ projection(vectors.shape[1], n_bits) > 0)
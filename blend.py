@@ -0,0 +1,138 @@
+import os
+import argparse
+import numpy as np
+from audioProcessor import AudioAnalysis
+from cache import ANALYSIS_PARAMS
+from catalog import Catalog, get_file_type, route_target_type
+from scoring import top_k
+
+# Candidates kept per component by how well they explain the query alone
+BLEND_CANDIDATES = 64
+# The best single fits propose partners that explain what they leave over
+BLEND_SEEDS = 8
+BLEND_PARTNERS = 8
+# Smallest amplitude share of a component; below it the query is one track, not a blend
+MIN_BLEND_WEIGHT = 0.05
+
+
+def blend_types(file1_type, file2_type=None):
+    """
+    Catalog types of the two components, the inverse of route_target_type: a
+    blend of two input tracks decomposes into tracks of their types, and a single
+    query into the type pair the routing sends to its type (an original into
+    vocals and music, vocals into two vocals tracks).
+    """
+    if file2_type is not None:
+        return file1_type, file2_type
+    for type_a, type_b in (('vocals', 'music'), ('vocals', 'vocals'), ('music', 'music')):
+        if route_target_type(type_a, type_b) == file1_type:
+            return type_a, type_b
+    return file1_type, file1_type
+
+
+def _single_fits(query, spectra):
+    """Best non-negative scale of each spectrum alone, and the share of the query it explains"""
+    dots = spectra @ query
+    norms = np.maximum((spectra ** 2).sum(axis=1), np.finfo(np.float64).tiny)
+    scales = np.maximum(dots, 0) / norms
+    return scales, scales * dots / (query @ query)
+
+
+def decompose(query_power, catalog, rows_a, rows_b, k=10):
+    """
+    Best (row_a, row_b, weight_a, explained) blends of the query among catalog
+    rows, best first. The query's mean mel power spectrum is modelled as
+    x * P_a + y * P_b with x, y >= 0 (powers of uncorrelated tracks add, scaled
+    by the square of their mix weight), fitted by least squares in relative
+    terms per band. Instead of all pairs, candidates are the tracks that best
+    explain the query alone plus the best partners for the leftover of the top
+    single fits; all candidate pairs are then solved in closed form at once.
+    weight_a is the amplitude share of track a, sqrt(x) / (sqrt(x) + sqrt(y)).
+    """
+    query_power = np.asarray(query_power, dtype=np.float64)
+    # Relative error per band, so quiet high bands count as much as loud low ones
+    band_weights = 1 / (query_power + 1e-6 * query_power.max() + np.finfo(np.float64).tiny)
+    query = query_power * band_weights
+    spectra_a = catalog.mel_power[rows_a].astype(np.float64) * band_weights
+    spectra_b = catalog.mel_power[rows_b].astype(np.float64) * band_weights
+
+    scales_a, explained_a = _single_fits(query, spectra_a)
+    scales_b, explained_b = _single_fits(query, spectra_b)
+    candidates_a = set(top_k(explained_a, BLEND_CANDIDATES).tolist())
+    candidates_b = set(top_k(explained_b, BLEND_CANDIDATES).tolist())
+    for seed in top_k(explained_a, BLEND_SEEDS):
+        leftover = query - scales_a[seed] * spectra_a[seed]
+        candidates_b.update(top_k(_single_fits(leftover, spectra_b)[1], BLEND_PARTNERS).tolist())
+    for seed in top_k(explained_b, BLEND_SEEDS):
+        leftover = query - scales_b[seed] * spectra_b[seed]
+        candidates_a.update(top_k(_single_fits(leftover, spectra_a)[1], BLEND_PARTNERS).tolist())
+    candidates_a = np.array(sorted(candidates_a), dtype=np.int64)
+    candidates_b = np.array(sorted(candidates_b), dtype=np.int64)
+    if not len(candidates_a) or not len(candidates_b):
+        return []
+
+    # Two-track least squares for every candidate pair from the 2x2 normal equations
+    pa, pb = spectra_a[candidates_a], spectra_b[candidates_b]
+    gaa = (pa ** 2).sum(axis=1)[:, None]
+    gbb = (pb ** 2).sum(axis=1)[None, :]
+    gab = pa @ pb.T
+    da = (pa @ query)[:, None]
+    db = (pb @ query)[None, :]
+    det = gaa * gbb - gab ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (da * gbb - db * gab) / det
+        y = (db * gaa - da * gab) / det
+        explained = (x * da + y * db) / (query @ query)
+
+    # Only true blends: two different tracks, both audible, each pair once
+    amplitude_a, amplitude_b = np.sqrt(np.maximum(x, 0)), np.sqrt(np.maximum(y, 0))
+    with np.errstate(invalid='ignore'):
+        weights = amplitude_a / (amplitude_a + amplitude_b)
+    valid = (det > 1e-12 * gaa * gbb) & (weights >= MIN_BLEND_WEIGHT) & (weights <= 1 - MIN_BLEND_WEIGHT)
+    track_a = np.asarray(rows_a)[candidates_a][:, None]
+    track_b = np.asarray(rows_b)[candidates_b][None, :]
+    valid &= track_a != track_b
+    if np.array_equal(rows_a, rows_b):
+        valid &= track_a < track_b
+    explained = np.where(valid, explained, -np.inf).ravel()
+
+    best = top_k(explained, min(k, int(valid.sum())))
+    i, j = np.unravel_index(best, valid.shape)
+    return [(int(track_a[a, 0]), int(track_b[0, b]), float(weights[a, b]), float(score))
+            for a, b, score in zip(i, j, explained[best])]
+
+
+def blend_search(query_power, catalog, file1_type, file2_type=None, k=10):
+    """Best blends with type routing, as [{'song_name', 'similarity', 'tracks', 'weight'}]"""
+    if catalog.mel_power.shape[1] == 0:
+        raise ValueError("The catalog has no blend spectra; run ingest.py again to add them")
+    type_a, type_b = blend_types(file1_type, file2_type)
+    rows_a = np.flatnonzero(catalog.types == type_a)
+    rows_b = np.flatnonzero(catalog.types == type_b)
+    results = []
+    for row_a, row_b, weight, explained in decompose(query_power, catalog, rows_a, rows_b, k):
+        name_a, name_b = catalog.names[row_a], catalog.names[row_b]
+        results.append({
+            'song_name': f"{name_a} ({weight:.0%}) + {name_b} ({1 - weight:.0%})",
+            'similarity': explained,
+            'tracks': [name_a, name_b],
+            'weight': weight,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the two catalog tracks and the weight behind a blend")
+    parser.add_argument("query", help="audio file of the blend")
+    parser.add_argument("--types", nargs=2, default=None, metavar=("TYPE_A", "TYPE_B"),
+                        help="catalog types of the two components (default: routed from the file name)")
+    parser.add_argument("--catalog", default="output", help="folder with the catalog")
+    parser.add_argument("--k", type=int, default=10, help="blends to report")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.catalog)
+    catalog.load()
+    features = AudioAnalysis.from_file(args.query, sr=ANALYSIS_PARAMS['sr'], features_only=True).features()
+    types = args.types or (get_file_type(os.path.basename(args.query)), None)
+    for rank, result in enumerate(blend_search(features['mel_power'], catalog, *types, k=args.k), 1):
+        print(f"{rank:3d}. {result['song_name']}  explains {result['similarity']:.1%}")
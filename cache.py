@@ -0,0 +1,150 @@
+import os
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from audioProcessor import AudioAnalysis
+
+# Analysis parameters that change the cached result
+ANALYSIS_PARAMS = {"sr": 22050, "feature_duration": 30, "n_mfcc": 20}
+# Bumped whenever AudioAnalysis.summary() gains or changes fields, so older results are recomputed
+SUMMARY_VERSION = 4
+
+
+def content_hash(audio_path, block_size=1 << 20):
+    """SHA-256 of the file content"""
+    digest = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def array_hash(y, sr):
+    """SHA-256 of a decoded signal and its sample rate"""
+    digest = hashlib.sha256(np.ascontiguousarray(y, dtype=np.float32).tobytes())
+    digest.update(str(sr).encode())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """
+    Content-addressed cache of analysis results (features, hashes, landmarks).
+    Entries are keyed by the audio content hash plus the analysis parameters,
+    kept in an in-memory LRU and optionally in a size-capped folder on disk.
+    """
+
+    def __init__(self, max_entries=64, disk_folder=None, max_disk_bytes=512 * 2**20):
+        self.max_entries = max_entries
+        self.disk_folder = disk_folder
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_bytes = 0
+        if disk_folder:
+            os.makedirs(disk_folder, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(disk_folder)
+                                   if entry.name.endswith(".pkl"))
+
+    @staticmethod
+    def make_key(content_sha, **params):
+        params = dict(ANALYSIS_PARAMS, **params, summary_version=SUMMARY_VERSION)
+        return hashlib.sha256((content_sha + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_folder, key + ".pkl")
+
+    def get(self, key):
+        """Cached value or None"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            self.memory_hits += 1
+            return self._memory[key]
+
+        if self.disk_folder:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                os.utime(path)  # disk LRU order follows mtime
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                self._remember(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.disk_folder:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._disk_bytes += os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        entries = sorted((entry for entry in os.scandir(self.disk_folder) if entry.name.endswith(".pkl")),
+                         key=lambda entry: entry.stat().st_mtime_ns)
+        self._disk_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def analyze_file(self, audio_path, sha=None, **params):
+        """Analysis summary of an audio file, computed only on a cache miss"""
+        params = dict(ANALYSIS_PARAMS, **params)
+        key = self.make_key(sha or content_hash(audio_path), **params)
+        return self.get_or_compute(key, lambda: AudioAnalysis.from_file(
+            audio_path, sr=params["sr"], feature_duration=params["feature_duration"]).summary(params["n_mfcc"]))
+
+    def analyze_array(self, y, sr, **params):
+        """Analysis summary of a decoded signal, computed only on a cache miss"""
+        params = dict(ANALYSIS_PARAMS, **params, sr=sr)
+        key = self.make_key(array_hash(y, sr), **params)
+        return self.get_or_compute(key, lambda: AudioAnalysis(
+            y, sr=sr, feature_duration=params["feature_duration"]).summary(params["n_mfcc"]))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import numpy as np
+from binary_hash import N_BITS, from_hex, lsh_codes
+from scoring import feature_vectors
+from timing import span
+from ann import ANN_INDEX_FILE, ANN_MIN_TRACKS, IVFPQIndex, build_catalog_index, catalog_checksum
+from fingerprint import LandmarkIndex, LANDMARK_INDEX_FILE
+from segments import SEGMENT_FOLDER, SegmentStore
+from packed_catalog import PACKED_CATALOG_FILE, PackedCatalog
+
+FEATURES_FILE = "all_features.json"
+HASHES_FILE = "feature_hashes.json"
+SPECTROGRAM_HASHES_FILE = "all_hashes.json"
+
+
+def get_file_type(filename):
+    """Determine the type of audio file based on its name"""
+    filename = filename.lower()
+    if any(vocal_term in filename for vocal_term in ['vocals', 'vocal', 'lyrics']):
+        return 'vocals'
+    elif any(music_term in filename for music_term in ['music', 'instruments', 'instrumental']):
+        return 'music'
+    else:
+        return 'original'
+
+
+# Words in file names that name the track type rather than the song
+TYPE_WORDS = {'vocals', 'vocal', 'lyrics', 'music', 'instruments', 'instrumental', 'original'}
+
+
+def song_key(filename):
+    """Song a track belongs to: its file name without the extension and type words, so stems share it"""
+    words = re.split(r'[\W_]+', os.path.splitext(filename.lower())[0])
+    return ' '.join(word for word in words if word and word not in TYPE_WORDS)
+
+
+def route_target_type(file1_type, file2_type):
+    """Catalog type to search for, given the types of the two input tracks"""
+    if file1_type == 'vocals' and file2_type == 'vocals':
+        return 'vocals'
+    elif file1_type == 'music' and file2_type == 'music':
+        return 'music'
+    elif (file1_type == 'music' and file2_type == 'vocals') or (file1_type == 'vocals' and file2_type == 'music'):
+        return 'original'
+    elif file1_type == 'original' or file2_type == 'original':
+        return 'original'
+    return None
+
+
+class Catalog:
+    """
+    In-memory index of the catalog in the output folder: a snapshot of its
+    segment store, or the feature and hash JSON databases of catalogs built
+    before segments existed. Features are held as contiguous NumPy arrays
+    indexed by track id, and are only loaded again when the catalog changes.
+    A packed copy of the same catalog (packed_catalog.py) is memory-mapped
+    instead when it is up to date.
+    """
+
+    def __init__(self, output_folder="output"):
+        self.features_path = os.path.join(output_folder, FEATURES_FILE)
+        self.hashes_path = os.path.join(output_folder, HASHES_FILE)
+        self.ann_path = os.path.join(output_folder, ANN_INDEX_FILE)
+        self.landmark_path = os.path.join(output_folder, LANDMARK_INDEX_FILE)
+        self.packed_path = os.path.join(output_folder, PACKED_CATALOG_FILE)
+        self.store = SegmentStore(os.path.join(output_folder, SEGMENT_FOLDER))
+        self._signature = None
+        self._landmark_index = None
+        self._landmark_signature = None
+        self._clear()
+
+    def _clear(self):
+        self.names = []
+        self.ids = {}
+        self.types = np.empty(0, dtype=object)
+        self.mfcc = np.empty((0, 0), dtype=np.float32)
+        self.chroma = np.empty((0, 0), dtype=np.float32)
+        self.spectral_contrast = np.empty((0, 0), dtype=np.float32)
+        self.spectral_centroid = np.empty(0, dtype=np.float32)
+        self.spectral_bandwidth = np.empty(0, dtype=np.float32)
+        self.mel_power = np.empty((0, 0), dtype=np.float32)
+        self.lsh_codes = np.empty((0, N_BITS // 64), dtype=np.uint64)
+        self._ann_index = None
+        self._snapshot = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def source_signature(self):
+        """Changes whenever the segments or JSON databases change, in the form stored in packed catalogs"""
+        if self.store.exists():
+            return list(self.store.signature())
+        signature = []
+        for path in (self.features_path, self.hashes_path):
+            try:
+                stat = os.stat(path)
+                signature.append([stat.st_mtime_ns, stat.st_size])
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+
+    def _file_signature(self):
+        try:
+            packed = os.stat(self.packed_path).st_mtime_ns
+        except FileNotFoundError:
+            packed = None
+        return self.source_signature(), packed
+
+    def refresh(self):
+        """Reload the catalog if the files on disk changed. Returns True if reloaded."""
+        signature = self._file_signature()
+        if signature == self._signature:
+            return False
+        with span("catalog_load"):
+            self.load()
+        self._signature = signature
+        return True
+
+    def load(self, packed=True):
+        """
+        Map the packed catalog if it was converted from the current databases,
+        otherwise load the current segment snapshot or parse the JSON databases
+        """
+        if packed and os.path.exists(self.packed_path):
+            catalog = PackedCatalog(self.packed_path)
+            if catalog.source == self.source_signature():
+                self._load_packed(catalog)
+                return
+        if self.store.exists():
+            self._load_snapshot(self.store.snapshot())
+            return
+
+        with open(self.hashes_path, "r") as f:
+            hash_database = json.load(f)
+        with open(self.features_path, "r") as f:
+            feature_database = json.load(f)
+
+        feature_lookup = {entry['song_name']: entry['features']
+                          for entry in feature_database}
+
+        # Only tracks present in both databases can be scored
+        entries = [(entry['song_name'], feature_lookup[entry['song_name']], entry['hash'])
+                   for entry in hash_database if entry['song_name'] in feature_lookup]
+        if not entries:
+            self._clear()
+            return
+
+        self.names = [name for name, _, _ in entries]
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.types = np.array([get_file_type(name) for name in self.names], dtype=object)
+
+        def stack(key):
+            return np.ascontiguousarray([features[key] for _, features, _ in entries], dtype=np.float32)
+
+        self.mfcc = stack('mfcc')
+        self.chroma = stack('chroma')
+        self.spectral_contrast = stack('spectral_contrast')
+        self.spectral_centroid = stack('spectral_centroid')
+        self.spectral_bandwidth = stack('spectral_bandwidth')
+        # Databases written before blend spectra existed cannot decompose blends
+        if all('mel_power' in features for _, features, _ in entries):
+            self.mel_power = stack('mel_power')
+        else:
+            self.mel_power = np.empty((len(entries), 0), dtype=np.float32)
+
+        # Packed locality-sensitive hashes as one (N, N_BITS // 64) matrix;
+        # databases written before the hash existed get it from the features
+        if all('lsh_hash' in hashes for _, _, hashes in entries):
+            self.lsh_codes = np.array([from_hex(hashes['lsh_hash']) for _, _, hashes in entries])
+        else:
+            self.lsh_codes = lsh_codes(feature_vectors({
+                'mfcc': self.mfcc, 'chroma': self.chroma, 'spectral_contrast': self.spectral_contrast}))
+        self._ann_index = None
+        self._snapshot = None
+
+    def _load_snapshot(self, snapshot):
+        if not len(snapshot):
+            self._clear()
+            return
+        self.names = snapshot.names
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.types = np.array([get_file_type(name) for name in self.names], dtype=object)
+        for key in ('mfcc', 'chroma', 'spectral_contrast', 'spectral_centroid', 'spectral_bandwidth', 'mel_power',
+                    'lsh_codes'):
+            setattr(self, key, np.ascontiguousarray(snapshot.arrays[key]))
+        self._ann_index = None
+        self._snapshot = snapshot
+
+    def _load_packed(self, catalog):
+        self.names = catalog.names
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.types = catalog.types
+        for key in ('mfcc', 'chroma', 'spectral_contrast', 'spectral_centroid', 'spectral_bandwidth', 'mel_power'):
+            setattr(self, key, catalog.feature(key))
+        self.lsh_codes = catalog.columns['lsh_codes']
+        self._ann_index = None
+        self._snapshot = None
+
+    def landmark_index(self):
+        """Landmark index of the loaded snapshot, or of the landmark database (reloaded when it changes)"""
+        if self._snapshot is None and self.store.exists():
+            # A packed catalog holds no landmarks; they come from the segments it was converted from
+            self._snapshot = self.store.snapshot()
+        if self._snapshot is not None:
+            return self._snapshot.landmark_index()
+        mtime = os.stat(self.landmark_path).st_mtime_ns
+        if self._landmark_index is None or mtime != self._landmark_signature:
+            self._landmark_index = LandmarkIndex.load(self.landmark_path)
+            self._landmark_signature = mtime
+        return self._landmark_index
+
+    def entry_features(self, track_id):
+        """Features of one track in the same layout as all_features.json"""
+        return {
+            'spectral_centroid': float(self.spectral_centroid[track_id]),
+            'spectral_bandwidth': float(self.spectral_bandwidth[track_id]),
+            'mfcc': self.mfcc[track_id],
+            'chroma': self.chroma[track_id],
+            'spectral_contrast': self.spectral_contrast[track_id],
+        }
+
+    def entry_hashes(self, track_id):
+        """Locality-sensitive hash of one track as in feature_hashes.json"""
+        return {'lsh_hash': self.lsh_codes[track_id].tobytes().hex()}
+
+    def ann_index(self):
+        """
+        Approximate nearest-neighbour index over the feature vectors, or None for
+        catalogs small enough to scan. The saved index is used when it was built
+        for the same tracks, otherwise it is rebuilt in memory.
+        """
+        if len(self) < ANN_MIN_TRACKS:
+            return None
+        if self._ann_index is None:
+            checksum = catalog_checksum(self)
+            if os.path.exists(self.ann_path):
+                index = IVFPQIndex.load(self.ann_path)
+                if index.checksum == checksum:
+                    self._ann_index = index
+            if self._ann_index is None:
+                with span("ann_build"):
+                    self._ann_index = build_catalog_index(self)
+        return self._ann_index
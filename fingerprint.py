@@ -0,0 +1,173 @@
+import os
+import numpy as np
+
+LANDMARK_INDEX_FILE = "landmarks.npz"
+
+# Peak picking: a peak is the loudest point of its (frequency bins, frames) neighbourhood
+PEAK_NEIGHBORHOOD = (25, 25)
+# Ignore peaks quieter than this many dB below the loudest point of the track
+PEAK_DYNAMIC_RANGE = 60
+
+# Pairing: each anchor peak is paired with the next FAN_OUT peaks in its target zone
+FAN_OUT = 10
+MIN_DELTA = 1
+MAX_DELTA = 100  # frames, ~2.3 s at 22050 Hz with a hop of 512
+
+# Key layout (uint32): 10 bits f1 | 10 bits f2 | 12 bits delta
+FREQ_BITS = 10
+DELTA_BITS = 12
+
+
+def find_peaks(magnitude):
+    """
+    Find spectral peaks (constellation points) in a magnitude spectrogram.
+    Returns (freq_bins, frames) sorted by frame, then by frequency.
+    """
+    from scipy.ndimage import maximum_filter  # slow to import, only needed once analysis starts
+    log_magnitude = 20 * np.log10(np.maximum(magnitude, 1e-10))
+    local_max = maximum_filter(log_magnitude, size=PEAK_NEIGHBORHOOD, mode='constant', cval=-np.inf)
+    is_peak = (log_magnitude == local_max) & (log_magnitude > log_magnitude.max() - PEAK_DYNAMIC_RANGE)
+    frames, freq_bins = np.nonzero(is_peak.T)
+    return freq_bins, frames
+
+
+def landmarks(magnitude, max_frame=None):
+    """
+    Hash pairs of spectral peaks into (f1, f2, delta) keys.
+    Returns (keys, offsets): uint32 keys and the frame of each anchor peak.
+    Peaks after max_frame are dropped (used for the unsettled end of a live stream).
+    """
+    freq_bins, frames = find_peaks(magnitude)
+    if max_frame is not None:
+        freq_bins, frames = freq_bins[frames <= max_frame], frames[frames <= max_frame]
+    freq_bins = np.minimum(freq_bins, 2 ** FREQ_BITS - 1).astype(np.uint32)
+    frames = frames.astype(np.int32)
+
+    keys = []
+    offsets = []
+    for step in range(1, FAN_OUT + 1):
+        anchor_freq, target_freq = freq_bins[:-step], freq_bins[step:]
+        anchor_frame, target_frame = frames[:-step], frames[step:]
+        delta = target_frame - anchor_frame
+        valid = (delta >= MIN_DELTA) & (delta <= MAX_DELTA)
+        keys.append((anchor_freq[valid] << (FREQ_BITS + DELTA_BITS))
+                    | (target_freq[valid] << DELTA_BITS)
+                    | delta[valid].astype(np.uint32))
+        offsets.append(anchor_frame[valid])
+
+    if not keys:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    return np.concatenate(keys).astype(np.uint32), np.concatenate(offsets)
+
+
+class LandmarkIndex:
+    """
+    Inverted index from landmark key to (track id, offset).
+    Postings are kept sorted by key so a lookup is a binary search per query
+    landmark and its cost does not depend on the number of tracks.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.keys = np.empty(0, dtype=np.uint32)
+        self.track_ids = np.empty(0, dtype=np.int32)
+        self.offsets = np.empty(0, dtype=np.int32)
+        self._pending = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, keys, offsets):
+        """Add the landmarks of one track, returns its track id"""
+        track_id = len(self.names)
+        self.names.append(name)
+        self._pending.append((np.asarray(keys, dtype=np.uint32),
+                              np.full(len(keys), track_id, dtype=np.int32),
+                              np.asarray(offsets, dtype=np.int32)))
+        return track_id
+
+    def add_many(self, names, keys, offsets, counts):
+        """Add the landmarks of several tracks concatenated track by track, counts long; returns the first track id"""
+        first_id = len(self.names)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.names.extend(names)
+        self._pending.append((np.asarray(keys, dtype=np.uint32),
+                              np.repeat(np.arange(first_id, first_id + len(counts), dtype=np.int32), counts),
+                              np.asarray(offsets, dtype=np.int32)))
+        return first_id
+
+    def finalize(self):
+        """Merge pending tracks into the sorted postings"""
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [p[0] for p in self._pending])
+        track_ids = np.concatenate([self.track_ids] + [p[1] for p in self._pending])
+        offsets = np.concatenate([self.offsets] + [p[2] for p in self._pending])
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.track_ids, self.offsets = keys[order], track_ids[order], offsets[order]
+        self._pending = []
+
+    def matches(self, keys, offsets):
+        """
+        Look up query landmarks.
+        Returns (pairs, counts): (track id, time offset) pairs packed as
+        track_id << 32 | offset, and how many landmarks agree on each pair.
+        """
+        self.finalize()
+        keys = np.asarray(keys, dtype=np.uint32)
+        left = np.searchsorted(self.keys, keys, side='left')
+        right = np.searchsorted(self.keys, keys, side='right')
+        counts = right - left
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # Expand each query landmark into the postings it hits
+        starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+        posting = starts + np.arange(total)
+        deltas = self.offsets[posting].astype(np.int64) - np.repeat(np.asarray(offsets, dtype=np.int64), counts)
+        track_ids = self.track_ids[posting].astype(np.int64)
+        return np.unique(track_ids << 32 | (deltas & 0xFFFFFFFF), return_counts=True)
+
+    @staticmethod
+    def best_offsets(pairs, pair_counts):
+        """Keep each track's best-aligned offset: (track_ids, offsets, counts)"""
+        pairs = np.asarray(pairs, dtype=np.int64)
+        pair_counts = np.asarray(pair_counts, dtype=np.int64)
+        pair_tracks = pairs >> 32
+        pair_offsets = (pairs & 0xFFFFFFFF).astype(np.uint32).astype(np.int32)
+        order = np.lexsort((-pair_counts, pair_tracks))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_tracks[order][1:] != pair_tracks[order][:-1]
+        best = order[first]
+        return pair_tracks[best], pair_offsets[best], pair_counts[best]
+
+    def votes(self, keys, offsets):
+        """
+        Vote for (track id, time offset) pairs.
+        Returns (track_ids, offsets, counts) with the best-aligned offset of each matched track.
+        """
+        return self.best_offsets(*self.matches(keys, offsets))
+
+    def query(self, keys, offsets, top_n=5):
+        """Best matching tracks as (song_name, votes, offset_frames), best first"""
+        track_ids, track_offsets, counts = self.votes(keys, offsets)
+        order = np.argsort(-counts, kind='stable')[:top_n]
+        return [(self.names[track_ids[i]], int(counts[i]), int(track_offsets[i])) for i in order]
+
+    def save(self, path):
+        self.finalize()
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, names=np.array(self.names, dtype=str),
+                 keys=self.keys, track_ids=self.track_ids, offsets=self.offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index.names = data['names'].tolist()
+            index.keys = data['keys']
+            index.track_ids = data['track_ids']
+            index.offsets = data['offsets']
+        return index
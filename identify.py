@@ -0,0 +1,206 @@
+import os
+import csv
+import json
+import time
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from audioProcessor import AudioAnalysis
+from audio_io import AUDIO_EXTENSIONS
+from ann import IVFPQIndex, search_catalog
+from cache import ANALYSIS_PARAMS
+from catalog import Catalog, get_file_type, route_target_type
+from fingerprint import LandmarkIndex
+from scoring import stack_features
+
+CATALOG_ARRAYS = ('mfcc', 'chroma', 'spectral_contrast', 'spectral_centroid', 'spectral_bandwidth', 'lsh_codes')
+ANN_ARRAYS = ('centroids', 'codebooks', 'ids', 'codes', 'list_starts')
+LANDMARK_ARRAYS = ('keys', 'track_ids', 'offsets')
+
+CSV_FIELDS = ["file", "target_type", "rank", "song_name", "similarity", "analysis_ms", "scoring_ms", "error"]
+
+
+def export_arrays(obj, keys, folder, prefix):
+    for key in keys:
+        np.save(os.path.join(folder, prefix + key + ".npy"), getattr(obj, key))
+
+
+def map_arrays(obj, keys, folder, prefix):
+    """Attach read-only memory maps of exported arrays; every process maps the same pages"""
+    for key in keys:
+        setattr(obj, key, np.load(os.path.join(folder, prefix + key + ".npy"), mmap_mode='r'))
+    return obj
+
+
+class MappedCatalog:
+    """
+    Read-only catalog whose arrays are memory-mapped from .npy files, so the
+    workers share one copy through the page cache instead of each parsing the
+    JSON databases. Offers what the scoring functions use from Catalog.
+    """
+
+    def __init__(self, folder, names, has_ann_index):
+        self.names = names
+        self.types = np.array([get_file_type(name) for name in names], dtype=object)
+        map_arrays(self, CATALOG_ARRAYS, folder, "catalog_")
+        self._ann_index = None
+        if has_ann_index:
+            self._ann_index = map_arrays(IVFPQIndex(), ANN_ARRAYS, folder, "ann_")
+            self._ann_index.n_subvectors, self._ann_index.n_codes = self._ann_index.codebooks.shape[:2]
+
+    def __len__(self):
+        return len(self.names)
+
+    def ann_index(self):
+        return self._ann_index
+
+
+def export_catalog(catalog, landmark_index, folder):
+    """Write the arrays workers map, returns the initializer arguments of the pool"""
+    export_arrays(catalog, CATALOG_ARRAYS, folder, "catalog_")
+    ann_index = catalog.ann_index()
+    if ann_index is not None:
+        export_arrays(ann_index, ANN_ARRAYS, folder, "ann_")
+    landmark_names = None
+    if landmark_index is not None:
+        landmark_index.finalize()
+        export_arrays(landmark_index, LANDMARK_ARRAYS, folder, "landmarks_")
+        landmark_names = landmark_index.names
+    return folder, catalog.names, ann_index is not None, landmark_names
+
+
+_catalog = None
+_landmark_index = None
+
+
+def _init_worker(folder, names, has_ann_index, landmark_names):
+    global _catalog, _landmark_index
+    _catalog = MappedCatalog(folder, names, has_ann_index)
+    if landmark_names is not None:
+        _landmark_index = map_arrays(LandmarkIndex(), LANDMARK_ARRAYS, folder, "landmarks_")
+        _landmark_index.names = landmark_names
+
+
+def identify_file(path, mode, k):
+    """Worker: rank the catalog for one clip, routed by its type as in the GUI"""
+    file_type = get_file_type(os.path.basename(path))
+    target_type = route_target_type(file_type, file_type)
+
+    start = time.perf_counter()
+    if mode == "landmarks":
+        keys, offsets = AudioAnalysis.from_file(path, sr=ANALYSIS_PARAMS['sr']).landmarks()
+    else:
+        # Only the feature window is decoded
+        features = AudioAnalysis.from_file(path, sr=ANALYSIS_PARAMS['sr'], feature_duration=ANALYSIS_PARAMS['feature_duration'],
+                                           features_only=True).features(ANALYSIS_PARAMS['n_mfcc'])
+    analyzed = time.perf_counter()
+
+    if mode == "landmarks":
+        matches = _landmark_index.query(keys, offsets, top_n=len(_landmark_index))
+        results = [{
+            'song_name': song_name,
+            'similarity': votes / max(len(keys), 1)
+        } for song_name, votes, _ in matches if get_file_type(song_name) == target_type][:k]
+    else:
+        rows = np.flatnonzero(_catalog.types == target_type)
+        best_rows, scores = search_catalog(stack_features([features]), _catalog,
+                                           index=_catalog.ann_index(), rows=rows, k=k)
+        results = [{
+            'song_name': _catalog.names[row],
+            'similarity': float(score)
+        } for row, score in zip(best_rows, scores)]
+
+    return {
+        "file": path,
+        "target_type": target_type,
+        "results": results,
+        "analysis_ms": (analyzed - start) * 1000,
+        "scoring_ms": (time.perf_counter() - analyzed) * 1000,
+    }
+
+
+def find_clips(folder):
+    clips = []
+    for root, _, files in os.walk(folder):
+        clips += [os.path.join(root, name) for name in files if name.lower().endswith(AUDIO_EXTENSIONS)]
+    return sorted(clips)
+
+
+class ResultWriter:
+    """Stream results to CSV (one row per ranked match) or JSONL (one line per clip)"""
+
+    def __init__(self, path, file_format):
+        self.file = open(path, "w", newline="")
+        self.file_format = file_format
+        if file_format == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            self.csv.writeheader()
+
+    def write(self, result):
+        if self.file_format == "jsonl":
+            self.file.write(json.dumps(result) + "\n")
+        elif "error" in result:
+            self.csv.writerow({"file": result["file"], "error": result["error"]})
+        else:
+            for rank, match in enumerate(result["results"], 1):
+                self.csv.writerow({
+                    "file": result["file"], "target_type": result["target_type"], "rank": rank,
+                    "song_name": match["song_name"], "similarity": f"{match['similarity']:.6f}",
+                    "analysis_ms": f"{result['analysis_ms']:.1f}", "scoring_ms": f"{result['scoring_ms']:.1f}",
+                })
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def identify_folder(input_folder, output_path, file_format, catalog_folder="output", mode="features", k=10,
+                    workers=None):
+    clips = find_clips(input_folder)
+    catalog = Catalog(catalog_folder)
+    catalog.load()
+    landmark_index = None
+    if mode == "landmarks":
+        landmark_index = catalog.landmark_index()
+    print(f"Identifying {len(clips)} clips against {len(catalog)} tracks")
+
+    writer = ResultWriter(output_path, file_format)
+    start = time.perf_counter()
+    errors = 0
+    with tempfile.TemporaryDirectory(prefix="catalog_") as folder:
+        initargs = export_catalog(catalog, landmark_index, folder)
+        # The parent's copies are no longer needed once the workers map the exported arrays
+        del catalog, landmark_index
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+            futures = {pool.submit(identify_file, path, mode, k): path for path in clips}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors += 1
+                    result = {"file": futures[future], "error": str(e) or type(e).__name__}
+                    print(f"Error processing {futures[future]}: {result['error']}")
+                writer.write(result)
+                if done % 100 == 0:
+                    print(f"[{done}/{len(clips)}] {done / (time.perf_counter() - start):.1f} clips/s")
+    writer.close()
+
+    seconds = time.perf_counter() - start
+    print(f"Identified {len(clips) - errors} clips in {seconds:.1f} s ({errors} errors), results in {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Identify every audio clip in a folder against the catalog")
+    parser.add_argument("input", help="folder with the clips (searched recursively)")
+    parser.add_argument("--output", default="identified.jsonl", help="results file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None,
+                        help="results format (default: from the output file extension)")
+    parser.add_argument("--catalog", default="output", help="folder with the catalog databases")
+    parser.add_argument("--mode", choices=["features", "landmarks"], default="features")
+    parser.add_argument("--k", type=int, default=10, help="matches reported per clip")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    file_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    identify_folder(args.input, args.output, file_format, args.catalog, args.mode, args.k, args.workers)
@@ -0,0 +1,282 @@
+import os
+import json
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from audio_io import AUDIO_EXTENSIONS
+from audioProcessor import FEATURE_BATCH_SIZE, AudioAnalysis, batch_features
+from cache import ANALYSIS_PARAMS, FeatureCache, SUMMARY_VERSION, content_hash
+from ann import ANN_INDEX_FILE
+from catalog import Catalog
+from segments import SEGMENT_FOLDER, SegmentStore
+from packed_catalog import PackedCatalog, convert, packed_path
+
+STATE_FILE = "ingest_state.json"
+JOURNAL_FILE = "ingest_journal.jsonl"
+LANDMARK_FOLDER = "landmarks"
+CACHE_FOLDER = "cache"
+
+
+def atomic_write_json(data, output_path, indent=4):
+    """Write JSON to a temporary file and rename it over the target"""
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+
+
+# Per-process cache of analysis results, shared on disk by all workers
+_worker_cache = None
+
+
+def analyze_tracks(tracks, cache_folder):
+    """
+    Worker: analyze a chunk of (audio_path, known sha or None) files, skipping the
+    DSP of contents analyzed before. The features of the cache misses are computed
+    as one stacked batch. Returns each file's result, or {"sha256", "error"} for a
+    file whose analysis failed.
+    """
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = FeatureCache(max_entries=1, disk_folder=cache_folder)
+    results = [None] * len(tracks)
+    misses = []
+    for i, (audio_path, sha) in enumerate(tracks):
+        try:
+            sha = sha or content_hash(audio_path)
+            key = _worker_cache.make_key(sha)
+            summary = _worker_cache.get(key)
+            if summary is not None:
+                results[i] = dict(summary, sha256=sha, summary_version=SUMMARY_VERSION, cache_hit=True)
+                continue
+            analysis = AudioAnalysis.from_file(audio_path, sr=ANALYSIS_PARAMS["sr"],
+                                               feature_duration=ANALYSIS_PARAMS["feature_duration"])
+            analysis.stft  # needed for the landmarks anyway; the batch takes its feature window from it
+            misses.append((i, sha, key, analysis))
+        except Exception as e:
+            results[i] = {"sha256": sha, "error": repr(e)}
+
+    try:
+        batch_features([analysis for *_, analysis in misses], ANALYSIS_PARAMS["n_mfcc"])
+    except Exception:
+        pass  # each summary below computes its own features and reports its own error
+    for i, sha, key, analysis in misses:
+        try:
+            summary = analysis.summary(ANALYSIS_PARAMS["n_mfcc"])
+            _worker_cache.put(key, summary)
+            results[i] = dict(summary, sha256=sha, summary_version=SUMMARY_VERSION, cache_hit=False)
+        except Exception as e:
+            results[i] = {"sha256": sha, "error": repr(e)}
+    return results
+
+
+class Ingest:
+    """
+    Incremental, resumable catalog build.
+    Finished files are appended to a journal as they complete, so an interrupted
+    run resumes where it stopped; unchanged files are never analyzed again.
+    Files that fail are recorded too and only retried once their content changes.
+    The catalog is then updated with one segment holding only the new and
+    changed tracks, plus tombstones for removed ones.
+    """
+
+    def __init__(self, input_folder="Music", output_folder="output", workers=None, use_cache=True):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.workers = workers
+        self.cache_folder = os.path.join(output_folder, CACHE_FOLDER) if use_cache else None
+        self.state_path = os.path.join(output_folder, STATE_FILE)
+        self.journal_path = os.path.join(output_folder, JOURNAL_FILE)
+        self.landmark_folder = os.path.join(output_folder, LANDMARK_FOLDER)
+        os.makedirs(self.landmark_folder, exist_ok=True)
+        self.store = SegmentStore(os.path.join(output_folder, SEGMENT_FOLDER))
+        self.state = self._load_state()
+        # Background merge and index rebuild started by run(), join it to wait for a maintained catalog
+        self.maintenance = None
+
+    def _load_state(self):
+        state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        # Replay files finished since the last full state write
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn line of a crashed run
+                    state[record["file_name"]] = record["entry"]
+        return state
+
+    def _landmark_path(self, sha):
+        return os.path.join(self.landmark_folder, sha + ".npz")
+
+    def _scan(self):
+        files = {}
+        for file_name in sorted(os.listdir(self.input_folder)):
+            if file_name.lower().endswith(AUDIO_EXTENSIONS):
+                stat = os.stat(os.path.join(self.input_folder, file_name))
+                files[file_name] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _pending(self, files):
+        """Files that need analysis, as {file_name: known content hash or None}"""
+        pending = {}
+        for file_name, (mtime, size) in files.items():
+            entry = self.state.get(file_name)
+            if (entry is None or entry.get("summary_version") != SUMMARY_VERSION
+                    or ("error" not in entry and not os.path.exists(self._landmark_path(entry["sha256"])))):
+                pending[file_name] = None
+            elif (entry["mtime_ns"], entry["size"]) != (mtime, size):
+                # Touched: only re-analyze if the content actually changed
+                sha = content_hash(os.path.join(self.input_folder, file_name))
+                if sha == entry["sha256"]:
+                    entry["mtime_ns"], entry["size"] = mtime, size
+                else:
+                    pending[file_name] = sha
+        return pending
+
+    def run(self):
+        files = self._scan()
+        removed = set(self.state) - set(files)
+        for file_name in removed:
+            del self.state[file_name]
+
+        pending = self._pending(files)
+        print(f"{len(files)} files, {len(pending)} to process, {len(removed)} removed")
+
+        # Chunks of up to FEATURE_BATCH_SIZE files, but small enough to keep every worker busy
+        names = list(pending)
+        workers = self.workers or os.cpu_count()
+        chunk_size = max(1, min(FEATURE_BATCH_SIZE, -(-len(names) // workers)))
+        chunks = [names[start:start + chunk_size] for start in range(0, len(names), chunk_size)]
+
+        with open(self.journal_path, "a") as journal, ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {
+                pool.submit(analyze_tracks, [(os.path.join(self.input_folder, file_name), pending[file_name])
+                                             for file_name in chunk], self.cache_folder): chunk
+                for chunk in chunks
+            }
+            cache_hits = 0
+            failed = set()
+            done = 0
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # The worker itself died: nothing is recorded, so the next run retries the chunk
+                    for file_name in chunk:
+                        print(f"Error processing {file_name}: {e!r}")
+                    done += len(chunk)
+                    failed.update(chunk)
+                    continue
+                for file_name, result in zip(chunk, results):
+                    done += 1
+                    mtime, size = files[file_name]
+                    if "error" in result:
+                        print(f"Error processing {file_name}: {result['error']}")
+                        failed.add(file_name)
+                        # Kept in the state so the file is skipped until it changes
+                        entry = dict(result, summary_version=SUMMARY_VERSION, mtime_ns=mtime, size=size)
+                    else:
+                        cache_hits += result.pop("cache_hit")
+                        keys, offsets = result.pop("landmarks")
+                        # The per-file record holds the whole analysis; the state only what identifies it
+                        analysis = {"features": result.pop("features"), "hash": result.pop("hash")}
+                        np.savez(self._landmark_path(result["sha256"]), keys=keys, offsets=offsets,
+                                 spectrogram=result.pop("spectrogram"), analysis=np.array(json.dumps(analysis)))
+                        entry = dict(result, mtime_ns=mtime, size=size)
+                    self.state[file_name] = entry
+
+                    # Checkpoint: one journal line per finished file
+                    journal.write(json.dumps({"file_name": file_name, "entry": entry}) + "\n")
+                    journal.flush()
+                    if file_name not in failed:
+                        print(f"[{done}/{len(pending)}] Processed {file_name}")
+
+        if pending:
+            print(f"Feature cache: {cache_hits} hits, {len(pending) - len(failed) - cache_hits} misses, {len(failed)} failed")
+        changed = self.update_catalog(processed=set(pending) - failed)
+        atomic_write_json(self.state, self.state_path, indent=None)
+        os.remove(self.journal_path)
+        if changed:
+            # Searches keep using their snapshot while segments are merged and the ANN index rebuilt
+            self.maintenance = threading.Thread(target=self.maintain_catalog, name="catalog-maintenance")
+            self.maintenance.start()
+
+    def _record(self, name):
+        """Segment record of an analyzed file"""
+        entry = self.state[name]
+        with np.load(self._landmark_path(entry["sha256"])) as data:
+            if "analysis" in data:
+                analysis = json.loads(str(data["analysis"]))
+            else:
+                analysis = entry  # analyzed before segments existed: the state held the features
+            return {
+                "song_name": name,
+                "sha256": entry["sha256"],
+                "features": analysis["features"],
+                "hash": analysis["hash"],
+                "landmarks": (data["keys"], data["offsets"]),
+                "spectrogram": data["spectrogram"],
+            }
+
+    def update_catalog(self, processed=()):
+        """
+        Bring the segment store in line with the state: tracks analyzed by this run
+        or whose content differs from the store go into one new segment, removed
+        ones get tombstones. Comparing with the store also completes updates of
+        interrupted runs. Files whose analysis failed are left as they are in the
+        store. Returns the number of tracks added and removed.
+        """
+        snapshot = self.store.snapshot()
+        stored = dict(zip(snapshot.names, snapshot.arrays['sha256'])) if len(snapshot) else {}
+        analyzed = {name: entry for name, entry in self.state.items() if "error" not in entry}
+        changed = [name for name in sorted(analyzed)
+                   if name in processed or stored.get(name) != analyzed[name]["sha256"]]
+        removed = [name for name in stored if name not in self.state]
+        self.store.update([self._record(name) for name in changed], removed)
+        print(f"Catalog: {len(changed)} tracks added or changed, {len(removed)} removed")
+
+        # Drop cached analyses of removed or changed files
+        live = {entry["sha256"] + ".npz" for entry in analyzed.values()}
+        for file_name in os.listdir(self.landmark_folder):
+            if file_name not in live:
+                os.remove(os.path.join(self.landmark_folder, file_name))
+        return len(changed) + len(removed)
+
+    def maintain_catalog(self):
+        """Merge segments when there are many, repack a packed catalog, then rebuild the ANN index of large catalogs"""
+        merged = self.store.compact()
+        if merged:
+            print(f"Compacted {merged} catalog segments")
+
+        # A catalog converted to the packed format is kept packed (and in the same precision)
+        if os.path.exists(packed_path(self.output_folder)):
+            quantized = PackedCatalog(packed_path(self.output_folder)).header["quantized"]
+            print(f"Repacked {convert(self.output_folder, quantized=quantized)} tracks")
+
+        catalog = Catalog(self.output_folder)
+        catalog.load()
+        ann_index = catalog.ann_index()
+        if ann_index is not None:
+            ann_index.save(os.path.join(self.output_folder, ANN_INDEX_FILE))
+        elif os.path.exists(os.path.join(self.output_folder, ANN_INDEX_FILE)):
+            os.remove(os.path.join(self.output_folder, ANN_INDEX_FILE))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the song catalog")
+    parser.add_argument("--input", default="Music", help="folder with the catalog audio files")
+    parser.add_argument("--output", default="output", help="folder for the catalog databases")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse cached analysis results")
+    args = parser.parse_args()
+
+    Ingest(args.input, args.output, args.workers, use_cache=not args.no_cache).run()
@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+import librosa
+from fingerprint import landmarks, LandmarkIndex, PEAK_NEIGHBORHOOD
+from catalog import song_key
+
+# Frames to wait before a peak is final (half the peak neighbourhood plus STFT padding)
+SETTLE_FRAMES = PEAK_NEIGHBORHOOD[1] // 2 + 2
+# Frames an anchor waits for later peaks to pair with before it is voted on
+PAIR_HORIZON = 32  # ~0.75 s
+
+# Early stop: enough aligned votes and a clear margin over the best track of another song
+MIN_VOTES = 20
+CONFIDENCE_THRESHOLD = 0.6
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of the most recent samples, addressed by absolute sample index"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.total_written = 0
+        self.lock = threading.Lock()
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)[-self.capacity:]
+        with self.lock:
+            start = self.total_written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self.data[start:start + first] = samples[:first]
+            self.data[:len(samples) - first] = samples[first:]
+            self.total_written += len(samples)
+
+    def read(self, start, end):
+        """Samples [start, end) as a contiguous copy; start must still be in the buffer"""
+        with self.lock:
+            if start < self.total_written - self.capacity or end > self.total_written:
+                raise IndexError("Requested samples are no longer (or not yet) buffered")
+            indices = np.arange(start, end) % self.capacity
+            return self.data[indices]
+
+
+class IncrementalMatcher:
+    """
+    Landmark matching of a growing signal.
+    Each update fingerprints only the newly settled frames (with enough context
+    for peak picking) and adds their votes to the running (track, offset) tally,
+    so the ranking is refined without re-analyzing the whole recording.
+    """
+
+    def __init__(self, index, sr=22050, n_fft=2048, hop_length=512):
+        self.index = index
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.next_frame = 0
+        self.n_landmarks = 0
+        self.tally = {}
+
+    def update(self, ring):
+        """Fingerprint the newly settled part of the ring buffer. Returns True if votes changed."""
+        # Last frame whose window holds only real samples
+        last_frame = (ring.total_written - self.n_fft // 2) // self.hop_length
+        accept_until = last_frame - SETTLE_FRAMES - PAIR_HORIZON
+        if accept_until <= self.next_frame:
+            return False
+
+        # Analyze from enough frames before the new anchors to pick their peaks correctly
+        window_frame = max(0, self.next_frame - SETTLE_FRAMES)
+        y = ring.read(window_frame * self.hop_length, ring.total_written)
+        magnitude = np.abs(librosa.stft(y, n_fft=self.n_fft, hop_length=self.hop_length))
+        magnitude = magnitude[:, :last_frame - window_frame + 1]
+        keys, offsets = landmarks(magnitude, max_frame=last_frame - SETTLE_FRAMES - window_frame)
+        offsets = offsets + window_frame
+
+        new = (offsets >= self.next_frame) & (offsets < accept_until)
+        self.next_frame = accept_until
+        if not new.any():
+            return False
+
+        self.n_landmarks += int(new.sum())
+        pairs, counts = self.index.matches(keys[new], offsets[new])
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            self.tally[pair] = self.tally.get(pair, 0) + count
+        return True
+
+    def ranking(self, top_n=10):
+        """Best candidates so far as (song_name, votes, offset_frames), best first; top_n=None ranks all"""
+        if not self.tally:
+            return []
+        track_ids, offsets, counts = LandmarkIndex.best_offsets(list(self.tally), list(self.tally.values()))
+        order = np.argsort(-counts, kind='stable')[:top_n]
+        return [(self.index.names[track_ids[i]], int(counts[i]), int(offsets[i])) for i in order]
+
+    def confidence(self):
+        """
+        0 until MIN_VOTES agree, then the best track's margin over the runner-up
+        of another song. The stems of the song being heard share its landmarks
+        and are not competing answers.
+        """
+        ranking = self.ranking(top_n=None)
+        if not ranking or ranking[0][1] < MIN_VOTES:
+            return 0.0
+        best_song = song_key(ranking[0][0])
+        runner_up = next((votes for song_name, votes, _ in ranking[1:] if song_key(song_name) != best_song), 0)
+        return 1 - runner_up / ranking[0][1]
+
+    def is_confident(self):
+        return self.confidence() >= CONFIDENCE_THRESHOLD
+
+
+class MicrophoneListener:
+    """Record from the default input device into a ring buffer"""
+
+    def __init__(self, sr=22050, buffer_seconds=30):
+        self.sr = sr
+        self.ring = RingBuffer(int(sr * buffer_seconds))
+        self.stream = None
+
+    def _callback(self, indata, frames, time, status):
+        if status:
+            print(f"Input stream status: {status}")
+        self.ring.write(indata.mean(axis=1))
+
+    def start(self):
+        import sounddevice as sd  # PortAudio is only loaded once the microphone is used
+        self.stream = sd.InputStream(samplerate=self.sr, channels=1, dtype='float32', callback=self._callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    @property
+    def seconds(self):
+        return self.ring.total_written / self.sr
@@ -1,20 +1,53 @@
+from timing import Trace
+
+# Startup report, measured from before the heavy imports
+STARTUP = Trace("startup")
+
 import sys
 import os
-import librosa
+import argparse
+from itertools import islice
 import numpy as np
-import sounddevice as sd
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QPushButton, QLabel, QSlider,
-    QFileDialog, QTableWidget, QTableWidgetItem, QWidget, QHBoxLayout, QLineEdit, QSizePolicy, QHeaderView
+    QFileDialog, QWidget, QHBoxLayout, QLineEdit, QSizePolicy, QComboBox, QSpinBox
 )
 from PyQt5.QtCore import Qt, QTimer
+import threading
 from PyQt5.QtGui import QIcon
-import soundfile as sf
-import json
-from scipy.spatial.distance import cosine
-from audioProcessor import extract_features, hash_features, search_similar_songs
+from audioProcessor import AudioAnalysis, search_similar_songs
+from audio_io import load_audio, resample
+from cache import FeatureCache, ANALYSIS_PARAMS
+from catalog import Catalog, get_file_type, route_target_type
+from workers import JobRunner
+from ann import search_catalog
+from blend import blend_search
+from playback import ArraySource, DecodedCache, Player
+from results_view import ResultsModel, ResultsView
+from listen import MicrophoneListener, IncrementalMatcher
+from timing import METRICS, append_log, count, span, trace
+from scoring import (
+    feature_similarity_pair, hash_similarity_pair, stack_features
+)
 from PyQt5.QtCore import QFile, QTextStream, QSize
+from warmup import warm_up
+
+STARTUP.lap("imports")
 
+# Ranked matches kept per search: the default and the largest value of the results box
+MAX_RESULTS = 100
+RESULTS_LIMIT = 100000
+# Results sent from a search job to the table at a time, so the first rows show while the rest follow
+RESULTS_PAGE = 500
+# Results decoded in the background as soon as they are shown
+PREFETCH_RESULTS = 3
+
+# Listen mode: ranking refresh interval and the longest recording before giving up
+LISTEN_INTERVAL_MS = 300
+LISTEN_MAX_SECONDS = 15
+
+# Stage timings of every load, mix and search, one JSON line each
+TIMING_LOG = os.path.join("output", "timings.jsonl")
 
 def load_stylesheet():
     # Open the stylesheet file
@@ -30,7 +63,7 @@ def load_stylesheet():
 
 
 class AudioSimilarityApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, metrics_path=None, server_address=None, shards=None):
         super().__init__()
         stylesheet = load_stylesheet()
 
@@ -47,8 +80,17 @@ class AudioSimilarityApp(QMainWindow):
         self.file2_audio = None
         self.sample_rate = None
         self.is_playing = False
-        self.audio_output = None
         self.audio_output_mixed = None
+        self.player = Player()
+        self.playing_button = None
+        # Decoded search results, prefetched so auditioning them starts at once
+        self.decoded_cache = DecodedCache()
+
+        # Per-track analyses (STFT computed once on selection) and the mix derived from them
+        self.file1_analysis = None
+        self.file2_analysis = None
+        self.mix_analysis = None
+        self.live_ranking = False
 
         # Central widget
         self.central_widget = QWidget()
@@ -81,6 +123,35 @@ class AudioSimilarityApp(QMainWindow):
         self.file1_path = None
         self.file2_path = None
 
+        # Catalog index, loaded on the first search and reloaded when the files change
+        self.catalog = Catalog("output")
+
+        # Analysis results of previously searched audio
+        self.feature_cache = FeatureCache(disk_folder=os.path.join("output", "cache"))
+
+        # Loading, mixing and searching run in the background; a newer job
+        # on the same channel cancels the stale one
+        self.jobs = JobRunner(self)
+        self.search_lock = threading.Lock()
+
+        # With an identification server, searches are sent to it instead of run here
+        self.client = None
+        if server_address:
+            from server import IdentificationClient  # asyncio is only needed in client mode
+            self.client = IdentificationClient(server_address)
+        # With shards, feature searches are scattered to the shard servers and merged here
+        self.shards = shards
+
+        # Slider moves are coalesced into one mix after the slider settles
+        self.mix_timer = QTimer(self)
+        self.mix_timer.setSingleShot(True)
+        self.mix_timer.setInterval(150)
+        self.mix_timer.timeout.connect(self.mix_audio)
+
+        # Stage timings: shown in the status bar, logged, and optionally exported for Prometheus
+        self.metrics_path = metrics_path
+        self.statusBar()
+
     def setup_file_selection(self):
         # File 1 selection
         file1_layout = QHBoxLayout()
@@ -158,6 +229,29 @@ class AudioSimilarityApp(QMainWindow):
         self.search_btn = QPushButton("Search Similar Songs")
         self.search_btn.clicked.connect(self.search_similar_songs)
         self.control_layout.addWidget(self.search_btn)
+
+        # Matching mode: feature similarity, landmark fingerprints, or the two tracks behind a blend
+        self.mode_combo = QComboBox()
+        self.mode_combo.addItems(["Features", "Landmarks", "Blend"])
+        self.control_layout.addWidget(self.mode_combo)
+
+        # Number of ranked matches a search keeps; the table stays fast with thousands
+        self.results_spin = QSpinBox()
+        self.results_spin.setRange(1, RESULTS_LIMIT)
+        self.results_spin.setValue(MAX_RESULTS)
+        self.results_spin.setPrefix("Top ")
+        self.results_spin.setToolTip("Number of ranked matches to show")
+        self.control_layout.addWidget(self.results_spin)
+
+        # Identify what the microphone hears
+        self.listen_btn = QPushButton("Listen")
+        self.listen_btn.clicked.connect(self.toggle_listening)
+        self.control_layout.addWidget(self.listen_btn)
+        self.listener = None
+        self.matcher = None
+        self.listen_timer = QTimer(self)
+        self.listen_timer.setInterval(LISTEN_INTERVAL_MS)
+        self.listen_timer.timeout.connect(self.refine_listening)
         self.top_layout.addLayout(self.control_layout)
 
         self.top_widget = QWidget()
@@ -165,20 +259,13 @@ class AudioSimilarityApp(QMainWindow):
         self.top_widget.setObjectName("top_widget")
         self.layout.addWidget(self.top_widget, 0, Qt.AlignCenter)
 
-        # Table for results
-        self.results_table = QTableWidget()
-
-        self.results_table.resizeColumnsToContents()
-        self.results_table.setColumnCount(3)
-        self.results_table.setHorizontalHeaderLabels(
-            ["Song Name", "Similarity Index", ""])
+        # Results: a model with a virtualized view, so large result lists render as fast as short ones
+        self.results_model = ResultsModel(self)
+        self.results_table = ResultsView(self.results_model)
         self.results_table.setSizePolicy(
             QSizePolicy.Expanding, QSizePolicy.Expanding)
-        self.results_table.horizontalHeader().setStretchLastSection(False)
-        self.results_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.results_table.verticalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.results_table.resizeRowsToContents()
-        self.results_table.resizeColumnsToContents()
+        self.results_table.play_delegate.clicked.connect(
+            lambda index: self.toggle_result_playback(self.results_model.track_path(index.row())))
         self.layout.addWidget(self.results_table)
         self.layout.setAlignment(Qt.AlignCenter)
 
@@ -187,50 +274,112 @@ class AudioSimilarityApp(QMainWindow):
             self, "Select First File", "", "Audio Files (*.wav *.mp3)")
         if file_path:
             self.file1_path = file_path
-            self.file1_label.setText(f"First Track: {os.path.basename(file_path)}")
-            self.file1_audio, self.sample_rate = librosa.load(
-                file_path, sr=None)
-            self.mix_audio()
+            self.file1_label.setText(f"First Track: {os.path.basename(file_path)} (loading...)")
+            self.jobs.submit('track1', self.load_track, file_path, None,
+                             on_result=self.on_file1_loaded, on_error=self.on_job_error)
 
     def select_file2(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self, "Select Second File", "", "Audio Files (*.wav *.mp3)")
         if file_path:
             self.file2_path = file_path
-            self.file2_label.setText(f"Second Track: {os.path.basename(file_path)}")
-            self.file2_audio, _ = librosa.load(
-                file_path, sr=self.sample_rate if self.sample_rate else None)
-            self.mix_audio()
+            self.file2_label.setText(f"Second Track: {os.path.basename(file_path)} (loading...)")
+            self.jobs.submit('track2', self.load_track, file_path,
+                             self.sample_rate if self.sample_rate else None,
+                             on_result=self.on_file2_loaded, on_error=self.on_job_error)
+
+    @staticmethod
+    def load_track(token, file_path, sr):
+        """Background job: decode a selected track and compute its spectrum once"""
+        with trace("load") as timings:
+            with span("decode"):
+                y, sr = load_audio(file_path, sr=sr)
+            token.check()
+
+            # The analysis runs at the catalog's rate; resample the decoded buffer instead of decoding again
+            analysis_sr = ANALYSIS_PARAMS['sr']
+            with span("resample"):
+                y_analysis = resample(y, sr, analysis_sr)
+            analysis = AudioAnalysis(y_analysis, sr=analysis_sr)
+            analysis.stft
+        return file_path, y, sr, analysis, timings.finish()
+
+    def on_file1_loaded(self, result):
+        file_path, self.file1_audio, self.sample_rate, self.file1_analysis, timings = result
+        self.file1_label.setText(f"First Track: {os.path.basename(file_path)}")
+        self.report_timings(timings)
+        self.mix_audio()
+
+    def on_file2_loaded(self, result):
+        file_path, self.file2_audio, _, self.file2_analysis, timings = result
+        self.file2_label.setText(f"Second Track: {os.path.basename(file_path)}")
+        self.report_timings(timings)
+        self.mix_audio()
+
+    def warm_up(self):
+        """Load the analysis stack in the background once the window is up"""
+        self.jobs.submit('warmup', self.run_warm_up, on_result=self.on_warmed_up, on_error=self.on_job_error)
+
+    @staticmethod
+    def run_warm_up(token):
+        return warm_up(ANALYSIS_PARAMS['sr'])
+
+    def on_warmed_up(self, report):
+        for stage, seconds in report.items():
+            STARTUP.add(stage, seconds)
+        STARTUP.finish()
+        self.report_timings(STARTUP)
+
+    def on_job_error(self, message):
+        print(f"Error in background job: {message}")
 
     def update_slider1(self):
         value = self.slider1.value()
         self.slider1_label.setText(f"First Track Weight: {value}%")
+        self.slider2_label.setText(f"Second Track Weight: {100 - value}%")
+        # Move the other slider without triggering its own update
+        self.slider2.blockSignals(True)
         self.slider2.setValue(100 - value)
-        self.mix_audio()
+        self.slider2.blockSignals(False)
+        self.mix_timer.start()
 
     def update_slider2(self):
         value = self.slider2.value()
         self.slider2_label.setText(f"Second Track Weight: {value}%")
+        self.slider1_label.setText(f"First Track Weight: {100 - value}%")
+        self.slider1.blockSignals(True)
         self.slider1.setValue(100 - value)
-        self.mix_audio()
+        self.slider1.blockSignals(False)
+        self.mix_timer.start()
 
     def mix_audio(self):
-        if self.file1_audio is not None and self.file2_audio is not None:
-            # Ensure both audio files are the same length
-            min_length = min(len(self.file1_audio), len(self.file2_audio))
-            audio1 = self.file1_audio[:min_length]
-            audio2 = self.file2_audio[:min_length]
-
+        if self.file1_analysis is not None and self.file2_analysis is not None:
             # Calculate mix ratios
             ratio1 = self.slider1.value() / 100
             ratio2 = self.slider2.value() / 100
+            self.jobs.submit('mix', self.mix_tracks, self.file1_audio, self.file2_audio,
+                             self.file1_analysis, self.file2_analysis, ratio1, ratio2,
+                             on_result=self.on_mix_ready, on_error=self.on_job_error)
+
+    @staticmethod
+    def mix_tracks(token, audio1, audio2, analysis1, analysis2, ratio1, ratio2):
+        """Background job: mix the two tracks in memory for playback and analysis"""
+        with trace("mix") as timings, span("mix"):
+            # Ensure both audio files are the same length
+            min_length = min(len(audio1), len(audio2))
+            mixed = (audio1[:min_length] * ratio1) + (audio2[:min_length] * ratio2)
+            token.check()
 
-            # Mix the audio
-            self.audio_output_mixed = (audio1 * ratio1) + (audio2 * ratio2)
+            # The mix's spectrum is derived from the tracks' spectra, no decode or new STFT
+            mix_analysis = AudioAnalysis.mix(analysis1, analysis2, ratio1, ratio2)
+        return mixed, mix_analysis, timings.finish()
 
-            # Save the mixed audio for similarity search
-            sf.write("mixed_output.wav",
-                     self.audio_output_mixed, self.sample_rate)
+    def on_mix_ready(self, result):
+        self.audio_output_mixed, self.mix_analysis, timings = result
+        self.report_timings(timings)
+        # Once a search was made, re-rank as the sliders move
+        if self.live_ranking:
+            self.search_similar_songs()
 
     def toggle_playback(self, button, track_source=None):
         is_playing = button.property("is_playing")
@@ -238,228 +387,328 @@ class AudioSimilarityApp(QMainWindow):
         if not is_playing:
             if track_source == 'track1':
                 if self.file1_audio is not None:
-                    self.audio_output = self.file1_audio
-                    self.sample_rate = self.sample_rate # !!!!!!!!!!!!!
+                    source = ArraySource(self.file1_audio, self.sample_rate)
                 else:
                     print("No track 1 selected")
                     return
             elif track_source == 'track2':
                 if self.file2_audio is not None:
-                    self.audio_output = self.file2_audio
-                    self.sample_rate = self.sample_rate # !!!!!!!!!!!!!
+                    source = ArraySource(self.file2_audio, self.sample_rate)
                 else:
                     print("No track 2 selected")
                     return
             elif track_source == 'mixed':
-                self.audio_output = self.audio_output_mixed
+                if self.audio_output_mixed is None:
+                    return
+                source = ArraySource(self.audio_output_mixed, self.sample_rate)
 
             elif isinstance(track_source, str):  # A file path
-                self.audio_output, self.sample_rate = librosa.load(
-                    track_source, sr=None)
+                source = self.file_source(track_source)
+                if source is None:
+                    return
             else:
                 return  # No valid audio selected
 
-            # Start playback
+            # Start playback (one track at a time)
+            self.stop_playback()
             self.is_playing = True
+            self.playing_button = button
             button.setIcon(QIcon("ico/pause.png"))
             button.setProperty("is_playing", True)
-            self.start_playback()
+            self.start_playback(source)
         else:
             # Stop playback
-            self.is_playing = False
-            button.setIcon(QIcon("ico/play.png"))
-            button.setProperty("is_playing", False)
             self.stop_playback()
 
-    def start_playback(self):
-        chunk_size = int(self.sample_rate * 0.1)  # 100ms chunks
-        sd.play(self.audio_output, self.sample_rate)
+    def toggle_result_playback(self, path):
+        if path is None:
+            return
+        if path == self.results_model.playing_path:
+            self.stop_playback()
+            return
+        source = self.file_source(path)
+        if source is None:
+            return
+        self.stop_playback()
+        self.is_playing = True
+        self.results_model.set_playing(path)
+        self.start_playback(source)
+
+    def file_source(self, path):
+        # A prefetched decode plays at once; otherwise it streams from disk
+        try:
+            return self.decoded_cache.source(path)
+        except Exception as e:
+            print(f"Cannot play {path}: {str(e)}")
+            return None
+
+    def start_playback(self, source):
+        self.player.play(source)
         self.audio_timer.start(100)  # Update every 100ms
 
     def stop_playback(self):
         self.audio_timer.stop()
-        sd.stop()
+        self.player.stop()
         self.is_playing = False
         self.play_btn.setText(" Mix")
         self.current_position = 0
+        if self.playing_button is not None:
+            self.playing_button.setIcon(QIcon("ico/play.png"))
+            self.playing_button.setProperty("is_playing", False)
+            self.playing_button = None
+        self.results_model.set_playing(None)
 
     def play_audio_chunk(self):
-        if not sd.get_stream().active:
+        if not self.player.active:
             self.stop_playback()
 
     @staticmethod
     def get_file_type(filename):
         """Determine the type of audio file based on its name"""
-        filename = filename.lower()
-        if any(vocal_term in filename for vocal_term in ['vocals', 'vocal', 'lyrics']):
-            return 'vocals'
-        elif any(music_term in filename for music_term in ['music', 'instruments', 'instrumental']):
-            return 'music'
-        else:
-            return 'original'
+        return get_file_type(filename)
     
     @staticmethod
     def calculate_feature_similarity(features1, features2):
         """Calculate similarity between two sets of audio features"""
-        similarities = {
-            'mfcc': 1 - cosine(features1['mfcc'], features2['mfcc']),
-            'chroma': 1 - cosine(features1['chroma'], features2['chroma']),
-            'spectral_contrast': 1 - cosine(features1['spectral_contrast'], features2['spectral_contrast']),
-            'spectral': 1 - abs(features1['spectral_centroid'] - features2['spectral_centroid']) / max(features1['spectral_centroid'], features2['spectral_centroid'])
-        }
-        
-        # Weights for different feature types
-        weights = {
-            'mfcc': 0.4,  # MFCCs are good for timbre
-            'chroma': 0.3,  # Chroma features capture harmony
-            'spectral_contrast': 0.2,  # Captures tonal vs noise-like content
-            'spectral': 0.1   # Basic spectral properties
-        }
-        
-        return sum(similarities[k] * weights[k] for k in weights)
+        return feature_similarity_pair(features1, features2)
     
     @staticmethod
     def calculate_hash_similarity(hash1, hash2):
         """Calculate similarity between two perceptual hashes"""
-        def calculate_hamming_similarity(hash1, hash2):
-            """Calculate similarity between two hashes using Hamming distance"""
-            try:
-                # Convert hex strings to bytes
-                hash1_bytes = bytes.fromhex(hash1)
-                hash2_bytes = bytes.fromhex(hash2)
-                
-                # Count matching bits
-                matches = sum(1 for a, b in zip(hash1_bytes, hash2_bytes) if a == b)
-                return matches / len(hash1_bytes)
-            except Exception as e:
-                print(f"Error calculating hash similarity: {str(e)}")
-                return 0
-            
-        similarities = {
-            'mfcc': calculate_hamming_similarity(hash1['mfcc_hash'], hash2['mfcc_hash']),
-            'chroma': calculate_hamming_similarity(hash1['chroma_hash'], hash2['chroma_hash']),
-            'energy': calculate_hamming_similarity(hash1['energy_hash'], hash2['energy_hash']),
-            'compact': calculate_hamming_similarity(hash1['compact_hash'], hash2['compact_hash'])
-        }
-        
-        # Weights for different hash types
-        weights = {
-            'mfcc': 0.4,
-            'chroma': 0.3,
-            'energy': 0.2,
-            'compact': 0.1
-        }
-        
-        return sum(similarities[k] * weights[k] for k in weights)
+        return hash_similarity_pair(hash1, hash2)
     
 
+    def match_features(self, query_summary, target_type, k=MAX_RESULTS):
+        """Rank catalog entries of the target type by feature and hash similarity"""
+        query_features = query_summary['features']
+        if self.shards is not None:
+            return self.shards.search(query_features, target_type, k=k)
+
+        # Large catalogs take candidates from the ANN index; small ones are scored in full
+        rows = np.flatnonzero(self.catalog.types == target_type)
+        best_rows, scores = search_catalog(stack_features([query_features]), self.catalog,
+                                           index=self.catalog.ann_index(), rows=rows, k=k)
+        return [{
+            'song_name': self.catalog.names[row],
+            'similarity': float(score)
+        } for row, score in zip(best_rows, scores)]
+
+    def load_landmark_index(self, token):
+        """Background job: landmark index of the current catalog, loaded again only if the catalog changed"""
+        with self.search_lock:
+            token.check()
+            self.catalog.refresh()
+            return self.catalog.landmark_index()
+
+    def match_landmarks(self, query_summary, target_type, k=MAX_RESULTS):
+        """Rank tracks of the target type by the share of query landmarks aligned in time"""
+        keys, offsets = query_summary['landmarks']
+        index = self.catalog.landmark_index()
+        matches = index.query(keys, offsets, top_n=len(index))
+        return [{
+            'song_name': song_name,
+            'similarity': votes / max(len(keys), 1)
+        } for song_name, votes, _ in matches if get_file_type(song_name) == target_type][:k]
+
     def search_similar_songs(self):
         """Enhanced search method with type-based filtering"""
         if not self.file1_path:
-            self.results_table.setRowCount(0)
+            self.jobs.cancel('search')
+            self.results_model.clear()
             return
 
-        try:
-            # Load databases
-            with open("output/feature_hashes.json", "r") as f:
-                hash_database = json.load(f)
-            with open("output/all_features.json", "r") as f:
-                feature_database = json.load(f)
-
-            # Create lookup dictionary for features
-            feature_lookup = {entry['song_name']: entry['features']
-                              for entry in feature_database}
-            hash_lookup = {entry['song_name']: entry['hash']
-                              for entry in hash_database}
-
-            # Determine search type based on input files
-            file1_type = self.get_file_type(self.file1_path)
-            file2_type = self.get_file_type(self.file2_path) if self.file2_path else file1_type
-
-            # Filter database entries based on input types
-            target_type = None
-            if file1_type == 'vocals' and file2_type == 'vocals':
-                target_type = 'vocals'
-            elif file1_type == 'music' and file2_type == 'music':
-                target_type = 'music'
-            elif (file1_type == 'music' and file2_type == 'vocals') or (file1_type == 'vocals' and file2_type == 'music'):
-                target_type = 'original'
-            elif file1_type == 'original' or file2_type == 'original':
-                target_type = 'original'
-
-            # Process current audio
-            if self.file2_path and self.audio_output is not None:
-                temp_mix_path = "temp_mix.wav"
-                sf.write(temp_mix_path, self.audio_output, self.sample_rate)
-                query_path = temp_mix_path
+        # Determine search type based on input files
+        file1_type = self.get_file_type(self.file1_path)
+        file2_type = self.get_file_type(self.file2_path) if self.file2_path else file1_type
+        target_type = route_target_type(file1_type, file2_type)
+
+        self.live_ranking = True
+        if self.file2_path:
+            if self.mix_analysis is None or any(self.jobs.is_busy(channel) for channel in ('track1', 'track2', 'mix')):
+                return  # the pending mix starts the search when it is ready
+            query_analysis = self.mix_analysis
+        else:
+            query_analysis = None
+
+        # Snapshot the GUI state; the search itself runs in the background
+        input_types = (file1_type, self.get_file_type(self.file2_path) if self.file2_path else None)
+        self.jobs.submit('search', self.run_search, self.file1_path, query_analysis,
+                         target_type, self.mode_combo.currentText(), input_types, self.results_spin.value(),
+                         on_partial=self.on_search_page, on_result=self.on_search_done,
+                         on_error=self.on_search_error)
+
+    def run_search(self, token, file1_path, query_analysis, target_type, mode, input_types=(None, None),
+                   k=MAX_RESULTS):
+        """
+        Background job: analyze the query and rank the catalog. The k best
+        results are reported in pages of RESULTS_PAGE, returns the timings.
+        """
+        with self.search_lock, trace("search") as timings:
+            token.check()
+
+            # Blends are decomposed here even with a server, against the local catalog
+            if self.client is not None and mode != "Blend":
+                # Send the file path, or the samples of an in-memory mix
+                with span("server"):
+                    if query_analysis is not None:
+                        results = self.client.identify(y=query_analysis.y, sr=query_analysis.sr, mode=mode.lower(),
+                                                       target_type=target_type, k=k)
+                    else:
+                        results = self.client.identify(path=file1_path, mode=mode.lower(),
+                                                       target_type=target_type, k=k)
+                return self.report_pages(token, results, timings)
+
+            # Load databases (no-op unless the files changed on disk); sharded
+            # feature searches are answered by the shards and never load the catalog here
+            if self.shards is None or mode != "Features":
+                self.catalog.refresh()
+
+            if query_analysis is not None:
+                # In-memory mix: only compute what this mode needs
+                if mode == "Landmarks":
+                    query_summary = {'landmarks': query_analysis.landmarks()}
+                else:
+                    query_summary = {'features': query_analysis.features()}
+            else:
+                # Analyze the query from a single decode, or reuse the cached result
+                hits = self.feature_cache.hits
+                query_summary = self.feature_cache.analyze_file(file1_path)
+                count("cache_hit" if self.feature_cache.hits > hits else "cache_miss")
+            token.check()
+
+            with span("scoring"):
+                if mode == "Landmarks":
+                    results = self.match_landmarks(query_summary, target_type, k)
+                elif mode == "Blend":
+                    results = blend_search(query_summary['features']['mel_power'], self.catalog, *input_types, k=k)
+                else:
+                    results = self.match_features(query_summary, target_type, k)
+            return self.report_pages(token, results, timings)
+
+    @staticmethod
+    def report_pages(token, results, timings):
+        """Stream ranked results to the table a page at a time, best first"""
+        token.report((0, results[:RESULTS_PAGE], timings))
+        for start in range(RESULTS_PAGE, len(results), RESULTS_PAGE):
+            token.check()
+            token.report((start, results[start:start + RESULTS_PAGE], timings))
+        return timings
+
+    def on_search_page(self, page):
+        """The first page replaces the shown results, later ones are appended"""
+        start, results, timings = page
+        with span("render", trace=timings):
+            if start == 0:
+                self.show_results(results)
             else:
-                query_path = self.file1_path
-
-            # Extract features and hash for query
-            query_features = extract_features(query_path)
-            query_hash = hash_features(query_path)
-
-            # Calculate similarities with type filtering
-            similarities = []
-            for hash_entry in hash_database:
-                song_name = hash_entry['song_name']
-                entry_type = self.get_file_type(song_name)
-                
-                # Only process entries matching the target type
-                if entry_type == target_type and song_name in feature_lookup:
-                    hash_sim = self.calculate_hash_similarity(query_hash, hash_lookup[song_name])
-                    feature_sim = self.calculate_feature_similarity(query_features, feature_lookup[song_name])
-                    combined_sim = (0.7 * feature_sim) + (0.3 * hash_sim)
-
-                    similarities.append({
-                        'song_name': song_name,
-                        'similarity': combined_sim
-                    })
-
-            # Sort by similarity
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-
-            # Update table
-            self.results_table.setRowCount(len(similarities))
-            self.results_table.setColumnCount(3)
-            self.results_table.setHorizontalHeaderLabels(
-                ["Song Name", "Similarity", ""])
-            self.results_table.resizeRowsToContents()
-
-            for i, result in enumerate(similarities):
-                song_name_item = QTableWidgetItem(result['song_name'])
-                similarity_item = QTableWidgetItem(
-                    f"{result['similarity']:.2%}")
-                self.results_table.setItem(i, 0, song_name_item)
-                self.results_table.setItem(i, 1, similarity_item)
-
-                res_play_button = QPushButton()
-                res_play_button.setIcon(QIcon("ico/play.png"))
-                res_play_button.setObjectName("res_play_btn")
-                res_play_button.setProperty("is_playing", False)
-
-                # correct file path for each track
-                filepath = f"Music/{result['song_name']}.wav" if os.path.exists(
-                    f"Music/{result['song_name']}.wav") else f"Music/{result['song_name']}.mp3"
-
-                res_play_button.clicked.connect(
-                    lambda _, btn=res_play_button, track_source=filepath: self.toggle_playback(btn, track_source=track_source))
-                res_play_button.setProperty("is_playing", False)
-
-                self.results_table.setCellWidget(i, 2, res_play_button)
-            self.results_table.setSortingEnabled(True)
-
-            # Clean up temporary file
-            if self.file2_path and os.path.exists("temp_mix.wav"):
-                os.remove("temp_mix.wav")
+                self.results_model.add_results(results)
+
+    def on_search_done(self, timings):
+        self.report_timings(timings.finish())
+
+    def report_timings(self, timings):
+        """Show a finished job's stage timings and record them in the log and metrics file"""
+        self.statusBar().showMessage(timings.summary())
+        try:
+            append_log(TIMING_LOG, timings)
+            if self.metrics_path:
+                METRICS.write_prometheus(self.metrics_path)
+        except OSError as e:
+            print(f"Cannot write timings: {str(e)}")
+
+    def toggle_listening(self):
+        if self.listener is not None or self.jobs.is_busy('listen'):
+            self.stop_listening()
+            return
+        # The index may wait for a running search and takes a while to load, so it is loaded in the background
+        self.listen_btn.setText("Stop")
+        self.jobs.submit('listen', self.load_landmark_index,
+                         on_result=self.start_listening, on_error=self.on_listen_error)
 
+    def start_listening(self, index):
+        """Open the microphone once the landmark index is loaded"""
+        try:
+            self.listener = MicrophoneListener(sr=ANALYSIS_PARAMS['sr'])
+            self.listener.start()
         except Exception as e:
-            print(f"Error during search: {str(e)}")
-            self.results_table.setRowCount(0)
+            self.listener = None
+            self.on_listen_error(str(e))
+            return
+        self.matcher = IncrementalMatcher(index, sr=ANALYSIS_PARAMS['sr'])
+        self.results_model.clear()
+        self.listen_timer.start()
+
+    def on_listen_error(self, message):
+        print(f"Cannot start listening: {message}")
+        self.listen_btn.setText("Listen")
+
+    def stop_listening(self):
+        self.listen_timer.stop()
+        self.jobs.cancel('listen')
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.listen_btn.setText("Listen")
+
+    def refine_listening(self):
+        """Fingerprint the audio heard since the last tick and refresh the ranking"""
+        if self.jobs.is_busy('listen'):
+            return  # the previous update is still running; the next tick catches up
+        self.jobs.submit('listen', self.update_listening, self.matcher, self.listener.ring,
+                         self.results_spin.value(), on_result=self.on_listening_update, on_error=self.on_job_error)
+
+    @staticmethod
+    def update_listening(token, matcher, ring, k=MAX_RESULTS):
+        """Background job: add the new landmarks' votes and rank"""
+        matcher.update(ring)
+        similarities = [{
+            'song_name': song_name,
+            'similarity': votes / max(matcher.n_landmarks, 1)
+        } for song_name, votes, _ in matcher.ranking(top_n=k)]
+        return similarities, matcher.is_confident()
+
+    def on_listening_update(self, result):
+        similarities, confident = result
+        if self.listener is None:
+            return
+        if similarities:
+            self.show_results(similarities)
+        if confident or self.listener.seconds >= LISTEN_MAX_SECONDS:
+            self.stop_listening()
+
+    def on_search_error(self, message):
+        print(f"Error during search: {message}")
+        self.results_model.clear()
+
+    def show_results(self, similarities):
+        """Show the ranked matches and decode the top ones in the background"""
+        self.results_model.set_results(similarities)
+        paths = (self.results_model.result_path(result) for result in similarities)
+        self.decoded_cache.prefetch(list(islice(filter(None, paths), PREFETCH_RESULTS)))
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = AudioSimilarityApp()
+    parser = argparse.ArgumentParser(description="Audio similarity search")
+    parser.add_argument("--metrics-file", default=None,
+                        help="write stage timing metrics in the Prometheus text format to this file")
+    parser.add_argument("--server", default=None,
+                        help="search through an identification server (HOST:PORT or unix:PATH) started with server.py")
+    parser.add_argument("--shards", default=None,
+                        help="search the catalog shards served by shards.py (comma-separated HOST:PORT, "
+                             "replicas of a shard separated by '|')")
+    parser.add_argument("--shard-policy", choices=["partial", "strict"], default="partial",
+                        help="answer from the remaining shards when one is down, or fail the search")
+    args, qt_args = parser.parse_known_args()
+
+    shards = None
+    if args.shards:
+        from shards import ShardedSearch
+        shards = ShardedSearch.from_spec(args.shards, failure_policy=args.shard_policy)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = AudioSimilarityApp(metrics_path=args.metrics_file, server_address=args.server, shards=shards)
     window.show()
+    app.processEvents()
+    STARTUP.lap("window")
+    window.warm_up()
     sys.exit(app.exec_())
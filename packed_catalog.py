@@ -0,0 +1,186 @@
+import os
+import json
+import struct
+import argparse
+import numpy as np
+
+PACKED_CATALOG_FILE = "catalog.pack"
+MAGIC = b"APACK001"
+# Columns start on cache-line boundaries
+ALIGNMENT = 64
+
+TRACK_TYPES = ('original', 'vocals', 'music')
+# Feature blocks that may be stored as int8; the scalar features and the blend
+# spectra (power spanning orders of magnitude) always stay float32
+QUANTIZABLE_FEATURES = ('mfcc', 'chroma', 'spectral_contrast')
+FLOAT_FEATURES = ('spectral_centroid', 'spectral_bandwidth', 'mel_power')
+
+
+def quantize(matrix):
+    """
+    int8 codes of a (N, D) matrix with a per-dimension affine scale, so that
+    codes * scale + offset reproduces it to within half a step of its range / 254
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    low = matrix.min(axis=0) if len(matrix) else np.zeros(matrix.shape[1], dtype=np.float32)
+    high = matrix.max(axis=0) if len(matrix) else low
+    scale = (high - low) / 254
+    scale[scale == 0] = 1
+    codes = np.round((matrix - low) / scale) - 127
+    offset = low + 127 * scale
+    return codes.astype(np.int8), scale.astype(np.float32), offset.astype(np.float32)
+
+
+class QuantizedMatrix:
+    """
+    Read-only float32 view of int8 codes: rows are decoded when they are indexed,
+    so the mapped codes are shared between processes and only the rows a search
+    uses are expanded. Supports what the scoring code does with feature matrices.
+    """
+
+    def __init__(self, codes, scale, offset):
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.shape = codes.shape
+        self.ndim = codes.ndim
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        return self.codes[rows].astype(np.float32) * self.scale + self.offset
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+def _string_table(strings):
+    """UTF-8 bytes of all strings back to back, and the (N + 1) offsets delimiting them"""
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def write_packed(catalog, path, quantized=False, source=None):
+    """
+    Write a catalog's names, types, features and LSH codes as one columnar file.
+    source identifies the databases it was converted from; a packed catalog is
+    only used while they are unchanged.
+    """
+    names, name_offsets = _string_table(catalog.names)
+    columns = {
+        'names': names,
+        'name_offsets': name_offsets,
+        'types': np.array([TRACK_TYPES.index(track_type) for track_type in catalog.types], dtype=np.uint8),
+        'lsh_codes': np.asarray(catalog.lsh_codes, dtype=np.uint64),
+    }
+    for key in QUANTIZABLE_FEATURES:
+        if quantized:
+            columns[key], columns[key + '_scale'], columns[key + '_offset'] = quantize(getattr(catalog, key))
+        else:
+            columns[key] = np.asarray(getattr(catalog, key), dtype=np.float32)
+    for key in FLOAT_FEATURES:
+        columns[key] = np.asarray(getattr(catalog, key), dtype=np.float32)
+
+    header = {"tracks": len(catalog.names), "quantized": quantized, "source": source, "columns": {}}
+    position = 0
+    for key, column in columns.items():
+        header["columns"][key] = {"dtype": column.dtype.str, "shape": list(column.shape), "offset": position}
+        position += -(-column.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for key, column in columns.items():
+            f.seek(data_start + header["columns"][key]["offset"])
+            f.write(np.ascontiguousarray(column).tobytes())
+        f.truncate(data_start + position)
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    """Header of a packed catalog and the file offset its columns are relative to"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a packed catalog")
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    return header, -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+
+
+class PackedCatalog:
+    """
+    A packed catalog file mapped with np.memmap: opening it reads only the
+    header and the name table, and feature pages are loaded by the OS as they
+    are scored and shared by every process that maps the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header, data_start = read_header(path)
+        self._file = np.memmap(path, dtype=np.uint8, mode='r')
+        self.columns = {}
+        for key, column in self.header["columns"].items():
+            dtype = np.dtype(column["dtype"])
+            shape = tuple(column["shape"])
+            self.columns[key] = np.ndarray(shape, dtype=dtype, buffer=self._file,
+                                           offset=data_start + column["offset"])
+
+        blob = self.columns['names'].tobytes()
+        offsets = self.columns['name_offsets'].tolist()
+        self.names = [blob[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+        self.types = np.array(TRACK_TYPES, dtype=object)[self.columns['types']]
+
+    @property
+    def source(self):
+        return self.header["source"]
+
+    def __len__(self):
+        return len(self.names)
+
+    def feature(self, key):
+        """A feature matrix: the mapped float32 column, or a decoding view of the int8 codes"""
+        if key + '_scale' in self.columns:
+            return QuantizedMatrix(self.columns[key], self.columns[key + '_scale'], self.columns[key + '_offset'])
+        return self.columns[key]
+
+
+def packed_path(output_folder):
+    return os.path.join(output_folder, PACKED_CATALOG_FILE)
+
+
+def convert(output_folder, quantized=False):
+    """Pack the catalog of the output folder (its segments or JSON databases), returns the number of tracks"""
+    from catalog import Catalog  # catalog imports this module
+
+    catalog = Catalog(output_folder)
+    source = catalog.source_signature()
+    catalog.load(packed=False)
+    write_packed(catalog, packed_path(output_folder), quantized=quantized, source=source)
+    return len(catalog)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the catalog to the memory-mapped packed format")
+    parser.add_argument("command", choices=["convert", "info"])
+    parser.add_argument("--output", default="output", help="folder with the catalog")
+    parser.add_argument("--int8", action="store_true",
+                        help="convert: store the MFCC, chroma and contrast features as int8 (4x smaller)")
+    args = parser.parse_args()
+
+    path = packed_path(args.output)
+    if args.command == "convert":
+        tracks = convert(args.output, quantized=args.int8)
+        print(f"Packed {tracks} tracks into {path} ({os.path.getsize(path) / 1024:.1f} KB)")
+    else:
+        packed = PackedCatalog(path)
+        print(f"{path}: {len(packed)} tracks, {'int8' if packed.header['quantized'] else 'float32'} features, "
+              f"{os.path.getsize(path) / max(len(packed), 1):.0f} bytes per track")
+        for key, column in packed.header["columns"].items():
+            print(f"  {key}: {column['dtype']} {tuple(column['shape'])}")
@@ -0,0 +1,201 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+from audio_io import AUDIO_EXTENSIONS, load_audio
+
+# Frames per callback block; ~23 ms at 44.1 kHz
+BLOCK_SIZE = 1024
+# Blocks read ahead of the stream by the reader thread (~0.75 s at 44.1 kHz)
+READ_AHEAD_BLOCKS = 32
+# Blocks read before the stream starts, so the first callbacks never starve
+PREFILL_BLOCKS = 4
+
+# Decoded results kept for instant replay
+CACHE_BYTES = 256 * 2**20
+
+
+def resolve_track_path(song_name, folder="Music"):
+    """Audio file of a catalog track; names usually carry their extension already"""
+    path = os.path.join(folder, song_name)
+    if song_name.lower().endswith(AUDIO_EXTENSIONS) and os.path.exists(path):
+        return path
+    for extension in AUDIO_EXTENSIONS:
+        if os.path.exists(path + extension):
+            return path + extension
+    return None
+
+
+class ArraySource:
+    """Playback of a decoded mono signal"""
+
+    def __init__(self, y, sr):
+        self.y = np.asarray(y, dtype=np.float32)
+        self.sr = sr
+        self.position = 0
+
+    def read(self, frames):
+        block = self.y[self.position:self.position + frames]
+        self.position += len(block)
+        return block
+
+    def close(self):
+        pass
+
+
+class FileSource:
+    """
+    Playback straight from disk: a reader thread decodes blocks ahead of the
+    stream into a bounded queue, so no file I/O happens in the audio callback
+    and sound starts after the first few blocks instead of a full decode.
+    """
+
+    def __init__(self, path):
+        self.file = sf.SoundFile(path)
+        self.sr = self.file.samplerate
+        self.blocks = queue.Queue(maxsize=READ_AHEAD_BLOCKS)
+        self.pending = np.empty(0, dtype=np.float32)
+        self.stopped = threading.Event()
+        for _ in range(PREFILL_BLOCKS):
+            if not self._read_block():
+                break
+        self.reader = threading.Thread(target=self._read_ahead, daemon=True)
+        self.reader.start()
+
+    def _read_block(self):
+        block = self.file.read(BLOCK_SIZE, dtype='float32', always_2d=True).mean(axis=1, dtype=np.float32)
+        self.blocks.put(block)
+        return len(block) > 0
+
+    def _read_ahead(self):
+        try:
+            while not self.stopped.is_set() and self._read_block():
+                pass
+        finally:
+            self.file.close()
+
+    def read(self, frames):
+        # Called from the audio callback: take what is decoded, never wait on the disk
+        while len(self.pending) < frames:
+            try:
+                block = self.blocks.get_nowait()
+            except queue.Empty:
+                break
+            if not len(block):
+                self.stopped.set()
+                break
+            self.pending = np.concatenate([self.pending, block])
+        block, self.pending = self.pending[:frames], self.pending[frames:]
+        if not len(block) and not self.stopped.is_set():
+            return np.zeros(frames, dtype=np.float32)  # reader behind: a short gap instead of the end
+        return block
+
+    def close(self):
+        self.stopped.set()
+        # Unblock the reader if the queue is full
+        while not self.blocks.empty():
+            self.blocks.get_nowait()
+
+
+class DecodedCache:
+    """
+    LRU cache of decoded tracks (mono, native rate), bounded in bytes. Results can
+    be prefetched in the background so auditioning them starts instantly.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._queued = set()
+
+    def get(self, path):
+        with self._lock:
+            if path not in self._entries:
+                return None
+            self._entries.move_to_end(path)
+            return self._entries[path]
+
+    def put(self, path, y, sr):
+        with self._lock:
+            if path in self._entries:
+                return
+            self._entries[path] = (y, sr)
+            self._bytes += y.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old, _) = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+
+    def _decode(self, path):
+        try:
+            if self.get(path) is None:
+                y, sr = load_audio(path, sr=None)
+                self.put(path, y, sr)
+        except Exception as e:
+            print(f"Cannot prefetch {path}: {str(e)}")
+        finally:
+            with self._lock:
+                self._queued.discard(path)
+
+    def prefetch(self, paths):
+        """Decode tracks in the background, in order, unless cached or queued already"""
+        for path in paths:
+            with self._lock:
+                if path in self._entries or path in self._queued:
+                    continue
+                self._queued.add(path)
+            self._pool.submit(self._decode, path)
+
+    def source(self, path):
+        """Playback source of a file: the cached decode, or a stream from disk (cached for next time)"""
+        cached = self.get(path)
+        if cached is not None:
+            return ArraySource(*cached)
+        self.prefetch([path])
+        try:
+            return FileSource(path)
+        except sf.LibsndfileError:
+            # Formats libsndfile cannot stream are decoded in full
+            return ArraySource(*load_audio(path, sr=None))
+
+
+class Player:
+    """One output stream fed by a callback that pulls blocks from the current source"""
+
+    def __init__(self):
+        self.stream = None
+        self.source = None
+
+    @property
+    def active(self):
+        return self.stream is not None and self.stream.active
+
+    def play(self, source):
+        import sounddevice as sd  # PortAudio is only loaded once something is played
+        self.stop()
+        self.source = source
+        self._callback_stop = sd.CallbackStop
+        self.stream = sd.OutputStream(samplerate=source.sr, channels=1, dtype='float32', blocksize=BLOCK_SIZE,
+                                      callback=self._callback)
+        self.stream.start()
+
+    def _callback(self, outdata, frames, time, status):
+        block = self.source.read(frames)
+        outdata[:len(block), 0] = block
+        if len(block) < frames:
+            outdata[len(block):] = 0
+            raise self._callback_stop
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        if self.source is not None:
+            self.source.close()
+            self.source = None
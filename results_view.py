@@ -0,0 +1,191 @@
+from PyQt5.QtCore import QAbstractTableModel, QEvent, QModelIndex, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import QAbstractItemView, QHeaderView, QStyle, QStyledItemDelegate, QTableView
+from playback import resolve_track_path
+
+NAME_COLUMN, SIMILARITY_COLUMN, PLAY_COLUMN = range(3)
+HEADERS = ["Song Name", "Similarity", ""]
+
+# Results view row height and play icon size, in pixels
+ROW_HEIGHT = 32
+ICON_SIZE = 20
+
+
+class ResultsModel(QAbstractTableModel):
+    """
+    Ranked matches as [{'song_name', 'similarity', ...}]. Cells are formatted
+    only when the view asks for them, i.e. for the visible rows, and sorting is
+    done on the list here instead of by the view, so updating the results costs
+    the same for ten rows as for thousands.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = []
+        self.sort_column = None
+        self.sort_order = Qt.DescendingOrder
+        self.playing_path = None
+        self._paths = {}
+        self.play_icon = QIcon("ico/play.png")
+        self.pause_icon = QIcon("ico/pause.png")
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.results)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        result = self.results[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == NAME_COLUMN:
+                return result['song_name']
+            if column == SIMILARITY_COLUMN:
+                return f"{result['similarity']:.2%}"
+        elif role == Qt.DecorationRole and column == PLAY_COLUMN:
+            path = self.track_path(index.row())
+            if path is None:
+                return None
+            return self.pause_icon if path == self.playing_path else self.play_icon
+        elif role == Qt.TextAlignmentRole and column == SIMILARITY_COLUMN:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def flags(self, index):
+        if index.column() == PLAY_COLUMN:
+            return Qt.ItemIsEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def track_path(self, row):
+        return self.result_path(self.results[row])
+
+    def result_path(self, result):
+        """Audio file of a result (the first track of a blend), looked up once per track"""
+        name = result.get('tracks', [result['song_name']])[0]
+        if name not in self._paths:
+            self._paths[name] = resolve_track_path(name)
+        return self._paths[name]
+
+    def _sort_key(self, column):
+        if column == NAME_COLUMN:
+            return lambda result: result['song_name'].lower()
+        return lambda result: result['similarity']
+
+    def _sorted(self, results):
+        if self.sort_column is None:
+            return list(results)  # rank order
+        return sorted(results, key=self._sort_key(self.sort_column), reverse=self.sort_order == Qt.DescendingOrder)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # Column -1 (no sort indicator) and the play column keep the rank order
+        self.sort_column = column if column in (NAME_COLUMN, SIMILARITY_COLUMN) else None
+        self.sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        self.results = self._sorted(self.results)
+        self.layoutChanged.emit()
+
+    def set_results(self, results):
+        """
+        Replace the results. Rows are updated in place and only the difference in
+        length is inserted or removed, so repeated updates (e.g. the live ranking
+        while listening) keep the scroll position and selection of the view.
+        """
+        results = self._sorted(results)
+        common = min(len(results), len(self.results))
+        if len(results) < len(self.results):
+            self.beginRemoveRows(QModelIndex(), common, len(self.results) - 1)
+            self.results = self.results[:common]
+            self.endRemoveRows()
+        self.results[:common] = results[:common]
+        if common:
+            self.dataChanged.emit(self.index(0, 0), self.index(common - 1, len(HEADERS) - 1))
+        if len(results) > common:
+            self.beginInsertRows(QModelIndex(), common, len(results) - 1)
+            self.results += results[common:]
+            self.endInsertRows()
+
+    def add_results(self, results):
+        """Append results as they arrive, keeping the current sort order"""
+        if self.sort_column is not None:
+            self.set_results(self.results + list(results))
+            return
+        if results:
+            self.beginInsertRows(QModelIndex(), len(self.results), len(self.results) + len(results) - 1)
+            self.results += results
+            self.endInsertRows()
+
+    def clear(self):
+        self.set_results([])
+
+    def set_playing(self, path):
+        """Show the pause icon on the rows of the track being played"""
+        if path == self.playing_path:
+            return
+        self.playing_path = path
+        if self.results:
+            self.dataChanged.emit(self.index(0, PLAY_COLUMN), self.index(len(self.results) - 1, PLAY_COLUMN),
+                                  [Qt.DecorationRole])
+
+
+class PlayButtonDelegate(QStyledItemDelegate):
+    """Paints the play/pause icon of a row and reports clicks on it, instead of a button widget per row"""
+
+    clicked = pyqtSignal(QModelIndex)
+
+    def paint(self, painter, option, index):
+        icon = index.data(Qt.DecorationRole)
+        self.initStyleOption(option, index)
+        option.icon = QIcon()
+        option.features &= ~option.HasDecoration
+        style = option.widget.style() if option.widget else None
+        if style is not None:
+            style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget)
+        if icon is not None:
+            mode = QIcon.Active if option.state & QStyle.State_MouseOver else QIcon.Normal
+            icon.paint(painter, option.rect, Qt.AlignCenter, mode)
+
+    def sizeHint(self, option, index):
+        return QSize(ICON_SIZE, ICON_SIZE)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            if index.data(Qt.DecorationRole) is not None:
+                self.clicked.emit(index)
+            return True
+        return False
+
+
+class ResultsView(QTableView):
+    """Virtualized results table: only visible rows are laid out and painted"""
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.play_delegate = PlayButtonDelegate(self)
+        self.setItemDelegateForColumn(PLAY_COLUMN, self.play_delegate)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setMouseTracking(True)  # hover highlight of the play icon
+
+        # Fixed row heights and column modes keep layout independent of the number of rows
+        vertical = self.verticalHeader()
+        vertical.setSectionResizeMode(QHeaderView.Fixed)
+        vertical.setDefaultSectionSize(ROW_HEIGHT)
+        vertical.hide()
+        horizontal = self.horizontalHeader()
+        horizontal.setSectionResizeMode(NAME_COLUMN, QHeaderView.Stretch)
+        horizontal.setSectionResizeMode(SIMILARITY_COLUMN, QHeaderView.Fixed)
+        horizontal.setSectionResizeMode(PLAY_COLUMN, QHeaderView.Fixed)
+        horizontal.resizeSection(SIMILARITY_COLUMN, 140)
+        horizontal.resizeSection(PLAY_COLUMN, 48)
+
+        # Rank order until a header is clicked
+        horizontal.setSortIndicator(-1, Qt.DescendingOrder)
+        self.setSortingEnabled(True)
@@ -0,0 +1,109 @@
+import numpy as np
+from binary_hash import N_BITS, from_hex, hamming_distance, lsh_codes, popcount
+
+# Weights for different feature types
+FEATURE_WEIGHTS = {
+    'mfcc': 0.4,  # MFCCs are good for timbre
+    'chroma': 0.3,  # Chroma features capture harmony
+    'spectral_contrast': 0.2,  # Captures tonal vs noise-like content
+    'spectral': 0.1   # Basic spectral properties
+}
+
+# Share of the feature and hash similarities in the combined score
+FEATURE_SHARE = 0.7
+HASH_SHARE = 0.3
+
+VECTOR_FEATURES = ('mfcc', 'chroma', 'spectral_contrast')
+
+
+def feature_similarity_pair(features1, features2):
+    """Calculate similarity between two sets of audio features"""
+    # Reference implementation only; scipy.spatial is slow to import
+    from scipy.spatial.distance import cosine
+    similarities = {
+        'mfcc': 1 - cosine(features1['mfcc'], features2['mfcc']),
+        'chroma': 1 - cosine(features1['chroma'], features2['chroma']),
+        'spectral_contrast': 1 - cosine(features1['spectral_contrast'], features2['spectral_contrast']),
+        'spectral': 1 - abs(features1['spectral_centroid'] - features2['spectral_centroid']) / max(features1['spectral_centroid'], features2['spectral_centroid'])
+    }
+    return sum(similarities[k] * FEATURE_WEIGHTS[k] for k in FEATURE_WEIGHTS)
+
+
+def hash_similarity_pair(hash1, hash2):
+    """Calculate similarity between two locality-sensitive hashes as the share of equal bits"""
+    code1 = from_hex(hash1['lsh_hash'])
+    code2 = from_hex(hash2['lsh_hash'])
+    return 1 - int(popcount(code1 ^ code2).sum()) / N_BITS
+
+
+def stack_features(features_list):
+    """Stack feature dicts of several queries into (Q, D) arrays"""
+    stacked = {key: np.asarray([features[key] for features in features_list], dtype=np.float32)
+               for key in VECTOR_FEATURES}
+    stacked['spectral_centroid'] = np.asarray(
+        [features['spectral_centroid'] for features in features_list], dtype=np.float32)
+    return stacked
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def feature_vectors(features):
+    """
+    One vector per row combining the MFCC, chroma and contrast blocks. Each block
+    is L2-normalized and scaled by the square root of its weight, so the dot
+    product of two vectors is the weighted sum of the blocks' cosine similarities.
+    """
+    return np.hstack([np.sqrt(FEATURE_WEIGHTS[key]) * _normalize_rows(np.asarray(features[key], dtype=np.float32))
+                      for key in VECTOR_FEATURES])
+
+
+def feature_similarity(query_features, catalog, rows=None):
+    """
+    Weighted feature similarity of every query against catalog rows.
+    query_features is the output of stack_features; returns a (Q, N) matrix.
+    """
+    rows = slice(None) if rows is None else rows
+    catalog_features = {key: getattr(catalog, key)[rows] for key in VECTOR_FEATURES}
+    scores = feature_vectors(query_features) @ feature_vectors(catalog_features).T
+
+    query_centroid = query_features['spectral_centroid'][:, None]
+    catalog_centroid = catalog.spectral_centroid[rows][None, :]
+    spectral = 1 - np.abs(query_centroid - catalog_centroid) / np.maximum(query_centroid, catalog_centroid)
+    return scores + FEATURE_WEIGHTS['spectral'] * spectral
+
+
+def hash_similarity(query_codes, catalog, rows=None):
+    """
+    Share of equal bits between the queries' LSH codes (Q, W) and catalog rows,
+    computed with XOR + popcount; returns a (Q, N) matrix.
+    """
+    rows = slice(None) if rows is None else rows
+    return 1 - hamming_distance(query_codes, catalog.lsh_codes[rows]) / N_BITS
+
+
+def combined_similarity(query_features, catalog, rows=None, query_codes=None):
+    """Combined score used for ranking, (Q, N)"""
+    if query_codes is None:
+        query_codes = lsh_codes(feature_vectors(query_features))
+    return (FEATURE_SHARE * feature_similarity(query_features, catalog, rows)
+            + HASH_SHARE * hash_similarity(query_codes, catalog, rows))
+
+
+def top_k(scores, k):
+    """
+    Indices of the k highest scores along the last axis, best first.
+    Uses a partial selection so only the selected k are sorted.
+    """
+    scores = np.asarray(scores)
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < scores.shape[-1]:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=-1)
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import fcntl
+import argparse
+from contextlib import contextmanager
+import numpy as np
+from audioProcessor import BLEND_BANDS
+from binary_hash import from_hex
+from fingerprint import LandmarkIndex
+from spectrograms import phashes
+
+SEGMENT_FOLDER = "segments"
+MANIFEST_FILE = "MANIFEST.json"
+LOCK_FILE = "LOCK"
+
+FEATURE_ARRAYS = ('mfcc', 'chroma', 'spectral_contrast', 'spectral_centroid', 'spectral_bandwidth', 'mel_power')
+TRACK_ARRAYS = ('names', 'sha256') + FEATURE_ARRAYS + ('lsh_codes', 'hashes', 'spectrogram_hashes', 'landmark_counts')
+LANDMARK_ARRAYS = ('landmark_keys', 'landmark_offsets')
+
+# Compaction is due once there are more segments than this
+MAX_SEGMENTS = 8
+# Files replaced by a compaction are kept this long for readers still loading an older snapshot
+OBSOLETE_GRACE_SECONDS = 60.0
+
+
+def segment_file(seq):
+    return f"segment_{seq:08d}.npz"
+
+
+class Segment:
+    """
+    One immutable segment file: the tracks added in one catalog update (or merged
+    by a compaction), with their features, hashes and landmarks. Track arrays are
+    row-aligned; landmarks are concatenated track by track, landmark_counts long.
+    """
+
+    def __init__(self, seq, arrays):
+        self.seq = seq
+        self.arrays = arrays
+        self.names = [str(name) for name in arrays['names']]
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            seq = int(data['seq'])
+            arrays = {key: data[key] for key in TRACK_ARRAYS + LANDMARK_ARRAYS if key in data}
+        if 'mel_power' not in arrays:
+            # Written before blend spectra existed: an empty spectrum never explains a blend
+            arrays['mel_power'] = np.zeros((len(arrays['names']), BLEND_BANDS), dtype=np.float32)
+        return cls(seq, arrays)
+
+    def select(self, rows):
+        """Arrays of some rows (in increasing order), with their landmarks"""
+        keep = np.zeros(len(self), dtype=bool)
+        keep[rows] = True
+        selected = {key: self.arrays[key][keep] for key in TRACK_ARRAYS}
+        landmark_keep = np.repeat(keep, self.arrays['landmark_counts'])
+        for key in LANDMARK_ARRAYS:
+            selected[key] = self.arrays[key][landmark_keep]
+        return selected
+
+
+def records_to_arrays(records):
+    """
+    Segment arrays of ingested tracks. A record holds song_name, sha256, features,
+    hash and landmarks as in the analysis summary, and the spectrogram thumbnail.
+    """
+    arrays = {
+        'names': np.array([record['song_name'] for record in records], dtype=str),
+        'sha256': np.array([record['sha256'] for record in records], dtype=str),
+    }
+    for key in FEATURE_ARRAYS:
+        arrays[key] = np.array([record['features'][key] for record in records], dtype=np.float32)
+    arrays['lsh_codes'] = np.array([from_hex(record['hash']['lsh_hash']) for record in records])
+    arrays['hashes'] = np.array([json.dumps(record['hash']) for record in records], dtype=str)
+    # Perceptual hashes of the new spectrograms in one vectorized pass
+    arrays['spectrogram_hashes'] = np.array(phashes([record['spectrogram'] for record in records]), dtype=str)
+    arrays['landmark_counts'] = np.array([len(record['landmarks'][0]) for record in records], dtype=np.int64)
+    arrays['landmark_keys'] = np.concatenate([np.asarray(record['landmarks'][0], dtype=np.uint32)
+                                              for record in records])
+    arrays['landmark_offsets'] = np.concatenate([np.asarray(record['landmarks'][1], dtype=np.int32)
+                                                 for record in records])
+    return arrays
+
+
+def concatenate_arrays(parts):
+    return {key: np.concatenate([part[key] for part in parts]) for key in TRACK_ARRAYS + LANDMARK_ARRAYS}
+
+
+def live_rows(segments, tombstones):
+    """
+    Rows of each segment that are visible: the newest copy of every track, unless
+    a later tombstone deleted it. A tombstone with sequence number t deletes the
+    copies in segments older than t.
+    """
+    seen = set()
+    rows = {}
+    for segment in sorted(segments, key=lambda segment: -segment.seq):
+        keep = []
+        for row, name in enumerate(segment.names):
+            if name not in seen and tombstones.get(name, 0) <= segment.seq:
+                keep.append(row)
+            seen.add(name)
+        rows[segment.seq] = np.array(keep, dtype=np.int64)
+    return rows
+
+
+class Snapshot:
+    """
+    Consistent, read-only view of the catalog at one manifest generation: the
+    live tracks of its segments in segment order. Later updates never change it.
+    """
+
+    def __init__(self, generation, segments, tombstones):
+        self.generation = generation
+        segments = sorted(segments, key=lambda segment: segment.seq)
+        rows = live_rows(segments, tombstones)
+        parts = [segment.select(rows[segment.seq]) for segment in segments]
+        self.arrays = concatenate_arrays(parts) if parts else None
+        self.names = [str(name) for name in self.arrays['names']] if parts else []
+        self._landmark_index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def landmark_index(self):
+        """Landmark index of the snapshot's tracks, built on first use"""
+        if self._landmark_index is None:
+            index = LandmarkIndex()
+            if self.names:
+                index.add_many(self.names, self.arrays['landmark_keys'], self.arrays['landmark_offsets'],
+                               self.arrays['landmark_counts'])
+                index.finalize()
+            self._landmark_index = index
+        return self._landmark_index
+
+
+class SegmentStore:
+    """
+    Append-only catalog storage. Every update writes one small immutable segment
+    with the added or changed tracks and records deletions as tombstones, so its
+    cost is proportional to the change. The manifest, which lists the live
+    segments, is the only file ever replaced (atomically), so readers always see
+    a complete generation. Compaction merges segments in the background.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, MANIFEST_FILE)
+        # Segments are immutable, so loaded ones are shared by all snapshots
+        self._segments = {}
+        self._snapshot = None
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def signature(self):
+        """Changes whenever a new generation is committed"""
+        try:
+            stat = os.stat(self.manifest_path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "next_seq": 1, "segments": [], "tombstones": {}, "obsolete": []}
+
+    @contextmanager
+    def _locked(self):
+        """Serialize manifest updates of concurrent writers (an ingest and a compaction)"""
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _commit(self, manifest):
+        manifest["generation"] += 1
+        # Remove files replaced by earlier compactions once no reader can still need them
+        now = time.time()
+        expired = [entry for entry in manifest["obsolete"] if now - entry[1] > OBSOLETE_GRACE_SECONDS]
+        for file_name, _ in expired:
+            path = os.path.join(self.folder, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+        manifest["obsolete"] = [entry for entry in manifest["obsolete"] if entry not in expired]
+
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_segment(self, seq, arrays, file_name=None):
+        file_name = file_name or segment_file(seq)
+        path = os.path.join(self.folder, file_name)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, seq=seq, **arrays)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return {"file": file_name, "seq": seq, "tracks": len(arrays['names'])}
+
+    def update(self, records=(), deleted=()):
+        """
+        Add (or replace) tracks and delete tracks by name in one new generation.
+        records are as in records_to_arrays.
+        """
+        records = list(records)
+        added = {record['song_name'] for record in records}
+        deleted = [name for name in deleted if name not in added]
+        if not records and not deleted:
+            return
+        with self._locked():
+            manifest = self.read_manifest()
+            if records:
+                seq = manifest["next_seq"]
+                manifest["next_seq"] += 1
+                manifest["segments"].append(self._write_segment(seq, records_to_arrays(records)))
+            if deleted:
+                seq = manifest["next_seq"]
+                manifest["next_seq"] += 1
+                manifest["tombstones"].update((name, seq) for name in deleted)
+            self._commit(manifest)
+
+    def _load_segment(self, file_name):
+        if file_name not in self._segments:
+            self._segments[file_name] = Segment.load(os.path.join(self.folder, file_name))
+        return self._segments[file_name]
+
+    def snapshot(self):
+        """The current generation, loading only segments not seen before"""
+        for attempt in range(3):
+            manifest = self.read_manifest()
+            if self._snapshot is not None and self._snapshot.generation == manifest["generation"]:
+                return self._snapshot
+            try:
+                segments = [self._load_segment(entry["file"]) for entry in manifest["segments"]]
+            except FileNotFoundError:
+                continue  # compacted away while this reader was behind; read the newer manifest
+            live = {entry["file"] for entry in manifest["segments"]}
+            self._segments = {file_name: segment for file_name, segment in self._segments.items()
+                              if file_name in live}
+            self._snapshot = Snapshot(manifest["generation"], segments, manifest["tombstones"])
+            return self._snapshot
+        raise RuntimeError(f"Catalog segments in {self.folder} keep changing while loading")
+
+    @staticmethod
+    def plan_compaction(segments, full=False):
+        """
+        Segments to merge: with full, all of them; otherwise, once there are more
+        than MAX_SEGMENTS, the newest two extended back over every older segment
+        no larger than the run so far. Large old segments are thus rarely
+        rewritten, and merged segments are always consecutive so newer copies still win.
+        """
+        if full:
+            return segments
+        if len(segments) <= MAX_SEGMENTS:
+            return []
+        start = len(segments) - 2
+        total = segments[-1]["tracks"] + segments[-2]["tracks"]
+        while start > 0 and segments[start - 1]["tracks"] <= total:
+            start -= 1
+            total += segments[start]["tracks"]
+        return segments[start:]
+
+    def compact(self, full=False):
+        """Merge segments into one, dropping deleted and replaced copies. Returns the number merged."""
+        with self._locked():
+            manifest = self.read_manifest()
+        plan = self.plan_compaction(manifest["segments"], full)
+        if not plan:
+            return 0
+
+        # The merge runs without the lock; updates committed meanwhile only add newer segments and tombstones
+        segments = [Segment.load(os.path.join(self.folder, entry["file"])) for entry in plan]
+        rows = live_rows(segments, manifest["tombstones"])
+        merged = concatenate_arrays([segment.select(rows[segment.seq]) for segment in segments])
+        # The merged segment takes the newest sequence number of its run
+        seq = plan[-1]["seq"]
+        merged_entry = self._write_segment(seq, merged,
+                                           file_name=f"segment_{seq:08d}_{manifest['generation']:06d}.npz")
+
+        with self._locked():
+            current = self.read_manifest()
+            planned = {entry["file"] for entry in plan}
+            kept = [entry for entry in current["segments"] if entry["file"] not in planned]
+            current["segments"] = sorted(kept + [merged_entry], key=lambda entry: entry["seq"])
+            if current["segments"][0] is merged_entry:
+                # Nothing older is left, so the tombstones the merge applied are no longer needed
+                applied = manifest["tombstones"]
+                current["tombstones"] = {name: tomb_seq for name, tomb_seq in current["tombstones"].items()
+                                         if applied.get(name) != tomb_seq}
+            current["obsolete"] += [[file_name, time.time()] for file_name in sorted(planned)]
+            self._commit(current)
+        return len(plan)
+
+    def export_json(self, output_folder):
+        """Write the current generation as the JSON databases older tools read"""
+        # Imported here: catalog and ingest import this module
+        from ingest import atomic_write_json
+        from catalog import FEATURES_FILE, HASHES_FILE, SPECTROGRAM_HASHES_FILE
+        from fingerprint import LANDMARK_INDEX_FILE
+
+        snapshot = self.snapshot()
+        arrays = snapshot.arrays
+        features = [{
+            "song_name": name,
+            "features": {key: arrays[key][i].tolist() for key in FEATURE_ARRAYS}
+        } for i, name in enumerate(snapshot.names)]
+        atomic_write_json(features, os.path.join(output_folder, FEATURES_FILE))
+        atomic_write_json([{"song_name": name, "hash": json.loads(str(arrays['hashes'][i]))}
+                           for i, name in enumerate(snapshot.names)], os.path.join(output_folder, HASHES_FILE))
+        atomic_write_json([{"song_name": name, "hash": str(arrays['spectrogram_hashes'][i])}
+                           for i, name in enumerate(snapshot.names)],
+                          os.path.join(output_folder, SPECTROGRAM_HASHES_FILE))
+        snapshot.landmark_index().save(os.path.join(output_folder, LANDMARK_INDEX_FILE))
+        return len(snapshot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the segmented catalog storage")
+    parser.add_argument("command", choices=["status", "compact", "export"])
+    parser.add_argument("--output", default="output", help="folder with the catalog")
+    parser.add_argument("--full", action="store_true", help="compact: merge all segments into one")
+    args = parser.parse_args()
+
+    store = SegmentStore(os.path.join(args.output, SEGMENT_FOLDER))
+    if args.command == "status":
+        manifest = store.read_manifest()
+        print(f"Generation {manifest['generation']}: {len(store.snapshot())} tracks in "
+              f"{len(manifest['segments'])} segments, {len(manifest['tombstones'])} tombstones")
+        for entry in manifest["segments"]:
+            print(f"  {entry['file']}: {entry['tracks']} tracks")
+    elif args.command == "compact":
+        print(f"Merged {store.compact(full=args.full)} segments")
+    else:
+        print(f"Exported {store.export_json(args.output)} tracks to {args.output}")
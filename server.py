@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import base64
+import socket
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from audioProcessor import AudioAnalysis
+from audio_io import resample
+from ann import search_catalog
+from cache import ANALYSIS_PARAMS, FeatureCache
+from catalog import Catalog, get_file_type, route_target_type
+from scoring import combined_similarity, stack_features, top_k
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+MAX_RESULTS = 100
+
+# Micro-batching: queries arriving within the window are scored together
+MAX_BATCH = 64
+BATCH_WINDOW = 0.005  # seconds
+
+# Requests are JSON lines; raw PCM makes them large
+MAX_REQUEST_BYTES = 64 * 2**20
+
+
+def parse_address(address):
+    """'unix:PATH' or 'HOST:PORT' as ('unix', path) or ('tcp', (host, port))"""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+# Per-process cache of analysis results, shared on disk by all workers
+_worker_cache = None
+
+
+def analyze_query(path, pcm, sr, mode, cache_folder):
+    """
+    Worker: analysis summary of a query. Files are analyzed once and cached by
+    content; raw PCM (e.g. a live mix) only computes what the mode needs.
+    """
+    global _worker_cache
+    if path is not None:
+        if _worker_cache is None:
+            _worker_cache = FeatureCache(disk_folder=cache_folder)
+        return _worker_cache.analyze_file(path)
+
+    analysis = AudioAnalysis(resample(pcm, sr, ANALYSIS_PARAMS['sr']), sr=ANALYSIS_PARAMS['sr'])
+    if mode == "landmarks":
+        return {'landmarks': analysis.landmarks()}
+    return {'features': analysis.features(ANALYSIS_PARAMS['n_mfcc'])}
+
+
+def _attempt(rank):
+    """Result of rank(), or the exception it raised"""
+    try:
+        return rank()
+    except Exception as e:
+        return e
+
+
+class IdentificationServer:
+    """
+    Headless identification service. The catalog is loaded once (and reloaded
+    when its files change); feature extraction runs in a process pool, and
+    feature queries that arrive together are ranked in one vectorized pass.
+
+    Protocol: one JSON object per line in each direction. A request holds
+    either "path" (a file readable by the server) or "pcm" (base64 little-endian
+    float32 mono samples) with "sr", plus optional "id", "mode" ("features" or
+    "landmarks"), "target_type" and "k". Already extracted "features" (lists, as
+    in all_features.json) are ranked directly. The response repeats the "id" and has
+    "results" (song_name and similarity, best first) or "error".
+    """
+
+    def __init__(self, output_folder="output", workers=None, max_batch=MAX_BATCH, batch_window=BATCH_WINDOW,
+                 catalog=None):
+        # Any catalog with refresh(), names, types, the feature arrays and ann_index() (e.g. one shard)
+        self.catalog = catalog if catalog is not None else Catalog(output_folder)
+        self.cache_folder = os.path.join(output_folder, "cache")
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.analysis_pool = ProcessPoolExecutor(max_workers=workers)
+        # Ranking runs off the event loop, one batch at a time
+        self.ranking_pool = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+
+    async def serve(self, address=DEFAULT_ADDRESS):
+        self.queue = asyncio.Queue()
+        self.catalog.refresh()
+        batcher = asyncio.create_task(self._batch_loop())
+
+        kind, target = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            server = await asyncio.start_unix_server(self._handle_client, path=target, limit=MAX_REQUEST_BYTES)
+        else:
+            server = await asyncio.start_server(self._handle_client, *target, limit=MAX_REQUEST_BYTES)
+        print(f"Serving {len(self.catalog)} tracks on {address}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if kind == "unix" and os.path.exists(target):
+                os.remove(target)
+
+    def close(self):
+        self.analysis_pool.shutdown(cancel_futures=True)
+        self.ranking_pool.shutdown(cancel_futures=True)
+
+    async def _handle_client(self, reader, writer):
+        # Requests on one connection are answered as they finish, matched by their id
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            print(f"Client error: {e}")
+        finally:
+            writer.close()
+
+    async def _respond(self, line, writer):
+        request = {}
+        try:
+            request = json.loads(line)
+            response = await self.identify(request)
+        except Exception as e:
+            response = {"id": request.get("id") if isinstance(request, dict) else None, "error": str(e)}
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def identify(self, request):
+        """Analyze one request in the worker pool and queue it for batched ranking"""
+        loop = asyncio.get_running_loop()
+        mode = request.get("mode", "features")
+        if mode not in ("features", "landmarks"):
+            raise ValueError(f"Unknown mode: {mode}")
+        path = request.get("path")
+        pcm, sr, summary = None, None, None
+        if "features" in request:
+            if mode != "features":
+                raise ValueError("Extracted features can only be ranked in features mode")
+            summary = {'features': request["features"]}
+            target_type = request.get("target_type")
+        elif path is not None:
+            file_type = get_file_type(os.path.basename(path))
+            target_type = request.get("target_type") or route_target_type(file_type, file_type)
+        elif "pcm" in request:
+            pcm = np.frombuffer(base64.b64decode(request["pcm"]), dtype='<f4')
+            sr = int(request.get("sr", ANALYSIS_PARAMS['sr']))
+            target_type = request.get("target_type")
+        else:
+            raise ValueError("Request needs a 'path' or 'pcm'")
+
+        start = time.perf_counter()
+        if summary is None:
+            summary = await loop.run_in_executor(self.analysis_pool, analyze_query, path, pcm, sr, mode,
+                                                 self.cache_folder)
+        analyzed = time.perf_counter()
+
+        future = loop.create_future()
+        await self.queue.put((mode, summary, target_type, int(request.get("k", MAX_RESULTS)), future))
+        results, batch_size = await future
+        return {
+            "id": request.get("id"),
+            "target_type": target_type,
+            "results": results,
+            "batch_size": batch_size,
+            "analysis_ms": (analyzed - start) * 1000,
+            "search_ms": (time.perf_counter() - analyzed) * 1000,
+        }
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                rankings = await loop.run_in_executor(self.ranking_pool, self.rank_batch,
+                                                      [query[:4] for query in batch])
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (*_, future), ranking in zip(batch, rankings):
+                if future.done():
+                    continue
+                if isinstance(ranking, Exception):
+                    future.set_exception(ranking)
+                else:
+                    future.set_result((ranking, len(batch)))
+
+    def rank_batch(self, queries):
+        """
+        Rankings of (mode, summary, target_type, k) queries, in order. A query
+        that fails gets its exception instead of a ranking, so only its own
+        request receives the error.
+        """
+        self.catalog.refresh()
+        rankings = [None] * len(queries)
+        feature_queries = [i for i, query in enumerate(queries) if query[0] == "features"]
+        if feature_queries:
+            try:
+                feature_rankings = self.rank_features([queries[i][1:] for i in feature_queries])
+            except Exception:
+                # Rank them one at a time so only the failing query gets the error
+                feature_rankings = [_attempt(lambda: self.rank_features([queries[i][1:]])[0]) for i in feature_queries]
+            for i, ranking in zip(feature_queries, feature_rankings):
+                rankings[i] = ranking
+        for i, (mode, summary, target_type, k) in enumerate(queries):
+            if mode == "landmarks":
+                rankings[i] = _attempt(lambda: self.rank_landmarks(summary, target_type, k))
+        return rankings
+
+    def rank_features(self, queries):
+        """Feature rankings of (summary, target_type, k) queries, scored together"""
+        catalog = self.catalog
+        query_features = stack_features([summary['features'] for summary, _, _ in queries])
+        index = catalog.ann_index()
+        if index is not None:
+            # Large catalog: each query takes its own candidates from the ANN index
+            rankings = []
+            for q, (_, target_type, k) in enumerate(queries):
+                rows = np.arange(len(catalog)) if target_type is None else np.flatnonzero(catalog.types == target_type)
+                features = {key: value[q:q + 1] for key, value in query_features.items()}
+                best_rows, scores = search_catalog(features, catalog, index=index, rows=rows, k=k)
+                rankings.append(self._results(best_rows, scores))
+            return rankings
+
+        # One (Q, N) scoring pass for the whole batch, then per-query type filtering
+        scores = combined_similarity(query_features, catalog)
+        rankings = []
+        for q, (_, target_type, k) in enumerate(queries):
+            eligible = np.ones(len(catalog), dtype=bool) if target_type is None else catalog.types == target_type
+            masked = np.where(eligible, scores[q], -np.inf)
+            best_rows = top_k(masked, min(k, int(eligible.sum())))
+            rankings.append(self._results(best_rows, scores[q, best_rows]))
+        return rankings
+
+    def _results(self, rows, scores):
+        return [{'song_name': self.catalog.names[row], 'similarity': float(score)} for row, score in zip(rows, scores)]
+
+    def rank_landmarks(self, summary, target_type, k):
+        keys, offsets = summary['landmarks']
+        index = self.catalog.landmark_index()
+        matches = index.query(keys, offsets, top_n=len(index))
+        return [{
+            'song_name': song_name,
+            'similarity': votes / max(len(keys), 1)
+        } for song_name, votes, _ in matches if target_type is None or get_file_type(song_name) == target_type][:k]
+
+
+class JsonLinesClient:
+    """Blocking JSON-lines client over one persistent connection"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+        self.next_id = 0
+
+    def _connect(self):
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(target)
+        else:
+            self.sock = socket.create_connection(target, timeout=self.timeout)
+        self.stream = self.sock.makefile("rb")
+
+    def close(self):
+        if self.sock is not None:
+            self.stream.close()
+            self.sock.close()
+            self.sock = None
+
+    def request(self, request):
+        """Send one request and return its response, raising RuntimeError on a server-side error"""
+        self.next_id += 1
+        request = dict(request, id=self.next_id)
+        line = (json.dumps(request) + "\n").encode()
+
+        # Reconnect once if the server restarted since the last request
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self._connect()
+                self.sock.sendall(line)
+                response = self.stream.readline()
+                if not response:
+                    raise ConnectionError("Server closed the connection")
+                break
+            except (ConnectionError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+
+        response = json.loads(response)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+
+class IdentificationClient(JsonLinesClient):
+    """Blocking client of the identification server"""
+
+    def identify(self, path=None, y=None, sr=None, mode="features", target_type=None, k=MAX_RESULTS):
+        """Ranked matches for a file path or a decoded mono signal, as [{'song_name', 'similarity'}]"""
+        request = {"mode": mode, "target_type": target_type, "k": k}
+        if path is not None:
+            request["path"] = os.path.abspath(path)
+        else:
+            request["pcm"] = base64.b64encode(np.ascontiguousarray(y, dtype='<f4').tobytes()).decode()
+            request["sr"] = sr
+        return self.request(request)["results"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve song identification over a local socket")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="HOST:PORT or unix:PATH (default: %(default)s)")
+    parser.add_argument("--output", default="output", help="folder with the catalog databases")
+    parser.add_argument("--workers", type=int, default=None, help="analysis worker processes (default: all cores)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="most queries ranked in one pass")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW * 1000,
+                        help="how long a query waits for others to join its batch")
+    args = parser.parse_args()
+
+    server = IdentificationServer(args.output, args.workers, args.max_batch, args.batch_window_ms / 1000)
+    try:
+        asyncio.run(server.serve(args.address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
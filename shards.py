@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ann import ANN_MIN_TRACKS, build_catalog_index
+from catalog import Catalog, get_file_type
+from server import IdentificationServer, JsonLinesClient
+from scoring import top_k
+from timing import span
+
+SHARD_FOLDER = "shards"
+MANIFEST_FILE = "shards.json"
+SHARD_ARRAYS = ('mfcc', 'chroma', 'spectral_contrast', 'spectral_centroid', 'spectral_bandwidth', 'lsh_codes')
+
+# A shard that failed is skipped for this long before it is tried again
+RETRY_SECONDS = 30.0
+
+# Queries reach a shard already extracted, so they wait less to be batched than at the server
+SHARD_BATCH_WINDOW = 0.001  # seconds
+
+
+def shard_file(index):
+    return f"shard_{index:03d}.npz"
+
+
+def shard_owner(name, n_shards):
+    """
+    Shard of a track by rendezvous (highest random weight) hashing: every shard
+    scores the name and the highest score wins. Going from N to N + 1 shards only
+    moves the ~1/(N + 1) of the tracks the new shard now wins.
+    """
+    weights = [hashlib.blake2b(f"{shard}:{name}".encode(), digest_size=8).digest() for shard in range(n_shards)]
+    return max(range(n_shards), key=weights.__getitem__)
+
+
+def read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_shards(catalog, folder, n_shards):
+    """
+    Partition the catalog into n_shards files, replacing the current split, and
+    return how many tracks changed shard. Shard files are replaced atomically, so
+    running shards pick up the new split on their next query.
+    """
+    os.makedirs(folder, exist_ok=True)
+    previous = {}
+    manifest = read_manifest(folder)
+    if manifest is not None:
+        for index, entry in enumerate(manifest["shards"]):
+            with np.load(os.path.join(folder, entry["file"])) as data:
+                previous.update((str(name), index) for name in data["names"])
+
+    owners = np.array([shard_owner(name, n_shards) for name in catalog.names], dtype=np.int64)
+    names = np.array(catalog.names)
+    shards = []
+    for index in range(n_shards):
+        rows = np.flatnonzero(owners == index)
+        path = os.path.join(folder, shard_file(index))
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, names=names[rows], **{key: getattr(catalog, key)[rows] for key in SHARD_ARRAYS})
+        os.replace(tmp_path, path)
+        shards.append({"file": shard_file(index), "tracks": len(rows)})
+
+    # Shards beyond the new count are no longer served
+    old_count = len(manifest["shards"]) if manifest is not None else 0
+    for index in range(n_shards, old_count):
+        path = os.path.join(folder, shard_file(index))
+        if os.path.exists(path):
+            os.remove(path)
+
+    tmp_path = os.path.join(folder, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"n_shards": n_shards, "shards": shards}, f, indent=4)
+    os.replace(tmp_path, os.path.join(folder, MANIFEST_FILE))
+
+    return sum(1 for name, owner in zip(catalog.names, owners) if previous.get(name, owner) != owner)
+
+
+class ShardCatalog:
+    """One shard of the catalog, reloaded when its file is replaced (e.g. by a rebalance)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self.names = []
+        self.types = np.empty(0, dtype=object)
+        self._ann_index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def refresh(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        with np.load(self.path) as data:
+            self.names = [str(name) for name in data["names"]]
+            for key in SHARD_ARRAYS:
+                setattr(self, key, data[key])
+        self.types = np.array([get_file_type(name) for name in self.names], dtype=object)
+        self._ann_index = None
+        self._mtime = mtime
+        return True
+
+    def ann_index(self):
+        """In-memory ANN index of the shard, for shards too large to scan"""
+        if len(self) < ANN_MIN_TRACKS:
+            return None
+        if self._ann_index is None:
+            with span("ann_build"):
+                self._ann_index = build_catalog_index(self)
+        return self._ann_index
+
+
+def serve_shard(path, address, batch_window=SHARD_BATCH_WINDOW):
+    """Serve feature queries against one shard file (one process per shard)"""
+    server = IdentificationServer(workers=1, batch_window=batch_window, catalog=ShardCatalog(path))
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+class ShardedSearch:
+    """
+    Scatter-gather coordinator: a feature query is sent to every shard at once,
+    each shard returns its local top k and the merged ranking keeps the best k.
+
+    shards is a list of address lists: the first address of a shard is its
+    primary and the others are replicas, tried in order when it fails. A shard
+    whose addresses all fail is skipped for RETRY_SECONDS. With the "partial"
+    failure policy the remaining shards' results are returned (and the missing
+    shards reported in last_missing); with "strict" the query fails.
+    """
+
+    def __init__(self, shards, timeout=5.0, failure_policy="partial"):
+        if failure_policy not in ("partial", "strict"):
+            raise ValueError(f"Unknown failure policy: {failure_policy}")
+        self.shards = [[JsonLinesClient(address, timeout=timeout) for address in addresses] for addresses in shards]
+        self.failure_policy = failure_policy
+        self.down_until = [0.0] * len(shards)
+        self.last_missing = []
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(shards)))
+
+    @classmethod
+    def from_spec(cls, spec, **kwargs):
+        """Shards from 'A,B|C': shards separated by commas, replicas of a shard by '|'"""
+        return cls([addresses.split("|") for addresses in spec.split(",") if addresses], **kwargs)
+
+    def close(self):
+        self.pool.shutdown()
+        for replicas in self.shards:
+            for client in replicas:
+                client.close()
+
+    def _query_shard(self, index, request):
+        errors = []
+        for client in self.shards[index]:
+            try:
+                return client.request(request)["results"]
+            except (OSError, RuntimeError, ValueError) as e:
+                # The connection may hold a late response; start the next request on a new one
+                client.close()
+                errors.append(f"{client.address}: {str(e) or type(e).__name__}")
+        self.down_until[index] = time.monotonic() + RETRY_SECONDS
+        raise ConnectionError(f"Shard {index} failed ({'; '.join(errors)})")
+
+    def search(self, query_features, target_type=None, k=100):
+        """Merged top-k of one query's features over all shards, as [{'song_name', 'similarity'}]"""
+        request = {
+            "mode": "features",
+            "features": {key: np.asarray(value).tolist() for key, value in query_features.items()},
+            "target_type": target_type,
+            "k": k,
+        }
+        now = time.monotonic()
+        live = [index for index in range(len(self.shards)) if self.down_until[index] <= now]
+        futures = {index: self.pool.submit(self._query_shard, index, request) for index in live}
+
+        results = []
+        missing = [index for index in range(len(self.shards)) if index not in futures]
+        for index, future in futures.items():
+            try:
+                results += future.result()
+            except ConnectionError as e:
+                print(f"Error querying shard: {e}")
+                missing.append(index)
+        self.last_missing = sorted(missing)
+        if missing and (self.failure_policy == "strict" or len(missing) == len(self.shards)):
+            raise ConnectionError(f"Shards {self.last_missing} unavailable")
+
+        # While a rebalance is rolled out a track may briefly be served by two shards
+        best = {}
+        for result in results:
+            if result['similarity'] > best.get(result['song_name'], -np.inf):
+                best[result['song_name']] = result['similarity']
+        names = list(best)
+        scores = np.array([best[name] for name in names])
+        return [{'song_name': names[i], 'similarity': float(scores[i])} for i in top_k(scores, k)]
+
+
+def local_addresses(n_shards, host="127.0.0.1", base_port=8801):
+    return [f"{host}:{base_port + index}" for index in range(n_shards)]
+
+
+def serve_all(folder, host="127.0.0.1", base_port=8801):
+    """Start one shard server process per shard file on consecutive ports"""
+    manifest = read_manifest(folder)
+    if manifest is None:
+        raise FileNotFoundError(f"No shards in {folder}, split the catalog first")
+    addresses = local_addresses(manifest["n_shards"], host, base_port)
+    processes = [multiprocessing.Process(target=serve_shard, args=(os.path.join(folder, entry["file"]), address))
+                 for entry, address in zip(manifest["shards"], addresses)]
+    for process in processes:
+        process.start()
+    print(f"Shards: {','.join(addresses)}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the catalog into shards and serve them")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="partition (or rebalance) the catalog into shard files")
+    split.add_argument("--output", default="output", help="folder with the catalog databases")
+    split.add_argument("--shards", type=int, required=True, help="number of shards")
+
+    serve = commands.add_parser("serve", help="serve one shard file")
+    serve.add_argument("shard", help="shard file, e.g. output/shards/shard_000.npz")
+    serve.add_argument("--address", required=True, help="HOST:PORT or unix:PATH")
+
+    serve_local = commands.add_parser("serve-all", help="serve every shard in its own local process")
+    serve_local.add_argument("--output", default="output", help="folder with the catalog databases")
+    serve_local.add_argument("--host", default="127.0.0.1")
+    serve_local.add_argument("--base-port", type=int, default=8801, help="port of the first shard")
+    args = parser.parse_args()
+
+    if args.command == "split":
+        catalog = Catalog(args.output)
+        catalog.load()
+        moved = write_shards(catalog, os.path.join(args.output, SHARD_FOLDER), args.shards)
+        print(f"Split {len(catalog)} tracks into {args.shards} shards ({moved} tracks moved)")
+    elif args.command == "serve":
+        serve_shard(args.shard, args.address)
+    else:
+        serve_all(os.path.join(args.output, SHARD_FOLDER), args.host, args.base_port)
@@ -0,0 +1,100 @@
+import os
+import argparse
+import numpy as np
+from audio_io import AUDIO_EXTENSIONS, load_audio
+
+# Perceptual hash as in imagehash.phash: the spectrogram is reduced to a
+# THUMBNAIL_SIZE square and hashed from its HASH_SIZE² lowest DCT frequencies
+HASH_SIZE = 8
+THUMBNAIL_SIZE = 4 * HASH_SIZE
+# Dynamic range mapped onto the grey levels, as in librosa.power_to_db
+TOP_DB = 80.0
+
+SPECTROGRAM_FOLDER = "spectrograms"
+
+
+def _area_weights(n_in, n_out):
+    """(n_out, n_in) matrix averaging the input cells each output cell covers"""
+    edges = np.linspace(0, n_in, n_out + 1)
+    cells = np.arange(n_in)
+    overlap = np.minimum(cells[None, :] + 1, edges[1:, None]) - np.maximum(cells[None, :], edges[:-1, None])
+    overlap = np.clip(overlap, 0, None)
+    return overlap / overlap.sum(axis=1, keepdims=True)
+
+
+def thumbnail(mel_db, size=THUMBNAIL_SIZE):
+    """
+    Grey-level image (0-255) of a mel spectrogram in dB (mel bins x frames),
+    area-averaged down to size x size with low frequencies at the bottom, as it
+    would be rendered.
+    """
+    mel_db = np.asarray(mel_db, dtype=np.float64)
+    if mel_db.size == 0:
+        return np.zeros((size, size), dtype=np.float32)
+    grey = (np.clip(mel_db - mel_db.max(), -TOP_DB, 0) + TOP_DB) * (255 / TOP_DB)
+    grey = grey[::-1]
+    return (_area_weights(grey.shape[0], size) @ grey @ _area_weights(grey.shape[1], size).T).astype(np.float32)
+
+
+def phashes(thumbnails, hash_size=HASH_SIZE):
+    """
+    Perceptual hashes of a stack of thumbnails (B, S, S) as hex strings, all
+    computed in one DCT pass. Bits are the low-frequency DCT coefficients above
+    their median, in the same order and hex layout as imagehash.
+    """
+    from scipy.fft import dct  # scipy.fft is slow to import; only ingest and spectrogram hashing need it
+    thumbnails = np.asarray(thumbnails, dtype=np.float64)
+    if thumbnails.ndim == 2:
+        thumbnails = thumbnails[None]
+    if len(thumbnails) == 0:
+        return []
+    coefficients = dct(dct(thumbnails, axis=1), axis=2)[:, :hash_size, :hash_size].reshape(len(thumbnails), -1)
+    bits = coefficients > np.median(coefficients, axis=1, keepdims=True)
+    return [row.tobytes().hex() for row in np.packbits(bits, axis=1)]
+
+
+# Function to render a spectrogram PNG for viewing (not needed for hashing)
+def render_png(audio_path, output_path, duration=30):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import librosa
+    import librosa.display
+
+    y, sr = load_audio(audio_path, duration=duration)
+    plt.figure(figsize=(10, 4))
+    S = librosa.feature.melspectrogram(y=y, sr=sr)
+    S_dB = librosa.power_to_db(S, ref=np.max)
+    librosa.display.specshow(S_dB, sr=sr, x_axis='time', y_axis='mel')
+    plt.colorbar(format='%+2.0f dB')
+    plt.title('Mel-frequency spectrogram')
+    plt.tight_layout()
+
+    plt.savefig(output_path)
+    plt.close()
+
+
+def render_folder(input_folder, output_folder, extensions=AUDIO_EXTENSIONS):
+    """Render PNGs of all audio files whose PNG is missing or older than the audio"""
+    os.makedirs(output_folder, exist_ok=True)
+    for file_name in sorted(os.listdir(input_folder)):
+        if not file_name.lower().endswith(extensions):
+            continue
+        audio_path = os.path.join(input_folder, file_name)
+        png_path = os.path.join(output_folder, file_name.rsplit(".", 1)[0] + ".png")
+        if os.path.exists(png_path) and os.path.getmtime(png_path) >= os.path.getmtime(audio_path):
+            continue
+        try:
+            render_png(audio_path, png_path)
+            print(f"Rendered {png_path}")
+        except Exception as e:
+            print(f"Error rendering {file_name}: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render mel spectrogram PNGs of the catalog for viewing")
+    parser.add_argument("--input", default="Music", help="folder with the audio files")
+    parser.add_argument("--output", default=os.path.join("output", SPECTROGRAM_FOLDER), help="folder for the PNGs")
+    args = parser.parse_args()
+
+    render_folder(args.input, args.output)
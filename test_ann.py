@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+import numpy as np
+from ann import IVFPQIndex, build_catalog_index, search_catalog
+from binary_hash import N_BITS, from_hex, hamming_distance, lsh_codes, to_hex
+from scoring import feature_vectors
+
+
+def clustered_catalog(rng, n_tracks=5000, n_clusters=100):
+    """Catalog arrays of tracks spread around song-like clusters, with their LSH codes"""
+    centers = {
+        'mfcc': rng.normal(size=(n_clusters, 20)),
+        'chroma': rng.random((n_clusters, 12)),
+        'spectral_contrast': rng.normal(20, 5, size=(n_clusters, 7)),
+    }
+    labels = rng.integers(n_clusters, size=n_tracks)
+    arrays = {key: (center[labels] + rng.normal(scale=0.3 * center.std(), size=(n_tracks, center.shape[1])))
+              .astype(np.float32) for key, center in centers.items()}
+    arrays['spectral_centroid'] = rng.uniform(500, 4000, size=n_tracks).astype(np.float32)
+    arrays['lsh_codes'] = lsh_codes(feature_vectors(arrays))
+    return SimpleNamespace(names=[f"Song{i:05d}_original.wav" for i in range(n_tracks)], **arrays)
+
+
+def queries_of(catalog, rows, rng, noise=0.05):
+    """Slightly perturbed copies of some catalog tracks, as stacked features"""
+    queries = []
+    for row in rows:
+        features = {key: getattr(catalog, key)[row:row + 1] for key in ('mfcc', 'chroma', 'spectral_contrast',
+                                                                        'spectral_centroid')}
+        queries.append({key: (value * (1 + rng.normal(scale=noise, size=value.shape))).astype(np.float32)
+                        for key, value in features.items()})
+    return queries
+
+
+def test_ivf_pq_recall_against_the_exact_scan():
+    rng = np.random.default_rng(0)
+    catalog = clustered_catalog(rng)
+    index = build_catalog_index(catalog)
+
+    k = 10
+    recalls = []
+    for query in queries_of(catalog, rng.choice(len(catalog.names), 50, replace=False), rng):
+        exact_rows, _ = search_catalog(query, catalog, k=k, exact=True)
+        ann_rows, ann_scores = search_catalog(query, catalog, index=index, k=k)
+        assert np.all(np.diff(ann_scores) <= 0)
+        recalls.append(len(set(exact_rows) & set(ann_rows)) / k)
+    assert np.mean(recalls) >= 0.9
+
+
+def test_ivf_pq_mask_and_save_load(tmp_path):
+    rng = np.random.default_rng(1)
+    catalog = clustered_catalog(rng, n_tracks=2000, n_clusters=40)
+    index = build_catalog_index(catalog)
+    vectors = feature_vectors(vars(catalog))
+
+    mask = np.zeros(len(catalog.names), dtype=bool)
+    mask[::3] = True
+    assert np.all(mask[index.search(vectors[5], 50, mask=mask)])
+
+    path = str(tmp_path / "ann_index.npz")
+    index.save(path)
+    loaded = IVFPQIndex.load(path)
+    assert loaded.checksum == index.checksum
+    np.testing.assert_array_equal(loaded.search(vectors[7], 20), index.search(vectors[7], 20))
+
+
+def test_lsh_hamming_distance_follows_the_angle():
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(3, 39)).astype(np.float32)
+    vectors[1] = vectors[0] + 0.1 * vectors[1]  # near duplicate of the first
+    codes = lsh_codes(vectors)
+    assert codes.shape == (3, N_BITS // 64)
+    np.testing.assert_array_equal(from_hex(to_hex(codes[2])), codes[2])
+
+    distances = hamming_distance(codes[:1], codes)[0]
+    assert distances[0] == 0
+    assert distances[1] < distances[2]
+    # The expected share of differing bits is the angle over pi
+    angle = np.arccos(vectors[0] @ vectors[2] / np.linalg.norm(vectors[0]) / np.linalg.norm(vectors[2]))
+    assert abs(distances[2] / N_BITS - angle / np.pi) < 0.1
@@ -0,0 +1,41 @@
+import numpy as np
+import soundfile as sf
+from audioProcessor import AudioAnalysis, batch_features, extract_features, extract_features_batch
+from benchmark import SR, synthesize_song
+
+
+def write_tracks(folder, durations, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i, duration in enumerate(durations):
+        vocals, music = synthesize_song(rng, duration)
+        path = str(folder / f"Song{i:05d}_original.wav")
+        sf.write(path, 0.6 * (vocals + music), SR, subtype="PCM_16")
+        paths.append(path)
+    return paths
+
+
+def test_batch_of_files_matches_per_file_features(tmp_path):
+    # Two full 30 s windows are stacked together, the short track is a batch of its own
+    paths = write_tracks(tmp_path, [32, 12, 31])
+    assert extract_features_batch(paths) == [extract_features(path) for path in paths]
+
+
+def test_batch_of_signals_matches_per_signal_features():
+    rng = np.random.default_rng(1)
+    signals = [0.6 * sum(synthesize_song(rng, 31)) for _ in range(3)]
+    batched = extract_features_batch(signals, batch_size=2)
+    assert batched == [AudioAnalysis(y, sr=SR).features() for y in signals]
+
+
+def test_batch_of_full_analyses_gives_the_same_summary(tmp_path):
+    paths = write_tracks(tmp_path, [31, 31], seed=2)
+    analyses = [AudioAnalysis.from_file(path) for path in paths]
+    for analysis in analyses:
+        analysis.stft
+    batch_features(analyses)
+    for analysis, path in zip(analyses, paths):
+        batched, single = analysis.summary(), AudioAnalysis.from_file(path).summary()
+        assert batched["features"] == single["features"]
+        assert batched["hash"] == single["hash"]
+        assert np.array_equal(batched["spectrogram"], single["spectrogram"])
@@ -0,0 +1,107 @@
+import os
+import json
+import numpy as np
+import pytest
+import soundfile as sf
+from benchmark import SR, synthesize_song
+from catalog import Catalog
+from ingest import JOURNAL_FILE, LANDMARK_FOLDER, STATE_FILE, Ingest
+
+
+@pytest.fixture
+def music(tmp_path):
+    folder = tmp_path / "Music"
+    folder.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(2):
+        vocals, music = synthesize_song(rng, 6)
+        sf.write(str(folder / f"Song{i:05d}_vocals.wav"), vocals, SR, subtype="PCM_16")
+        sf.write(str(folder / f"Song{i:05d}_music.wav"), music, SR, subtype="PCM_16")
+    return folder
+
+
+def ingest(music, output):
+    run = Ingest(str(music), str(output), workers=1, use_cache=False)
+    run.run()
+    if run.maintenance is not None:
+        run.maintenance.join()
+    return run
+
+
+def catalog_names(output):
+    catalog = Catalog(str(output))
+    catalog.load()
+    return sorted(catalog.names)
+
+
+def test_interrupted_run_resumes_from_the_journal(music, tmp_path, monkeypatch, capsys):
+    output = tmp_path / "output"
+    output.mkdir()
+
+    def crash(self, processed=()):
+        raise KeyboardInterrupt
+
+    # Interrupted after the files were analyzed, before the catalog and state were written
+    monkeypatch.setattr(Ingest, "update_catalog", crash)
+    with pytest.raises(KeyboardInterrupt):
+        ingest(music, output)
+    assert not (output / STATE_FILE).exists()
+    with open(output / JOURNAL_FILE) as f:
+        assert len(f.readlines()) == 4
+    monkeypatch.undo()
+
+    capsys.readouterr()
+    ingest(music, output)
+    assert "4 files, 0 to process, 0 removed" in capsys.readouterr().out
+    assert catalog_names(output) == sorted(os.listdir(music))
+    assert not (output / JOURNAL_FILE).exists()
+
+
+def test_removed_and_changed_files_update_the_catalog(music, tmp_path, capsys):
+    output = tmp_path / "output"
+    output.mkdir()
+    ingest(music, output)
+    assert len(os.listdir(output / LANDMARK_FOLDER)) == 4
+
+    os.remove(music / "Song00001_music.wav")
+    vocals, _ = synthesize_song(np.random.default_rng(1), 6)
+    sf.write(str(music / "Song00000_vocals.wav"), vocals, SR, subtype="PCM_16")
+    capsys.readouterr()
+    run = ingest(music, output)
+    out = capsys.readouterr().out
+    assert "3 files, 1 to process, 1 removed" in out
+    assert "Catalog: 1 tracks added or changed, 1 removed" in out
+    assert catalog_names(output) == sorted(os.listdir(music))
+    # Only the analyses of the current files are kept
+    assert sorted(os.listdir(output / LANDMARK_FOLDER)) == sorted(entry["sha256"] + ".npz"
+                                                                  for entry in run.state.values())
+
+    # Touching a file without changing it is not a change
+    os.utime(music / "Song00000_music.wav", ns=(1, 1))
+    capsys.readouterr()
+    ingest(music, output)
+    assert "3 files, 0 to process, 0 removed" in capsys.readouterr().out
+
+
+def test_failed_files_are_skipped_until_they_change(music, tmp_path, capsys):
+    output = tmp_path / "output"
+    output.mkdir()
+    (music / "bad_music.wav").write_bytes(b"not audio")
+    ingest(music, output)
+    out = capsys.readouterr().out
+    assert "Error processing bad_music.wav: " in out
+    assert "Error processing bad_music.wav: \n" not in out
+    with open(output / STATE_FILE) as f:
+        entry = json.load(f)["bad_music.wav"]
+    assert entry["error"] and entry["sha256"]
+    assert "bad_music.wav" not in catalog_names(output)
+
+    ingest(music, output)
+    assert "5 files, 0 to process, 0 removed" in capsys.readouterr().out
+
+    # Replaced by a readable file: analyzed and added
+    _, music_part = synthesize_song(np.random.default_rng(2), 6)
+    sf.write(str(music / "bad_music.wav"), music_part, SR, subtype="PCM_16")
+    ingest(music, output)
+    assert "5 files, 1 to process, 0 removed" in capsys.readouterr().out
+    assert "bad_music.wav" in catalog_names(output)
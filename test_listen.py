@@ -0,0 +1,57 @@
+import numpy as np
+import librosa
+from benchmark import SR, synthesize_song
+from catalog import song_key
+from fingerprint import LandmarkIndex, landmarks
+from listen import CONFIDENCE_THRESHOLD, IncrementalMatcher, RingBuffer
+
+
+def build_index(songs):
+    """Landmark index of the vocals, music and original tracks of every song"""
+    index = LandmarkIndex()
+    for i, (vocals, music) in enumerate(songs):
+        for kind, y in (("vocals", vocals), ("music", music), ("original", 0.6 * (vocals + music))):
+            index.add(f"Song{i:05d}_{kind}.wav", *landmarks(np.abs(librosa.stft(y, n_fft=2048, hop_length=512))))
+    return index
+
+
+def listen(index, y, block=SR // 4):
+    """Feed a signal to the matcher in microphone-sized blocks"""
+    ring = RingBuffer(len(y))
+    matcher = IncrementalMatcher(index, sr=SR)
+    for start in range(0, len(y), block):
+        ring.write(y[start:start + block])
+        matcher.update(ring)
+    return matcher
+
+
+def test_song_key_ignores_type_words():
+    assert song_key("Song00001_vocals.wav") == song_key("Song00001_music.wav") == song_key("Song00001_original.wav")
+    assert song_key("Adele - Hello (Instrumental).mp3") == song_key("Adele - Hello.mp3")
+    assert song_key("Song00001_vocals.wav") != song_key("Song00002_vocals.wav")
+
+
+def test_stems_of_the_heard_song_do_not_lower_confidence():
+    rng = np.random.default_rng(0)
+    songs = [synthesize_song(rng, 12) for _ in range(3)]
+    index = build_index(songs)
+
+    vocals, _ = songs[1]
+    matcher = listen(index, vocals[2 * SR:10 * SR])
+
+    ranking = matcher.ranking()
+    assert ranking[0][0] == "Song00001_vocals.wav"
+    # The original holds the same vocals: as a rival it would leave too small a margin
+    assert ranking[1][0] == "Song00001_original.wav"
+    assert 1 - ranking[1][1] / ranking[0][1] < CONFIDENCE_THRESHOLD
+    assert matcher.confidence() >= CONFIDENCE_THRESHOLD
+    assert matcher.is_confident()
+
+
+def test_margin_is_taken_over_another_song():
+    index = LandmarkIndex()
+    for name in ("Song00000_original.wav", "Song00000_vocals.wav", "Song00001_original.wav"):
+        index.add(name, [], [])
+    matcher = IncrementalMatcher(index)
+    matcher.tally = {0 << 32 | 5: 100, 1 << 32 | 5: 90, 2 << 32 | 7: 40}
+    assert abs(matcher.confidence() - 0.6) < 1e-9
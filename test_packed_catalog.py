@@ -0,0 +1,58 @@
+import numpy as np
+from catalog import Catalog
+from packed_catalog import PackedCatalog, QuantizedMatrix, convert, packed_path, quantize
+from scoring import combined_similarity, stack_features
+from segments import SEGMENT_FOLDER, SegmentStore
+from test_segments import random_records
+
+
+def build_catalog(folder, n_tracks=60, seed=0):
+    rng = np.random.default_rng(seed)
+    records = random_records(rng, [f"Song{i // 3:05d}_{('original', 'vocals', 'music')[i % 3]}.wav"
+                                   for i in range(n_tracks)])
+    SegmentStore(str(folder / SEGMENT_FOLDER)).update(records)
+    return records
+
+
+def test_quantize_is_within_half_a_step():
+    matrix = np.random.default_rng(0).normal(size=(100, 7)).astype(np.float32)
+    codes, scale, offset = quantize(matrix)
+    assert codes.dtype == np.int8
+    decoded = QuantizedMatrix(codes, scale, offset)
+    assert np.all(np.abs(np.asarray(decoded) - matrix) <= scale / 2 + 1e-6)
+    np.testing.assert_array_equal(decoded[[3, 7]], np.asarray(decoded)[[3, 7]])
+
+
+def test_int8_catalog_ranks_like_the_float_catalog(tmp_path):
+    records = build_catalog(tmp_path)
+    exact = Catalog(str(tmp_path))
+    exact.load(packed=False)
+
+    assert convert(str(tmp_path), quantized=True) == len(records)
+    packed = Catalog(str(tmp_path))
+    packed.load()
+    assert isinstance(packed.mfcc, QuantizedMatrix)
+    assert packed.names == exact.names
+    assert list(packed.types) == list(exact.types)
+    np.testing.assert_array_equal(packed.lsh_codes, exact.lsh_codes)
+    np.testing.assert_array_equal(packed.mel_power, exact.mel_power)
+
+    # Every track is still its own best match, with nearly the same scores
+    queries = stack_features([record['features'] for record in records])
+    exact_scores = combined_similarity(queries, exact)
+    packed_scores = combined_similarity(queries, packed)
+    assert np.array_equal(packed_scores.argmax(axis=1), np.arange(len(records)))
+    assert np.abs(packed_scores - exact_scores).max() < 0.01
+
+
+def test_packed_catalog_is_ignored_once_the_store_changes(tmp_path):
+    build_catalog(tmp_path, n_tracks=6)
+    convert(str(tmp_path))
+    assert len(PackedCatalog(packed_path(str(tmp_path)))) == 6
+
+    rng = np.random.default_rng(1)
+    SegmentStore(str(tmp_path / SEGMENT_FOLDER)).update(random_records(rng, ["New_original.wav"]))
+    catalog = Catalog(str(tmp_path))
+    catalog.load()
+    assert len(catalog) == 7
+    assert isinstance(catalog.mfcc, np.ndarray)
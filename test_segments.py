@@ -0,0 +1,109 @@
+import numpy as np
+from audioProcessor import BLEND_BANDS
+from binary_hash import lsh_codes, to_hex
+from catalog import Catalog
+from scoring import feature_vectors
+from segments import MAX_SEGMENTS, SEGMENT_FOLDER, SegmentStore
+
+
+def random_records(rng, names):
+    """Segment records of random tracks, as ingest writes them"""
+    records = []
+    for name in names:
+        features = {
+            'mfcc': rng.normal(size=20).tolist(),
+            'chroma': rng.random(12).tolist(),
+            'spectral_contrast': rng.normal(20, 5, size=7).tolist(),
+            'spectral_centroid': float(rng.uniform(500, 4000)),
+            'spectral_bandwidth': float(rng.uniform(500, 4000)),
+            'mel_power': rng.random(BLEND_BANDS).tolist(),
+        }
+        code = lsh_codes(feature_vectors({key: np.array([features[key]]) for key in
+                                          ('mfcc', 'chroma', 'spectral_contrast')}))[0]
+        n_landmarks = int(rng.integers(5, 50))
+        records.append({
+            'song_name': name,
+            'sha256': f"{rng.integers(2**63):064x}",
+            'features': features,
+            'hash': {'lsh_hash': to_hex(code)},
+            'landmarks': (rng.integers(2**32, size=n_landmarks, dtype=np.uint32),
+                          np.sort(rng.integers(0, 1000, size=n_landmarks)).astype(np.int32)),
+            'spectrogram': rng.random((32, 32)),
+        })
+    return records
+
+
+def test_tombstones_hide_deleted_and_replaced_tracks(tmp_path):
+    rng = np.random.default_rng(0)
+    store = SegmentStore(str(tmp_path))
+    store.update(random_records(rng, ["a.wav", "b.wav", "c.wav"]))
+    replaced = random_records(rng, ["b.wav"])
+    store.update(replaced, deleted=["c.wav"])
+
+    snapshot = store.snapshot()
+    assert sorted(snapshot.names) == ["a.wav", "b.wav"]
+    row = snapshot.names.index("b.wav")
+    assert snapshot.arrays['sha256'][row] == replaced[0]['sha256']
+    np.testing.assert_allclose(snapshot.arrays['mfcc'][row], replaced[0]['features']['mfcc'], rtol=1e-6)
+
+    # A track added again after its deletion is visible again
+    store.update(random_records(rng, ["c.wav"]))
+    assert sorted(store.snapshot().names) == ["a.wav", "b.wav", "c.wav"]
+
+
+def test_snapshot_is_unchanged_by_later_updates(tmp_path):
+    rng = np.random.default_rng(1)
+    store = SegmentStore(str(tmp_path))
+    store.update(random_records(rng, ["a.wav", "b.wav"]))
+    snapshot = store.snapshot()
+    store.update(random_records(rng, ["d.wav"]), deleted=["a.wav"])
+    assert snapshot.names == ["a.wav", "b.wav"]
+    assert sorted(store.snapshot().names) == ["b.wav", "d.wav"]
+
+
+def test_compaction_keeps_the_live_tracks_and_their_landmarks(tmp_path):
+    rng = np.random.default_rng(2)
+    store = SegmentStore(str(tmp_path))
+    records = {}
+    for i in range(MAX_SEGMENTS + 2):
+        # New originals, replaced vocals and deleted older originals in every update
+        batch = random_records(rng, [f"Song{i:05d}_original.wav", f"Song{i % 3:05d}_vocals.wav"])
+        deleted = [f"Song{i - 2:05d}_original.wav"] if i >= 2 else []
+        store.update(batch, deleted=deleted)
+        records.update((record['song_name'], record) for record in batch)
+        for name in deleted:
+            del records[name]
+    before = store.snapshot()
+    index_before = before.landmark_index()
+
+    assert store.compact() > 1
+    after = SegmentStore(str(tmp_path)).snapshot()
+    assert len(store.read_manifest()["segments"]) <= MAX_SEGMENTS
+    assert sorted(after.names) == sorted(before.names) == sorted(records)
+    for name in after.names:
+        assert after.arrays['sha256'][after.names.index(name)] == records[name]['sha256']
+
+    # Every track still finds itself through the rebuilt landmark index
+    index_after = after.landmark_index()
+    for name in after.names:
+        keys, offsets = records[name]['landmarks']
+        assert index_after.query(keys, offsets, top_n=1)[0][0] == name
+        assert index_before.query(keys, offsets, top_n=1)[0][0] == name
+
+    # A full compaction leaves one segment and no tombstones
+    store.compact(full=True)
+    manifest = store.read_manifest()
+    assert len(manifest["segments"]) == 1 and not manifest["tombstones"]
+    assert sorted(SegmentStore(str(tmp_path)).snapshot().names) == sorted(records)
+
+
+def test_catalog_loads_the_store(tmp_path):
+    rng = np.random.default_rng(3)
+    records = random_records(rng, ["Song00000_vocals.wav", "Song00000_music.wav", "Song00001_original.wav"])
+    SegmentStore(str(tmp_path / SEGMENT_FOLDER)).update(records)
+    catalog = Catalog(str(tmp_path))
+    assert catalog.refresh()
+    assert catalog.names == [record['song_name'] for record in records]
+    assert list(catalog.types) == ['vocals', 'music', 'original']
+    assert catalog.entry_hashes(1) == records[1]['hash']
+    assert not catalog.refresh()
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from segments import SEGMENT_FOLDER, SegmentStore
+from server import IdentificationServer, JsonLinesClient
+from test_segments import random_records
+
+
+@pytest.fixture
+def catalog_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    records = random_records(rng, [f"Song{i // 3:05d}_{('original', 'vocals', 'music')[i % 3]}.wav"
+                                   for i in range(30)])
+    SegmentStore(str(tmp_path / SEGMENT_FOLDER)).update(records)
+    return tmp_path, records
+
+
+def test_failing_query_does_not_fail_its_batch(catalog_folder):
+    folder, records = catalog_folder
+    server = IdentificationServer(str(folder), workers=1)
+    try:
+        good = ("features", {'features': records[4]['features']}, None, 3)
+        typed = ("features", {'features': records[5]['features']}, "music", 2)
+        broken = ("features", {'features': {'mfcc': [1.0, 2.0]}}, None, 3)
+        landmarks = ("landmarks", {'landmarks': records[7]['landmarks']}, None, 1)
+        rankings = server.rank_batch([good, broken, typed, landmarks])
+    finally:
+        server.close()
+
+    assert isinstance(rankings[1], Exception)
+    assert rankings[0][0]['song_name'] == records[4]['song_name'] and len(rankings[0]) == 3
+    assert [result['song_name'] for result in rankings[2]][0] == records[5]['song_name']
+    assert all(result['song_name'].endswith("_music.wav") for result in rankings[2])
+    assert rankings[3][0]['song_name'] == records[7]['song_name']
+
+
+def test_only_the_failing_request_gets_an_error(catalog_folder):
+    folder, records = catalog_folder
+    address = f"unix:{folder / 'server.sock'}"
+    # A long batch window so the concurrent requests are ranked in one batch
+    server = IdentificationServer(str(folder), workers=1, batch_window=0.5)
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve(address)), daemon=True)
+    thread.start()
+    while not (folder / 'server.sock').exists():
+        time.sleep(0.01)
+
+    def request(features):
+        client = JsonLinesClient(address, timeout=10)
+        try:
+            return client.request({"mode": "features", "features": features, "k": 1})
+        except RuntimeError as e:
+            return e
+        finally:
+            client.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            responses = list(pool.map(request, [records[0]['features'], {'mfcc': [1.0]}, records[9]['features']]))
+    finally:
+        server.close()
+
+    assert isinstance(responses[1], RuntimeError)
+    assert responses[0]['results'][0]['song_name'] == records[0]['song_name']
+    assert responses[2]['results'][0]['song_name'] == records[9]['song_name']
+    assert responses[0]['batch_size'] == responses[2]['batch_size'] == 3
+
+
+def test_catalog_is_reloaded_between_batches(catalog_folder):
+    folder, records = catalog_folder
+    server = IdentificationServer(str(folder), workers=1)
+    try:
+        server.rank_batch([("features", {'features': records[0]['features']}, None, 1)])
+        added = random_records(np.random.default_rng(1), ["Added_original.wav"])
+        SegmentStore(str(folder / SEGMENT_FOLDER)).update(added)
+        ranking, = server.rank_batch([("features", {'features': added[0]['features']}, None, 1)])
+    finally:
+        server.close()
+    assert ranking[0]['song_name'] == "Added_original.wav"
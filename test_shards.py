@@ -0,0 +1,57 @@
+import os
+import numpy as np
+from catalog import Catalog
+from segments import SEGMENT_FOLDER, SegmentStore
+from shards import ShardCatalog, read_manifest, shard_file, shard_owner, write_shards
+from test_segments import random_records
+
+
+def test_adding_a_shard_only_moves_the_tracks_it_wins():
+    names = [f"Song{i:05d}_original.wav" for i in range(3000)]
+    before = [shard_owner(name, 4) for name in names]
+    after = [shard_owner(name, 5) for name in names]
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+    assert all(new == 4 for _, new in moved)
+    # About a fifth of the tracks move to the new shard
+    assert abs(len(moved) / len(names) - 1 / 5) < 0.03
+
+    # Removing it again moves exactly those tracks back
+    assert [shard_owner(name, 4) for name in names] == before
+
+
+def test_rebalance_rewrites_the_split(tmp_path):
+    rng = np.random.default_rng(0)
+    names = [f"Song{i // 3:05d}_{('original', 'vocals', 'music')[i % 3]}.wav" for i in range(300)]
+    SegmentStore(str(tmp_path / SEGMENT_FOLDER)).update(random_records(rng, names))
+    catalog = Catalog(str(tmp_path))
+    catalog.load()
+    folder = str(tmp_path / "shards")
+
+    assert write_shards(catalog, folder, 3) == 0
+    shard = ShardCatalog(os.path.join(folder, shard_file(1)))
+    assert shard.refresh()
+    before = set(shard.names)
+
+    moved = write_shards(catalog, folder, 4)
+    assert 0 < moved < len(names) / 2
+    assert read_manifest(folder)["n_shards"] == 4
+
+    # Every track is in exactly one shard, the one its rendezvous hash picks
+    owners = {}
+    for index in range(4):
+        part = ShardCatalog(os.path.join(folder, shard_file(index)))
+        part.refresh()
+        owners.update((name, index) for name in part.names)
+        rows = [catalog.ids[name] for name in part.names]
+        np.testing.assert_array_equal(part.mfcc, catalog.mfcc[rows])
+    assert owners == {name: shard_owner(name, 4) for name in names}
+    assert sum(1 for name in names if shard_owner(name, 3) != owners[name]) == moved
+
+    # A running shard picks up the new split; shards only lose tracks to the new one
+    assert shard.refresh()
+    assert set(shard.names) <= before
+
+    # Shrinking removes the files of the dropped shards
+    write_shards(catalog, folder, 2)
+    assert not os.path.exists(os.path.join(folder, shard_file(2)))
+    assert not os.path.exists(os.path.join(folder, shard_file(3)))
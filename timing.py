@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the stage duration histogram buckets, in seconds
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Trace:
+    """Stage durations of one job (a search, a track load, a mix), in seconds"""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.counts = {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lap = self._start
+        self.total = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, event, n=1):
+        self.counts[event] = self.counts.get(event, 0) + n
+
+    def lap(self, stage):
+        """Record the time since the trace started (or since the previous lap) as a stage"""
+        now = time.perf_counter()
+        self.add(stage, now - self._lap)
+        self._lap = now
+
+    def finish(self):
+        self.total = time.perf_counter() - self._start
+        METRICS.observe_job(self.name, self.total)
+        return self
+
+    def record(self):
+        """JSON-serializable form, with durations in milliseconds"""
+        return {
+            "job": self.name,
+            "timestamp": self.started,
+            "total_ms": round(self.total * 1000, 3) if self.total is not None else None,
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            "counts": self.counts,
+        }
+
+    def summary(self):
+        """One line for the status bar, slowest stages first"""
+        stages = sorted(self.stages.items(), key=lambda item: -item[1])
+        parts = [f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in stages]
+        parts += [f"{event.replace('_', ' ')} {n}" for event, n in self.counts.items()]
+        total = f"{self.total * 1000:.0f} ms" if self.total is not None else "running"
+        return f"{self.name.capitalize()} {total}: " + ", ".join(parts)
+
+
+@contextmanager
+def trace(name):
+    """Collect the spans of this thread into a new Trace until the block ends"""
+    previous = getattr(_local, "trace", None)
+    _local.trace = Trace(name)
+    try:
+        yield _local.trace
+    finally:
+        _local.trace = previous
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def span(stage, trace=None):
+    """
+    Time one pipeline stage. The time spent in nested spans is attributed to
+    them only, so the stages of a trace add up to its work without double counting.
+    """
+    if not hasattr(_local, "children"):
+        _local.children = []
+    _local.children.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        exclusive = elapsed - _local.children.pop()
+        if _local.children:
+            _local.children[-1] += elapsed
+        METRICS.observe_stage(stage, exclusive)
+        target = trace or current_trace()
+        if target is not None:
+            target.add(stage, exclusive)
+
+
+def count(event, n=1, trace=None):
+    """Count an event (e.g. a cache hit) in the current trace"""
+    target = trace or current_trace()
+    if target is not None:
+        target.count(event, n)
+
+
+class Metrics:
+    """Process-wide counters and stage histograms, exportable in the Prometheus text format"""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.stage_counts = {}
+        self.stage_sums = {}
+        self.stage_buckets = {}
+        self.job_counts = {}
+        self.job_sums = {}
+
+    def observe_stage(self, stage, seconds):
+        with self.lock:
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+            self.stage_sums[stage] = self.stage_sums.get(stage, 0.0) + seconds
+            counts = self.stage_buckets.setdefault(stage, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+
+    def observe_job(self, job, seconds):
+        with self.lock:
+            self.job_counts[job] = self.job_counts.get(job, 0) + 1
+            self.job_sums[job] = self.job_sums.get(job, 0.0) + seconds
+
+    def to_prometheus(self):
+        with self.lock:
+            lines = [
+                "# HELP audio_similarity_stage_seconds Time spent in each pipeline stage.",
+                "# TYPE audio_similarity_stage_seconds histogram",
+            ]
+            for stage in sorted(self.stage_counts):
+                for bound, count in zip(self.buckets, self.stage_buckets[stage]):
+                    lines.append(f'audio_similarity_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'audio_similarity_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {self.stage_counts[stage]}')
+                lines.append(f'audio_similarity_stage_seconds_sum{{stage="{stage}"}} {self.stage_sums[stage]:.6f}')
+                lines.append(f'audio_similarity_stage_seconds_count{{stage="{stage}"}} {self.stage_counts[stage]}')
+
+            lines += [
+                "# HELP audio_similarity_jobs_total Finished jobs by kind.",
+                "# TYPE audio_similarity_jobs_total counter",
+            ]
+            lines += [f'audio_similarity_jobs_total{{job="{job}"}} {count}' for job, count in sorted(self.job_counts.items())]
+            lines += [
+                "# HELP audio_similarity_job_seconds_total Wall time of finished jobs by kind.",
+                "# TYPE audio_similarity_job_seconds_total counter",
+            ]
+            lines += [f'audio_similarity_job_seconds_total{{job="{job}"}} {seconds:.6f}'
+                      for job, seconds in sorted(self.job_sums.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics for a node-exporter textfile collector (atomically, it may be scraped any time)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
+
+
+def append_log(path, finished_trace):
+    """Append one trace as a JSON line"""
+    with open(path, "a") as f:
+        f.write(json.dumps(finished_trace.record()) + "\n")
@@ -0,0 +1,20 @@
+import time
+import numpy as np
+
+# Length and level of the warm-up signal (near silence: pure zeros make librosa warn about tuning)
+WARMUP_SECONDS = 1.0
+WARMUP_LEVEL = 1e-4
+
+
+def warm_up(sr=22050):
+    """
+    Run the analysis once on a short, near-silent buffer, so librosa's lazily
+    loaded submodules, numba-compiled kernels and scipy's filters are ready
+    before the first real search. Returns the seconds it took by stage.
+    """
+    start = time.perf_counter()
+    from audioProcessor import AudioAnalysis
+
+    y = (WARMUP_LEVEL * np.random.default_rng(0).standard_normal(int(sr * WARMUP_SECONDS))).astype(np.float32)
+    AudioAnalysis(y, sr=sr).summary()
+    return {"warmup": time.perf_counter() - start}
@@ -0,0 +1,120 @@
+import traceback
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+
+class CancelledError(Exception):
+    """Raised inside a job when a newer job on the same channel replaced it"""
+
+
+class CancelToken:
+    """Cooperative cancellation flag handed to every job, which also reports its partial results"""
+
+    def __init__(self, report=None):
+        self.cancelled = False
+        self._report = report
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        """Call between stages of a job to stop early once it is stale"""
+        if self.cancelled:
+            raise CancelledError()
+
+    def report(self, value):
+        """Send a partial result (e.g. a page of results) to the job's on_partial callback"""
+        if self._report is not None and not self.cancelled:
+            self._report(value)
+
+
+class WorkerSignals(QObject):
+    done = pyqtSignal(object, object, object)  # (job, result, error message)
+    partial = pyqtSignal(object, object)  # (job, partial result), delivered before done
+
+
+class Job(QRunnable):
+    def __init__(self, channel, fn, args, kwargs, on_result, on_error, on_partial=None):
+        super().__init__()
+        self.setAutoDelete(False)  # lifetime is managed by JobRunner
+        self.channel = channel
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.on_error = on_error
+        self.on_partial = on_partial
+        self.signals = WorkerSignals()
+        self.token = CancelToken(self._report)
+
+    def _report(self, value):
+        try:
+            self.signals.partial.emit(self, value)
+        except RuntimeError:
+            pass  # the application shut down while the job was running
+
+    def run(self):
+        result = error = None
+        try:
+            result = self.fn(self.token, *self.args, **self.kwargs)
+        except CancelledError:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            error = str(e)
+        try:
+            self.signals.done.emit(self, result, error)
+        except RuntimeError:
+            pass  # the application shut down while the job was running
+
+
+class JobRunner(QObject):
+    """
+    Run jobs on a QThreadPool and post their results back to the GUI thread.
+    Jobs are grouped in channels: submitting a job cancels the one still running
+    on the same channel, and results of cancelled jobs are dropped.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool.globalInstance()
+        self.current = {}
+        self.jobs = set()
+
+    def submit(self, channel, fn, *args, on_result=None, on_error=None, on_partial=None, **kwargs):
+        """Run fn(token, *args, **kwargs) in the background; token.report(value) calls on_partial(value)"""
+        self.cancel(channel)
+        job = Job(channel, fn, args, kwargs, on_result, on_error, on_partial)
+        # The signals object lives in the GUI thread, so these are queued connections
+        job.signals.partial.connect(self._deliver_partial)
+        job.signals.done.connect(self._deliver)
+        self.current[channel] = job
+        self.jobs.add(job)
+        self.pool.start(job)
+        return job.token
+
+    def cancel(self, channel):
+        job = self.current.pop(channel, None)
+        if job is not None:
+            job.token.cancel()
+
+    def is_busy(self, channel):
+        return channel in self.current
+
+    @pyqtSlot(object, object)
+    def _deliver_partial(self, job, value):
+        if job.token.cancelled or self.current.get(job.channel) is not job:
+            return
+        if job.on_partial is not None:
+            job.on_partial(value)
+
+    @pyqtSlot(object, object, object)
+    def _deliver(self, job, result, error):
+        self.jobs.discard(job)
+        if job.token.cancelled or self.current.get(job.channel) is not job:
+            return
+        del self.current[job.channel]
+        if error is not None:
+            if job.on_error is not None:
+                job.on_error(error)
+        elif job.on_result is not None:
+            job.on_result(result)